@@ -2,76 +2,169 @@ from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
 from math import sin, cos, atan2, radians, sqrt
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+from operator import itemgetter
+import atexit
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
 
 # Global variables
 GRID_LENGTH = 500
+WINDOW_WIDTH = 1000
+WINDOW_HEIGHT = 800
 cam_angle_h = 45
 cam_angle_v = 30
 cam_dist = 4000
 fovY = 60
+CAMERA_ASPECT = WINDOW_WIDTH / WINDOW_HEIGHT
+CAMERA_NEAR = 0.1
+CAMERA_FAR = 30000
 
-# Castle configurations
-castle_configs = [
-    {
-        'position': [-800, -1600, 0],
-        'size': 1600,
-        'height': 800,
-        'roof_z': 600,
-        'tower_radius': 160,
-        'floors': 7,
-        'wall_thickness': 300,
-        'wall_height': 600,
-        'color_scheme': 'reddish'
-    },
-    {
-        'position': [900, 1000, 0],
-        'size': 1600,
-        'height': 1200,
-        'roof_z': 800,
-        'tower_radius': 180,
-        'floors': 12,
-        'wall_thickness': 400,
-        'wall_height': 800,
-        'color_scheme': 'reddish'
-    },
-    {
-        'position': [-3300, 400, 0],
-        'size': 2000,
-        'height': 600,
-        'roof_z': 450,
-        'tower_radius': 120,
-        'floors': 3,
-        'wall_thickness': 300,
-        'wall_height': 450,
-        'color_scheme': 'reddish'
-    }
-]
+# Level of detail tiers: 0 is full detail, LOD_FAR drops stone blocks and small parts.
+# Distances are camera-to-bounds thresholds between consecutive tiers per object kind.
+LOD_FAR = 2
+LOD_DISTANCES = {
+    'castle': (6000, 14000),
+    'perimeter': (6000, 14000),
+    'mountain': (9000, 18000),
+    'vegetation': (5000, 11000)
+}
+LOD_HYSTERESIS = 0.1
+TOWER_LOD_SEGMENTS = [(32, 32), (16, 2), (8, 1)]
+GUARD_TOWER_LOD_SEGMENTS = [(16, 16), (12, 2), (8, 1)]
+GUARD_ROOF_LOD_SEGMENTS = [(12, 12), (10, 2), (6, 1)]
+MOUNTAIN_LOD_SEGMENTS = [(12, 8), (8, 6), (6, 4)]
 
+# Scene contents, filled from the scene file by load_scene at the end of this module
+SCENE_PATH = os.environ.get('CASTLE_SCENE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'scenes', 'default.json'))
+castle_configs = []
 # Central rock tower position
-central_rock_pos = [-1000, 1500, 0]
-player_pos = [central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1630]
+central_rock_pos = [0, 0, 0]
+player_pos = [0, 0, 1630]
 player_speed = 50
 player_angle = 0
 player_turn_speed = 5
 teleport_skip_clamp = False
+window_id = None
+
+# Fixed-timestep scheduler: window input only updates key state, the simulation advances
+# in SIM_DT steps from a GLUT timer, and a redraw is posted only when something changed
+SIM_TICK_RATE = 60
+SIM_DT = 1.0 / SIM_TICK_RATE
+MAX_FRAME_RATE = 60
+MAX_SIM_STEPS_PER_TICK = 5
+HELD_KEY_RATE = 30  # discrete presses per second that holding a key is worth
+HELD_KEYS = {'w', 's', 'a', 'd', 'z', 'x'}
+keys_held = set()
+special_keys_held = set()
+pending_keys = []
+scheduler = {'running': False, 'dirty': True, 'last_time': 0.0, 'accumulator': 0.0, 'last_render': 0.0}
+
+# Scenery props: mountains are (x, y, z, width, height, depth), trees and bushes (x, y)
+mountain_positions = []
+tree_positions = []
+bush_positions = []
+vegetation_clearance = 900
+safe_vegetation = {'key': None, 'trees': [], 'bushes': []}  # see get_safe_vegetation
+perimeter_wall_layout = None  # None: derive one wall around castles 1 and 3 and the rock
+
+# Color schemes are per-channel gains on a base color; channels with a gain above 1 are
+# clamped to 1. register_color_scheme adds or changes schemes at runtime.
+COLOR_SCHEMES = {'normal': (1.0, 1.0, 1.0), 'reddish': (1.2, 0.8, 0.8)}
+
+# Palette: every (scheme, base color) pair in use gets an index the first time it is asked
+# for. 'colors' holds the scheme-applied colors, 'shades' the cube face colors (front, top,
+# side, back) as tuples for glColor3f. Scheme None is the base color unchanged.
+PALETTE_FACE_SHADES = np.array([1.0, 1.3, 0.7, 0.5])
+palette = {'index': {}, 'keys': [], 'colors': np.empty((64, 3)), 'shades': []}
+palette_lock = threading.Lock()
+
+def scheme_color(scheme_name, base_color):
+    """base_color with a scheme's gains applied; unknown schemes leave it unchanged"""
+    base_color = np.asarray(base_color, dtype=np.float64)
+    gains = np.asarray(COLOR_SCHEMES.get(scheme_name, (1.0, 1.0, 1.0)) if scheme_name else (1.0, 1.0, 1.0))
+    color = base_color * gains
+    return np.where(gains > 1.0, np.minimum(1.0, color), color)
+
+def face_shades(color):
+    """Front, top, side and back colors of a shaded cube, as in draw_cube_manual_shading"""
+    shades = color[None, :] * PALETTE_FACE_SHADES[:, None]
+    shades[1] = np.minimum(1.0, shades[1])
+    return tuple(tuple(shade) for shade in shades.tolist())
+
+def palette_index(scheme_name, base_color):
+    """Palette index of a base color under a scheme, adding it on first use"""
+    key = (scheme_name, tuple(base_color))
+    index = palette['index'].get(key)
+    if index is not None:
+        return index
+    with palette_lock:
+        index = palette['index'].get(key)
+        if index is None:
+            index = len(palette['keys'])
+            if index == len(palette['colors']):
+                grown = np.empty((2 * index, 3))
+                grown[:index] = palette['colors'][:index]
+                palette['colors'] = grown
+            palette['colors'][index] = scheme_color(scheme_name, key[1])
+            palette['shades'].append(face_shades(palette['colors'][index]))
+            palette['keys'].append(key)
+            palette['index'][key] = index
+    return index
+
+def palette_indices(scheme_name, base_colors):
+    """palette_index for every row of an (N, 3) array of base colors"""
+    base_colors = np.asarray(base_colors, dtype=np.float64).reshape(-1, 3)
+    rows, inverse = np.unique(base_colors, axis=0, return_inverse=True)
+    return np.array([palette_index(scheme_name, row) for row in rows.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+
+def palette_color(index):
+    """(r, g, b) of a palette entry"""
+    return palette['shades'][index][0]
 
 def get_color_scheme(scheme_name, base_color):
     """Get color based on scheme"""
-    if scheme_name == 'reddish':
-        return [min(1.0, base_color[0] * 1.2), base_color[1] * 0.8, base_color[2] * 0.8]
-    else:
-        return base_color
+    return palette_color(palette_index(scheme_name, base_color))
 
-def draw_cube_manual_shading(x, y, z, dx, dy, dz, base_color):
-    """Draw cube with manual face shading"""
+def register_color_scheme(name, gains):
+    """Add or redefine a color scheme; only geometry drawn with it is rebuilt"""
+    if not isinstance(name, str) or not name:
+        raise ValueError(f"Color scheme name must be a non-empty string, got {name!r}")
+    gains = tuple(float(g) for g in gains)
+    if len(gains) != 3 or min(gains) < 0:
+        raise ValueError(f"Color scheme '{name}' needs three non-negative gains, got {gains}")
+    if COLOR_SCHEMES.get(name) == gains:
+        return
+    
+    COLOR_SCHEMES[name] = gains
+    with palette_lock:
+        for index, (scheme_name, base_color) in enumerate(palette['keys']):
+            if scheme_name == name:
+                palette['colors'][index] = scheme_color(name, base_color)
+                palette['shades'][index] = face_shades(palette['colors'][index])
+    invalidate_color_scheme(name)
+
+def draw_cube_manual_shading(x, y, z, dx, dy, dz, color):
+    """Draw cube with manual face shading; color is a palette index or an RGB base color"""
     glPushMatrix()
     glTranslatef(x, y, z)
     
     # Face colors with different brightness
-    top_color = [min(1.0, c * 1.3) for c in base_color]
-    front_color = base_color
-    side_color = [c * 0.7 for c in base_color]
-    back_color = [c * 0.5 for c in base_color]
+    if not isinstance(color, (int, np.integer)):
+        color = palette_index(None, color)
+    front_color, top_color, side_color, back_color = palette['shades'][color]
     
     glBegin(GL_QUADS)
     # Top face (brightest)
@@ -119,30 +212,284 @@ def draw_cube_manual_shading(x, y, z, dx, dy, dz, base_color):
     
     glPopMatrix()
 
-def draw_human(x, y, z, scale=80):
-    """Draw a humanoid figure with blue torso, skin-colored limbs, and arms pointing forward."""
-    global player_angle
+# Cube layout matching draw_cube_manual_shading: face corners as +/- half-extent signs
+# (top, front, right, left, back, bottom) and the brightness factor of each face
+CUBE_FACE_CORNERS = np.array([
+    [[-1, 1, -1], [-1, 1, 1], [1, 1, 1], [1, 1, -1]],
+    [[-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]],
+    [[1, -1, -1], [1, 1, -1], [1, 1, 1], [1, -1, 1]],
+    [[-1, -1, -1], [-1, -1, 1], [-1, 1, 1], [-1, 1, -1]],
+    [[-1, -1, -1], [-1, 1, -1], [1, 1, -1], [1, -1, -1]],
+    [[-1, -1, -1], [1, -1, -1], [1, -1, 1], [-1, -1, 1]]
+], dtype=np.float64).reshape(24, 3) * 0.5
+CUBE_FACE_SHADES = np.repeat([1.3, 1.0, 0.7, 0.7, 0.5, 0.7], 4)
+
+def get_color_scheme_array(scheme_name, base_colors):
+    """Vectorized get_color_scheme for an (N, 3) array of colors"""
+    return palette['colors'][palette_indices(scheme_name, base_colors)]
+
+# Angle tables: every circle, arc and spiral reads cos/sin from arrays computed once per shape
+angle_tables = {}
+ROTATION_TABLE_LIMIT = 4096
+rotation_table = {}
+
+def memoized_table(key, build):
+    """Read-only arrays for key, built on first use"""
+    table = angle_tables.get(key)
+    if table is None:
+        table = tuple(build())
+        for array in table:
+            array.flags.writeable = False
+        table = angle_tables.setdefault(key, table)
+    return table
+
+def angle_table(start, stop, step):
+    """Degrees in [start, stop) every step, with their cos and sin"""
+    def build():
+        degrees = np.arange(start, stop, step)
+        rad = np.radians(degrees)
+        return degrees, np.cos(rad), np.sin(rad)
+    return memoized_table(('range', start, stop, step), build)
+
+def unit_circle(segments):
+    """cos/sin of segments + 1 evenly spaced angles, first and last both at 0 degrees"""
+    def build():
+        theta = 2 * np.pi * np.arange(segments + 1) / segments
+        theta[-1] = 0.0
+        return np.cos(theta), np.sin(theta)
+    return memoized_table(('circle', segments), build)
+
+def spiral_table(steps, angle_per_step):
+    """Step index, degrees, cos and sin for a spiral turning angle_per_step each step"""
+    def build():
+        i = np.arange(steps)
+        degrees = angle_per_step * i
+        rad = np.radians(degrees)
+        return i, degrees, np.cos(rad), np.sin(rad)
+    return memoized_table(('spiral', steps, angle_per_step), build)
+
+def sag_table(segments):
+    """Curve parameter t and the parabolic sag weight 4t(1 - t) for a rope"""
+    def build():
+        t = np.arange(segments + 1) / segments
+        return t, 4 * t * (1 - t)
+    return memoized_table(('sag', segments), build)
+
+def ring_points(x, y, z, radius, cos_table, sin_table):
+    """(N, 3) points on a horizontal ring around (x, y) at height z"""
+    return np.column_stack((
+        x + radius * cos_table,
+        y + radius * sin_table,
+        np.full(len(cos_table), z, dtype=np.float64)
+    ))
+
+def fan_arc_triangles(radius, segments, skip_start=None, skip_end=None):
+    """GL_TRIANGLES for a disc of segments wedges around the origin, dropping wedges
+    whose start angle lies in [skip_start, skip_end]"""
+    def build():
+        cos_t, sin_t = unit_circle(segments)
+        start = 360 / segments * np.arange(segments)
+        keep = np.ones(segments, dtype=bool)
+        if skip_start is not None:
+            keep = ~((skip_start <= start) & (start <= skip_end))
+        rim = np.column_stack((radius * cos_t, radius * sin_t, np.zeros(segments + 1)))
+        wedges = np.nonzero(keep)[0]
+        triangles = np.zeros((len(wedges), 3, 3), dtype=np.float32)
+        triangles[:, 1] = rim[wedges]
+        triangles[:, 2] = rim[wedges + 1]
+        return (triangles.reshape(-1, 3),)
+    return memoized_table(('fan', radius, segments, skip_start, skip_end), build)[0]
+
+def rotation_cos_sin(angle):
+    """cos/sin of a rotation angle in degrees, cached per angle for wall_block_layout"""
+    angle = float(angle)
+    entry = rotation_table.get(angle)
+    if entry is None:
+        if len(rotation_table) >= ROTATION_TABLE_LIMIT:
+            rotation_table.clear()
+        rad = radians(angle)
+        entry = rotation_table[angle] = (cos(rad), sin(rad))
+    return entry
+
+# Packed per-instance layout: x, y, z, sx, sy, sz, angle (degrees about Z), r, g, b
+INSTANCE_STRIDE = 10
+
+def make_template(name, vertices, colors, mode):
+    """Template mesh in local space; instance colors multiply the template colors"""
+    return {
+        'name': name,
+        'vertices': np.asarray(vertices, dtype=np.float64).reshape(-1, 3),
+        'colors': np.asarray(colors, dtype=np.float64).reshape(-1, 3),
+        'mode': mode
+    }
+
+CUBE_TEMPLATE = make_template('cube', CUBE_FACE_CORNERS, np.repeat(CUBE_FACE_SHADES[:, None], 3, axis=1), GL_QUADS)
+
+def pack_instances(positions, sizes, angles, colors):
+    """Pack per-instance transforms and colors into an (N, INSTANCE_STRIDE) array
+    
+    sizes, angles and colors may be per-instance arrays or shared values.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    instances = np.empty((len(positions), INSTANCE_STRIDE))
+    instances[:, 0:3] = positions
+    instances[:, 3:6] = sizes
+    instances[:, 6] = angles
+    instances[:, 7:10] = colors
+    return instances
+
+def expand_instances(template, instances):
+    """Transform the template once per instance into world-space vertex/color arrays"""
+    instances = np.asarray(instances, dtype=np.float64).reshape(-1, INSTANCE_STRIDE)
+    rad = np.radians(instances[:, 6])
+    cos_a, sin_a = np.cos(rad)[:, None], np.sin(rad)[:, None]
+    
+    local = template['vertices'][None, :, :] * instances[:, None, 3:6]
+    vertices = np.empty_like(local)
+    vertices[:, :, 0] = instances[:, 0:1] + local[:, :, 0] * cos_a - local[:, :, 1] * sin_a
+    vertices[:, :, 1] = instances[:, 1:2] + local[:, :, 0] * sin_a + local[:, :, 1] * cos_a
+    vertices[:, :, 2] = instances[:, 2:3] + local[:, :, 2]
+    
+    colors = np.minimum(1.0, template['colors'][None, :, :] * instances[:, None, 7:10])
+    return (vertices.reshape(-1, 3).astype(np.float32),
+            colors.reshape(-1, 3).astype(np.float32))
+
+def build_cube_mesh(centers, sizes, angles, base_colors):
+    """Build GL_QUADS vertex/color arrays for many shaded cubes in one pass
+    
+    centers, sizes and base_colors are (N, 3) arrays, angles is (N,) in degrees
+    (rotation about Z, applied like glRotatef inside draw_cube_manual_shading).
+    """
+    return expand_instances(CUBE_TEMPLATE, pack_instances(centers, sizes, angles, base_colors))
+
+# Instances queued by the draw functions, drawn with one call per template
+instance_queues = threading.local()
+
+def get_instance_queue():
+    """This thread's instance queue, so a background bake never mixes with frame drawing"""
+    queue = getattr(instance_queues, 'queue', None)
+    if queue is None:
+        queue = instance_queues.queue = {}
+    return queue
+
+def queue_instances(template, instances):
+    """Add packed instances to the family for this template"""
+    if len(instances) == 0:
+        return
+    instance_queue = get_instance_queue()
+    if template['name'] not in instance_queue:
+        instance_queue[template['name']] = (template, [])
+    instance_queue[template['name']][1].append(instances)
+
+def queue_cubes(positions, sizes, angles, colors):
+    """Queue shaded cubes (world space) for the next flush_instances"""
+    queue_instances(CUBE_TEMPLATE, pack_instances(positions, sizes, angles, colors))
+
+def flush_instances():
+    """Draw every queued family with a single array draw each"""
+    instance_queue = get_instance_queue()
+    for template, chunks in instance_queue.values():
+        vertices, colors = expand_instances(template, np.concatenate(chunks))
+        draw_mesh_arrays(vertices, colors, template['mode'])
+    instance_queue.clear()
+
+def draw_mesh_arrays(vertices, colors, mode=GL_QUADS):
+    """Submit a whole vertex/color array with a single draw call"""
+    if len(vertices) == 0:
+        return
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, vertices)
+    glColorPointer(3, GL_FLOAT, 0, colors)
+    glDrawArrays(mode, 0, len(vertices))
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+def draw_vertex_array(vertices, mode=GL_TRIANGLES):
+    """Submit a vertex array drawn in the current color"""
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, vertices)
+    glDrawArrays(mode, 0, len(vertices))
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+def wall_block_layout(x1, y1, x2, y2, offset_z, height, block_width, block_height, gap):
+    """Centers, rows, cols and angle of the staggered stone blocks along a wall"""
+    length = ((x2 - x1)**2 + (y2 - y1)**2) ** 0.5
+    angle = atan2(y2 - y1, x2 - x1) * 180 / 3.14159
+    blocks_x = int(length / (block_width + gap))
+    blocks_z = int(height / (block_height + gap))
+    midx, midy = (x1 + x2) / 2, (y1 + y2) / 2
+    
+    rows, cols = np.meshgrid(np.arange(blocks_z), np.arange(blocks_x), indexing='ij')
+    rows, cols = rows.ravel(), cols.ravel()
+    offset = np.where(rows % 2 == 1, (block_width + gap) / 2, 0)
+    block_x_local = -length/2 + cols * (block_width + gap) + block_width/2 + offset
+    block_z_local = rows * (block_height + gap) + block_height/2
+    
+    keep = np.abs(block_x_local) <= length/2 - block_width/2
+    rows, cols, block_x_local, block_z_local = rows[keep], cols[keep], block_x_local[keep], block_z_local[keep]
+    
+    cos_a, sin_a = rotation_cos_sin(angle)
+    centers = np.column_stack((
+        midx + block_x_local * cos_a,
+        midy + block_x_local * sin_a,
+        offset_z + block_z_local + 15
+    ))
+    return centers, rows, cols, angle
+
+def build_stone_blocks_mesh(x1, y1, x2, y2, offset_z, thickness, height, color_scheme='normal'):
+    """Vertex/color arrays for every castle wall stone block"""
+    block_width, block_height, gap = 200, 100, 20
+    centers, rows, cols, angle = wall_block_layout(x1, y1, x2, y2, offset_z, height, block_width, block_height, gap)
+    
+    variation = 0.12 * ((rows + cols) % 5 - 2) / 2
+    stone_colors = np.clip(np.array([0.85, 0.40, 0.35])[None, :] + variation[:, None], 0.0, 1.0)
+    final_colors = get_color_scheme_array(color_scheme, stone_colors)
+    
+    sizes = np.broadcast_to([block_width, thickness + 5, block_height], centers.shape)
+    return build_cube_mesh(centers, sizes, angle, final_colors)
+
+def build_perimeter_stone_blocks_mesh(x1, y1, x2, y2, offset_z, thickness, height):
+    """Vertex/color arrays for every perimeter wall stone block"""
+    block_width, block_height, gap = 150, 80, 15
+    centers, rows, cols, angle = wall_block_layout(x1, y1, x2, y2, offset_z, height, block_width, block_height, gap)
+    
+    variation = 0.1 * ((rows + cols) % 4 - 2) / 2
+    block_colors = np.clip(np.array([0.75, 0.75, 0.65])[None, :] + variation[:, None], 0.0, 1.0)
+    
+    sizes = np.broadcast_to([block_width, thickness + 5, block_height], centers.shape)
+    return build_cube_mesh(centers, sizes, angle, block_colors)
+
+# (head slices, head stacks, limb slices, limb stacks) per LOD tier of draw_human
+HUMAN_LOD_SEGMENTS = [(16, 16, 8, 8), (8, 6, 6, 2), (5, 3, 4, 1)]
+HUMAN_TORSO_COLOR = (0.2, 0.4, 1.0)
+
+def draw_human(x, y, z, scale=80, angle=None, lod=0, torso_color=HUMAN_TORSO_COLOR):
+    """Draw a humanoid figure with blue torso, skin-colored limbs, and arms pointing forward.
+    
+    angle defaults to player_angle; lod picks a row of HUMAN_LOD_SEGMENTS.
+    """
+    head_slices, head_stacks, limb_slices, limb_stacks = HUMAN_LOD_SEGMENTS[lod]
     
-    quad = gluNewQuadric()
     glPushMatrix()
     
     # Move to human position
     glTranslatef(x, y, z)
     
     # Rotate human to face player_angle
-    glRotatef(player_angle, 0, 0, 1)
+    glRotatef(player_angle if angle is None else angle, 0, 0, 1)
     
     # Scale human
     glScalef(scale/100, scale/100, scale/100)
     
     # Torso (blue shirt)
-    draw_cube_manual_shading(0, 0, 120, 80, 40, 150, [0.2, 0.4, 1.0])
+    draw_cube_manual_shading(0, 0, 120, 80, 40, 150, torso_color)
     
     # Head (skin color)
     glPushMatrix()
     glTranslatef(0, 0, 250)
     glColor3f(1.0, 0.8, 0.6)
-    gluSphere(quad, 50, 16, 16)
+    draw_sphere(50, head_slices, head_stacks)
     glPopMatrix()
     
     # Arms (skin color) - pointing forward
@@ -154,14 +501,14 @@ def draw_human(x, y, z, scale=80):
     glPushMatrix()
     glTranslatef(60, 0, 180)
     glRotatef(-90, 1, 0, 0)
-    gluCylinder(quad, arm_radius, arm_radius, arm_length, 8, 8)
+    draw_cylinder(arm_radius, arm_radius, arm_length, limb_slices, limb_stacks)
     glPopMatrix()
     
     # Left arm
     glPushMatrix()
     glTranslatef(-60, 0, 180)
     glRotatef(-90, 1, 0, 0)
-    gluCylinder(quad, arm_radius, arm_radius, arm_length, 8, 8)
+    draw_cylinder(arm_radius, arm_radius, arm_length, limb_slices, limb_stacks)
     glPopMatrix()
     
     # Legs (skin color)
@@ -172,22 +519,27 @@ def draw_human(x, y, z, scale=80):
     # Right leg
     glPushMatrix()
     glTranslatef(25, 0, 0)
-    gluCylinder(quad, leg_radius, leg_radius, leg_length, 8, 8)
+    draw_cylinder(leg_radius, leg_radius, leg_length, limb_slices, limb_stacks)
     glPopMatrix()
     
     # Left leg
     glPushMatrix()
     glTranslatef(-25, 0, 0)
-    gluCylinder(quad, leg_radius, leg_radius, leg_length, 8, 8)
+    draw_cylinder(leg_radius, leg_radius, leg_length, limb_slices, limb_stacks)
     glPopMatrix()
     
     glPopMatrix()
 
-def draw_perimeter_wall():
-    """Draw perimeter wall around all buildings except the biggest castle"""
-    wall_thickness = 200
-    wall_height = 400
-    wall_color = [0.7, 0.7, 0.6]
+PERIMETER_WALL_THICKNESS = 200
+PERIMETER_WALL_HEIGHT = 400
+
+def get_perimeter_wall_segments():
+    """Wall segments (x1, y1, x2, y2) around all buildings except the biggest castle
+    
+    A scene can list its own segments instead (perimeter_wall_layout).
+    """
+    if perimeter_wall_layout is not None:
+        return [tuple(segment) for segment in perimeter_wall_layout]
     
     # Calculate bounding box for buildings to encapsulate (excluding biggest castle)
     buildings_to_encapsulate = [
@@ -203,25 +555,26 @@ def draw_perimeter_wall():
     max_y = max([pos['position'][1] + pos['size']/2 for pos in buildings_to_encapsulate]) + 500
     
     # Define wall segments (rectangular perimeter)
-    wall_segments = [
+    return [
         (min_x, max_y, max_x, max_y),  # North wall
         (max_x, max_y, max_x, min_y),  # East wall
         (max_x, min_y, min_x, min_y),  # South wall
         (min_x, min_y, min_x, max_y)   # West wall
     ]
-    
-    for x1, y1, x2, y2 in wall_segments:
-        draw_wall_segment(x1, y1, x2, y2, 0, wall_thickness, wall_height, wall_color)
-        draw_perimeter_stone_blocks(x1, y1, x2, y2, 0, wall_thickness, wall_height)
-    
-    # Draw guard towers at corners
-    corners = set()
-    for x1, y1, x2, y2 in wall_segments:
-        corners.add((x1, y1))
-        corners.add((x2, y2))
-    
-    for corner_x, corner_y in corners:
-        draw_guard_tower(corner_x, corner_y, wall_height)
+
+def draw_perimeter_wall_segment(x1, y1, x2, y2, lod=0):
+    """Draw one perimeter wall segment with the guard tower at its start corner"""
+    wall_color = [0.7, 0.7, 0.6]
+    draw_wall_segment(x1, y1, x2, y2, 0, PERIMETER_WALL_THICKNESS, PERIMETER_WALL_HEIGHT, wall_color)
+    if lod < LOD_FAR:
+        draw_perimeter_stone_blocks(x1, y1, x2, y2, 0, PERIMETER_WALL_THICKNESS, PERIMETER_WALL_HEIGHT)
+    draw_guard_tower(x1, y1, PERIMETER_WALL_HEIGHT, lod)
+
+def draw_perimeter_wall():
+    """Draw perimeter wall around all buildings except the biggest castle"""
+    # The segments form a closed loop, so every corner starts exactly one segment
+    for x1, y1, x2, y2 in get_perimeter_wall_segments():
+        draw_perimeter_wall_segment(x1, y1, x2, y2)
 
 def draw_wall_segment(x1, y1, x2, y2, offset_z, thickness, height, color):
     """Draw a single wall segment"""
@@ -237,90 +590,58 @@ def draw_wall_segment(x1, y1, x2, y2, offset_z, thickness, height, color):
     glPopMatrix()
 
 def draw_perimeter_stone_blocks(x1, y1, x2, y2, offset_z, thickness, height):
-    """Draw stone blocks on perimeter walls"""
-    length = ((x2 - x1)**2 + (y2 - y1)**2) ** 0.5
-    angle = atan2(y2 - y1, x2 - x1) * 180 / 3.14159
-    block_width, block_height, gap = 150, 80, 15
-    blocks_x = int(length / (block_width + gap))
-    blocks_z = int(height / (block_height + gap))
-    midx, midy = (x1 + x2) / 2, (y1 + y2) / 2
-    
-    for row in range(blocks_z):
-        for col in range(blocks_x):
-            offset = (block_width + gap) / 2 if (row % 2 == 1) else 0
-            block_x_local = -length/2 + col * (block_width + gap) + block_width/2 + offset
-            block_z_local = row * (block_height + gap) + block_height/2
-            
-            if abs(block_x_local) > length/2 - block_width/2:
-                continue
-            
-            cos_a, sin_a = cos(radians(angle)), sin(radians(angle))
-            world_x = midx + block_x_local * cos_a
-            world_y = midy + block_x_local * sin_a
-            world_z = offset_z + block_z_local + 15
-            
-            # Color variation for perimeter wall blocks
-            base_r, base_g, base_b = 0.75, 0.75, 0.65
-            variation = 0.1 * ((row + col) % 4 - 2) / 2
-            block_color = [
-                min(max(base_r + variation, 0.0), 1.0),
-                min(max(base_g + variation, 0.0), 1.0),
-                min(max(base_b + variation, 0.0), 1.0)
-            ]
-            
-            glPushMatrix()
-            glTranslatef(world_x, world_y, world_z)
-            glRotatef(angle, 0, 0, 1)
-            draw_cube_manual_shading(0, 0, 0, block_width, thickness + 5, block_height, block_color)
-            glPopMatrix()
+    """Draw stone blocks on perimeter walls as one vertex array"""
+    vertices, colors = build_perimeter_stone_blocks_mesh(x1, y1, x2, y2, offset_z, thickness, height)
+    draw_mesh_arrays(vertices, colors)
 
-def draw_guard_tower(x, y, wall_height):
+def draw_guard_tower(x, y, wall_height, lod=0):
     """Draw guard towers at wall corners"""
     tower_radius = 60
     tower_height = wall_height + 200
     tower_color = [0.6, 0.6, 0.55]
     
-    quad = gluNewQuadric()
     glPushMatrix()
     glTranslatef(x, y, 0)
     glColor3f(tower_color[0], tower_color[1], tower_color[2])
-    gluCylinder(quad, tower_radius, tower_radius, tower_height, 16, 16)
+    draw_cylinder(tower_radius, tower_radius, tower_height, *GUARD_TOWER_LOD_SEGMENTS[lod])
     
     # Tower roof
     glTranslatef(0, 0, tower_height)
     roof_color = [0.8, 0.3, 0.2]
     glColor3f(roof_color[0], roof_color[1], roof_color[2])
-    gluCylinder(quad, tower_radius + 10, 5, tower_radius, 12, 12)
+    draw_cylinder(tower_radius + 10, 5, tower_radius, *GUARD_ROOF_LOD_SEGMENTS[lod])
     glPopMatrix()
     
+    if lod >= LOD_FAR:
+        return
+    
     # Battlements around tower top
     battlement_color = [0.5, 0.5, 0.45]
-    for angle in range(0, 360, 30):
-        rad = radians(angle)
-        bx = x + (tower_radius + 15) * cos(rad)
-        by = y + (tower_radius + 15) * sin(rad)
-        draw_cube_manual_shading(bx, by, wall_height + 150, 20, 20, 50, battlement_color)
+    _, cos_t, sin_t = angle_table(0, 360, 30)
+    positions = ring_points(x, y, wall_height + 150, tower_radius + 15, cos_t, sin_t)
+    queue_cubes(positions, [20, 20, 50], 0, battlement_color)
 
-def draw_rope(start_pos, end_pos, segments=20):
-    """Draw a rope between two points with sagging effect"""
+ROPE_SEGMENTS = 20
+
+def rope_curve(start_pos, end_pos, segments=ROPE_SEGMENTS):
+    """Points of a rope hanging between two points with the static parabolic sag"""
     x1, y1, z1 = start_pos
     x2, y2, z2 = end_pos
-    glColor3f(0.4, 0.3, 0.2)
-    glLineWidth(3.0)
-    
     distance = sqrt((x2-x1)**2 + (y2-y1)**2 + (z2-z1)**2)
     sag_factor = min(100, distance * 0.1)
     
-    glBegin(GL_LINE_STRIP)
-    for i in range(segments + 1):
-        t = i / segments
-        x = x1 + t * (x2 - x1)
-        y = y1 + t * (y2 - y1)
-        z = z1 + t * (z2 - z1)
-        sag = sag_factor * (4 * t * (1 - t))
-        z -= sag
-        glVertex3f(x, y, z)
-    glEnd()
+    t, sag = sag_table(segments)
+    return np.column_stack((
+        x1 + t * (x2 - x1),
+        y1 + t * (y2 - y1),
+        z1 + t * (z2 - z1) - sag_factor * sag
+    )).astype(np.float32)
+
+def draw_rope(start_pos, end_pos, segments=ROPE_SEGMENTS):
+    """Draw a rope between two points with sagging effect"""
+    glColor3f(0.4, 0.3, 0.2)
+    glLineWidth(3.0)
+    draw_vertex_array(rope_curve(start_pos, end_pos, segments), GL_LINE_STRIP)
     glLineWidth(1.0)
 
 def draw_rope_support_bar(x, y, z, height=200):
@@ -328,20 +649,19 @@ def draw_rope_support_bar(x, y, z, height=200):
     glColor3f(0.3, 0.3, 0.3)
     bar_radius = 8
     
-    quad = gluNewQuadric()
     glPushMatrix()
     glTranslatef(x, y, z)
-    gluCylinder(quad, bar_radius, bar_radius, height, 16, 16)
+    draw_cylinder(bar_radius, bar_radius, height, 16, 16)
     
     glTranslatef(0, 0, height)
-    gluDisk(quad, 0, bar_radius, 16, 1)
+    draw_disk(0, bar_radius, 16, 1)
     
     glTranslatef(0, 0, 5)
     glRotatef(90, 0, 1, 0)
-    gluCylinder(quad, 5, 5, 30, 8, 8)
+    draw_cylinder(5, 5, 30, 8, 8)
     glPopMatrix()
 
-def draw_platform_with_gap(x, y, z, radius, gap_angle_start=0, gap_angle_end=45, color_scheme='normal'):
+def draw_platform_with_gap(x, y, z, radius, gap_angle_start=0, gap_angle_end=45, color_scheme='normal', lod=0):
     """Draw circular platform with a gap for stairs"""
     platform_thickness = 20
     base_color = [0.7, 0.7, 0.65]
@@ -351,39 +671,24 @@ def draw_platform_with_gap(x, y, z, radius, gap_angle_start=0, gap_angle_end=45,
     glTranslatef(x, y, z + platform_thickness/2)
     glColor3f(platform_color[0], platform_color[1], platform_color[2])
     
-    segments = 36
-    segment_angle = 360 / segments
-    for i in range(segments):
-        current_angle = i * segment_angle
-        next_angle = (i + 1) * segment_angle
-        
-        if not (gap_angle_start <= current_angle <= gap_angle_end):
-            glBegin(GL_TRIANGLES)
-            glVertex3f(0, 0, 0)
-            rad1 = radians(current_angle)
-            glVertex3f(radius * cos(rad1), radius * sin(rad1), 0)
-            rad2 = radians(next_angle)
-            glVertex3f(radius * cos(rad2), radius * sin(rad2), 0)
-            glEnd()
-    
+    draw_vertex_array(fan_arc_triangles(radius, 36, gap_angle_start, gap_angle_end))
     glPopMatrix()
     
+    if lod >= LOD_FAR:
+        return
+    
     # Add battlements around platform
     battlement_base = [0.55, 0.55, 0.55]
     battlement_color = get_color_scheme(color_scheme, battlement_base)
     battlement_z = z + platform_thickness
     
-    for angle in range(0, 360, 20):
-        if not (gap_angle_start <= angle <= gap_angle_end):
-            rad = radians(angle)
-            bx = x + (radius + 25) * cos(rad)
-            by = y + (radius + 25) * sin(rad)
-            draw_cube_manual_shading(bx, by, battlement_z + 30, 35, 35, 80, battlement_color)
+    angles, cos_t, sin_t = angle_table(0, 360, 20)
+    keep = ~((gap_angle_start <= angles) & (angles <= gap_angle_end))
+    positions = ring_points(x, y, battlement_z + 30, radius + 25, cos_t[keep], sin_t[keep])
+    queue_cubes(positions, [35, 35, 80], 0, battlement_color)
 
-def draw_tower_with_platform(offset_x, offset_y, offset_z, radius=160, height=800, floors=3, color_scheme='normal'):
+def draw_tower_with_platform(offset_x, offset_y, offset_z, radius=160, height=800, floors=3, color_scheme='normal', lod=0):
     """Draw tower with platform that has stair entrance gap"""
-    quad = gluNewQuadric()
-    
     # Draw main tower
     glPushMatrix()
     glTranslatef(offset_x, offset_y, offset_z)
@@ -391,17 +696,19 @@ def draw_tower_with_platform(offset_x, offset_y, offset_z, radius=160, height=80
     stone_color = get_color_scheme(color_scheme, base_stone_color)
     glColor3f(stone_color[0], stone_color[1], stone_color[2])
     
+    slices, stacks = TOWER_LOD_SEGMENTS[lod]
     floor_height = height / floors
     for floor in range(floors):
-        gluCylinder(quad, radius, radius, floor_height, 32, 32)
+        draw_cylinder(radius, radius, floor_height, slices, stacks)
         glTranslatef(0, 0, floor_height)
         
         if floor < floors - 1:
-            ring_base = [0.6, 0.6, 0.6]
-            ring_color = get_color_scheme(color_scheme, ring_base)
-            glColor3f(ring_color[0], ring_color[1], ring_color[2])
-            gluCylinder(quad, radius + 5, radius + 5, 10, 32, 32)
-            glColor3f(stone_color[0], stone_color[1], stone_color[2])
+            if lod < LOD_FAR:
+                ring_base = [0.6, 0.6, 0.6]
+                ring_color = get_color_scheme(color_scheme, ring_base)
+                glColor3f(ring_color[0], ring_color[1], ring_color[2])
+                draw_cylinder(radius + 5, radius + 5, 10, slices, stacks)
+                glColor3f(stone_color[0], stone_color[1], stone_color[2])
             glTranslatef(0, 0, 10)
     
     glPopMatrix()
@@ -411,11 +718,11 @@ def draw_tower_with_platform(offset_x, offset_y, offset_z, radius=160, height=80
     platform_radius = radius + 30
     gap_start = 315
     gap_end = 45
-    draw_platform_with_gap(offset_x, offset_y, platform_z, platform_radius, gap_start, gap_end, color_scheme)
+    draw_platform_with_gap(offset_x, offset_y, platform_z, platform_radius, gap_start, gap_end, color_scheme, lod)
     
     # Add central structure on platform
     central_base = [0.8, 0.8, 0.75]
-    central_color = get_color_scheme(color_scheme, central_base)
+    central_color = palette_index(color_scheme, central_base)
     draw_cube_manual_shading(offset_x, offset_y, platform_z + 40, 60, 60, 80, central_color)
 
 def draw_rock_tower():
@@ -444,24 +751,15 @@ def draw_rock_tower_platform():
     # Railing around the edge
     railing_color = [0.5, 0.5, 0.45]
     railing_height = platform_height + platform_thickness + 10
-    for angle in range(0, 360, 30):
-        rad = radians(angle)
-        rail_x = x + (platform_radius - 10) * cos(rad)
-        rail_y = y + (platform_radius - 10) * sin(rad)
-        draw_cube_manual_shading(rail_x, rail_y, railing_height + 15, 8, 8, 30, railing_color)
+    _, cos_t, sin_t = angle_table(0, 360, 30)
+    positions = ring_points(x, y, railing_height + 15, platform_radius - 10, cos_t, sin_t)
+    queue_cubes(positions, [8, 8, 30], 0, railing_color)
 
 def draw_filled_circle(x, y, z, radius, segments=32):
     """Draw a filled circular plate using triangle fan"""
     glPushMatrix()
     glTranslatef(x, y, z)
-    glBegin(GL_TRIANGLE_FAN)
-    glVertex3f(0.0, 0.0, 0.0)
-    for i in range(segments + 1):
-        angle = 2 * 3.14159 * i / segments
-        px = radius * cos(angle)
-        py = radius * sin(angle)
-        glVertex3f(px, py, 0.0)
-    glEnd()
+    draw_vertex_array(fan_arc_triangles(radius, segments))
     glPopMatrix()
 
 def draw_spiral_stairs_around_rock():
@@ -474,39 +772,48 @@ def draw_spiral_stairs_around_rock():
     angle_per_step = 1800 / steps
     stair_color = [0.6, 0.5, 0.4]
     
-    for i in range(steps):
-        angle = radians(angle_per_step * i)
-        step_x = x + radius * cos(angle)
-        step_y = y + radius * sin(angle)
-        step_z = z + height_per_step * i
-        
-        glPushMatrix()
-        glTranslatef(step_x, step_y, step_z)
-        glRotatef(angle_per_step * i, 0, 0, 1)
-        draw_cube_manual_shading(0, 0, 0, 100, 50, 15, stair_color)
-        
-        if i % 10 == 0:
-            draw_cube_manual_shading(0, 0, -50, 25, 25, 100, stair_color)
-        glPopMatrix()
+    i, angles, cos_t, sin_t = spiral_table(steps, angle_per_step)
+    positions = np.column_stack((
+        x + radius * cos_t,
+        y + radius * sin_t,
+        z + height_per_step * i
+    ))
+    queue_cubes(positions, [100, 50, 15], angles, stair_color)
+    
+    # Support pillar under every tenth step
+    pillars = i % 10 == 0
+    queue_cubes(positions[pillars] - [0, 0, 50], [25, 25, 100], angles[pillars], stair_color)
+
+def get_rope_endpoints(config):
+    """Castle support bar top and rock platform anchor for a castle's rope"""
+    pos = config['position']
+    bar_height = 350
+    center_bar_top = [pos[0], pos[1], pos[2] + config['wall_height'] + bar_height - 50]
+    rock_platform = [central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1600 + 150]
+    return center_bar_top, rock_platform
+
+def draw_rope_connection(config, with_rope=True):
+    """Draw a castle's support bar and its rope to the rock tower
+    
+    The scene objects leave the rope out; draw_ropes draws them every frame so they can swing.
+    """
+    pos = config['position']
+    bar_height = 350
+    draw_rope_support_bar(pos[0], pos[1], pos[2] + config['wall_height'], bar_height)
+    if with_rope:
+        draw_rope(*get_rope_endpoints(config))
+
+def draw_rock_support_bar():
+    """Main support bar on top of the rock tower"""
+    draw_rope_support_bar(central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1600 + 30, 100)
 
 def draw_rope_connections():
     """Draw ropes connecting towers to castle centers and rock tower"""
     for config in castle_configs:
-        pos = config['position']
-        wall_height = config['wall_height']
-        
-        castle_center_height = pos[2] + wall_height
-        castle_center = [pos[0], pos[1], castle_center_height]
-        
-        bar_height = 350
-        draw_rope_support_bar(castle_center[0], castle_center[1], castle_center[2], bar_height)
-        
-        center_bar_top = [castle_center[0], castle_center[1], castle_center[2] + bar_height - 50]
-        rock_platform = [central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1600 + 150]
-        draw_rope(center_bar_top, rock_platform)
+        draw_rope_connection(config)
     
     # Add main support bar at rock tower
-    draw_rope_support_bar(central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1600 + 30, 100)
+    draw_rock_support_bar()
 
 def draw_wall(x1, y1, x2, y2, offset_z, thickness=400, height=600, color_scheme='normal'):
     """Draw wall segment"""
@@ -519,55 +826,16 @@ def draw_wall(x1, y1, x2, y2, offset_z, thickness=400, height=600, color_scheme=
     angle = atan2(y2 - y1, x2 - x1) * 180 / 3.14159
     glRotatef(angle, 0, 0, 1)
     wall_base = [0.85, 0.82, 0.75]
-    wall_color = get_color_scheme(color_scheme, wall_base)
+    wall_color = palette_index(color_scheme, wall_base)
     draw_cube_manual_shading(0, 0, 0, length, thickness, height, wall_color)
     glPopMatrix()
 
-def draw_stone_block(x, y, z, width, depth, height, angle, row, col, color_scheme='normal'):
-    """Draw individual stone block"""
-    glPushMatrix()
-    glTranslatef(x, y, z)
-    glRotatef(angle, 0, 0, 1)
-    
-    # Color variation
-    base_r, base_g, base_b = 0.85, 0.40, 0.35
-    variation = 0.12 * ((row + col) % 5 - 2) / 2
-    stone_color = [
-        min(max(base_r + variation, 0.0), 1.0),
-        min(max(base_g + variation, 0.0), 1.0),
-        min(max(base_b + variation, 0.0), 1.0)
-    ]
-    
-    final_color = get_color_scheme(color_scheme, stone_color)
-    draw_cube_manual_shading(0, 0, 0, width, depth, height, final_color)
-    glPopMatrix()
-
 def draw_stone_blocks(x1, y1, x2, y2, offset_z, thickness, height, color_scheme='normal'):
-    """Draw stone blocks on walls"""
-    length = ((x2 - x1)**2 + (y2 - y1)**2) ** 0.5
-    angle = atan2(y2 - y1, x2 - x1) * 180 / 3.14159
-    block_width, block_height, gap = 200, 100, 20
-    blocks_x = int(length / (block_width + gap))
-    blocks_z = int(height / (block_height + gap))
-    midx, midy = (x1 + x2) / 2, (y1 + y2) / 2
-    
-    for row in range(blocks_z):
-        for col in range(blocks_x):
-            offset = (block_width + gap) / 2 if (row % 2 == 1) else 0
-            block_x_local = -length/2 + col * (block_width + gap) + block_width/2 + offset
-            block_z_local = row * (block_height + gap) + block_height/2
-            
-            if abs(block_x_local) > length/2 - block_width/2:
-                continue
-            
-            cos_a, sin_a = cos(radians(angle)), sin(radians(angle))
-            world_x = midx + block_x_local * cos_a
-            world_y = midy + block_x_local * sin_a
-            world_z = offset_z + block_z_local + 15
-            
-            draw_stone_block(world_x, world_y, world_z, block_width, thickness + 5, block_height, angle, row, col, color_scheme)
+    """Draw stone blocks on walls as one vertex array"""
+    vertices, colors = build_stone_blocks_mesh(x1, y1, x2, y2, offset_z, thickness, height, color_scheme)
+    draw_mesh_arrays(vertices, colors)
 
-def draw_single_castle(config):
+def draw_single_castle(config, lod=0):
     """Draw individual castle"""
     pos = config['position']
     size = config['size']
@@ -588,7 +856,7 @@ def draw_single_castle(config):
     
     # Draw towers with platforms
     for (x, y) in corners:
-        draw_tower_with_platform(x, y, pos[2], tower_radius, height, floors, color_scheme)
+        draw_tower_with_platform(x, y, pos[2], tower_radius, height, floors, color_scheme, lod)
     
     # Draw walls
     wall_inset = 50
@@ -604,194 +872,375 @@ def draw_single_castle(config):
         wall_x2, wall_y2 = x2 - dx_norm, y2 - dy_norm
         
         draw_wall(wall_x1, wall_y1, wall_x2, wall_y2, pos[2], wall_thickness, wall_height, color_scheme)
-        draw_stone_blocks(wall_x1, wall_y1, wall_x2, wall_y2, pos[2], wall_thickness, wall_height, color_scheme)
+        # Far away the blocks collapse into the flat wall cube
+        if lod < LOD_FAR:
+            draw_stone_blocks(wall_x1, wall_y1, wall_x2, wall_y2, pos[2], wall_thickness, wall_height, color_scheme)
     
-    # Add railings on top of castle walls
-    railing_height = 80
-    railing_color = get_color_scheme(color_scheme, [0.6, 0.6, 0.55])
-    railing_top_z = pos[2] + wall_height + railing_height/2
-    
-    # Draw railings on each wall segment
-    for i in range(len(corners)):
-        x1, y1 = corners[i]
-        x2, y2 = corners[(i + 1) % len(corners)]
+    # Railings are too thin to see from far away
+    if lod < LOD_FAR:
+        railing_height = 80
+        railing_color = get_color_scheme(color_scheme, [0.6, 0.6, 0.55])
+        railing_top_z = pos[2] + wall_height + railing_height/2
         
-        dx, dy = x2 - x1, y2 - y1
-        length = (dx**2 + dy**2)**0.5
+        # Draw railings on each wall segment
+        for i in range(len(corners)):
+            x1, y1 = corners[i]
+            x2, y2 = corners[(i + 1) % len(corners)]
         
-        dx_norm, dy_norm = dx / length * wall_inset, dy / length * wall_inset
-        wall_x1, wall_y1 = x1 + dx_norm, y1 + dy_norm
-        wall_x2, wall_y2 = x2 - dx_norm, y2 - dy_norm
+            dx, dy = x2 - x1, y2 - y1
+            length = (dx**2 + dy**2)**0.5
         
-        num_railings = int(length / 100)
-        for j in range(num_railings + 1):
-            t = j / max(num_railings, 1)
-            rail_x = wall_x1 + t * (wall_x2 - wall_x1)
-            rail_y = wall_y1 + t * (wall_y2 - wall_y1)
-            draw_cube_manual_shading(rail_x, rail_y, railing_top_z, 15, 15, railing_height, railing_color)
-    
-    # Add horizontal railing bars
-    railing_bar_color = get_color_scheme(color_scheme, [0.65, 0.65, 0.6])
-    for i in range(len(corners)):
-        x1, y1 = corners[i]
-        x2, y2 = corners[(i + 1) % len(corners)]
+            dx_norm, dy_norm = dx / length * wall_inset, dy / length * wall_inset
+            wall_x1, wall_y1 = x1 + dx_norm, y1 + dy_norm
+            wall_x2, wall_y2 = x2 - dx_norm, y2 - dy_norm
         
-        dx, dy = x2 - x1, y2 - y1
-        length = (dx**2 + dy**2)**0.5
+            num_railings = int(length / 100)
+            t = np.arange(num_railings + 1) / max(num_railings, 1)
+            positions = np.column_stack((
+                wall_x1 + t * (wall_x2 - wall_x1),
+                wall_y1 + t * (wall_y2 - wall_y1),
+                np.full(len(t), railing_top_z)
+            ))
+            queue_cubes(positions, [15, 15, railing_height], 0, railing_color)
         
-        dx_norm, dy_norm = dx / length * wall_inset, dy / length * wall_inset
-        wall_x1, wall_y1 = x1 + dx_norm, y1 + dy_norm
-        wall_x2, wall_y2 = x2 - dx_norm, y2 - dy_norm
+        # Add horizontal railing bars
+        railing_bar_color = palette_index(color_scheme, [0.65, 0.65, 0.6])
+        for i in range(len(corners)):
+            x1, y1 = corners[i]
+            x2, y2 = corners[(i + 1) % len(corners)]
+        
+            dx, dy = x2 - x1, y2 - y1
+            length = (dx**2 + dy**2)**0.5
         
-        midx = (wall_x1 + wall_x2) / 2
-        midy = (wall_y1 + wall_y2) / 2
+            dx_norm, dy_norm = dx / length * wall_inset, dy / length * wall_inset
+            wall_x1, wall_y1 = x1 + dx_norm, y1 + dy_norm
+            wall_x2, wall_y2 = x2 - dx_norm, y2 - dy_norm
         
-        glPushMatrix()
-        glTranslatef(midx, midy, pos[2] + wall_height + railing_height - 20)
-        angle = atan2(wall_y2 - wall_y1, wall_x2 - wall_x1) * 180 / 3.14159
-        glRotatef(angle, 0, 0, 1)
-        draw_cube_manual_shading(0, 0, 0, length - 2*wall_inset, 10, 8, railing_bar_color)
-        glPopMatrix()
+            midx = (wall_x1 + wall_x2) / 2
+            midy = (wall_y1 + wall_y2) / 2
+        
+            glPushMatrix()
+            glTranslatef(midx, midy, pos[2] + wall_height + railing_height - 20)
+            angle = atan2(wall_y2 - wall_y1, wall_x2 - wall_x1) * 180 / 3.14159
+            glRotatef(angle, 0, 0, 1)
+            draw_cube_manual_shading(0, 0, 0, length - 2*wall_inset, 10, 8, railing_bar_color)
+            glPopMatrix()
     
     # Interior and gate
     interior_base = [0.82, 0.8, 0.72]
     gate_base = [0.3, 0.3, 0.3]
-    interior_color = get_color_scheme(color_scheme, interior_base)
-    gate_color = get_color_scheme(color_scheme, gate_base)
+    interior_color = palette_index(color_scheme, interior_base)
+    gate_color = palette_index(color_scheme, gate_base)
     
     draw_cube_manual_shading(pos[0], pos[1], pos[2] + wall_height/2, size * 0.8, size * 0.8, wall_height, interior_color)
     draw_cube_manual_shading(pos[0], pos[1] - half_size + wall_inset, pos[2] + wall_height/2, 300, 80, wall_height, gate_color)
 
-def draw_simple_tree(x, y, z, size=100):
-    """Draw a simple tree using larger spheres"""
-    quad = gluNewQuadric()
-    
-    glPushMatrix()
-    glTranslatef(x, y, z)
-    glColor3f(0.4, 0.2, 0.1)
-    gluCylinder(quad, size*0.15, size*0.1, size*0.8, 6, 10)
-    
-    glTranslatef(0, 0, size*0.6)
-    glColor3f(0.1, 0.5, 0.1)
-    gluSphere(quad, size*0.6, 8, 8)
-    glPopMatrix()
+def grid_to_triangles(grid):
+    """Split a (rows, cols, 3) vertex grid into GL_TRIANGLES vertices"""
+    a, b = grid[:-1, :-1], grid[1:, :-1]
+    c, d = grid[1:, 1:], grid[:-1, 1:]
+    return np.stack((a, b, c, a, c, d), axis=2).reshape(-1, 3)
+
+def tessellate_cylinder(base_radius, top_radius, height, slices, stacks):
+    """Triangles for a gluCylinder with the same slice/stack layout"""
+    theta = np.linspace(0, 2 * np.pi, slices + 1)
+    t = np.linspace(0, 1, stacks + 1)[:, None]
+    r = base_radius + (top_radius - base_radius) * t
+    grid = np.stack(np.broadcast_arrays(r * np.sin(theta), r * np.cos(theta), height * t), axis=-1)
+    return grid_to_triangles(grid)
+
+def tessellate_sphere(radius, slices, stacks):
+    """Triangles for a gluSphere with the same slice/stack layout"""
+    theta = np.linspace(0, 2 * np.pi, slices + 1)
+    phi = np.linspace(0, np.pi, stacks + 1)[:, None]
+    grid = np.stack(np.broadcast_arrays(radius * np.sin(theta) * np.sin(phi),
+                                        radius * np.cos(theta) * np.sin(phi),
+                                        radius * np.cos(phi)), axis=-1)
+    return grid_to_triangles(grid)
+
+def tessellate_disk(inner_radius, outer_radius, slices, loops):
+    """Triangles for a gluDisk with the same slice/loop layout"""
+    theta = np.linspace(0, 2 * np.pi, slices + 1)
+    r = np.linspace(inner_radius, outer_radius, loops + 1)[:, None]
+    grid = np.stack(np.broadcast_arrays(r * np.sin(theta), r * np.cos(theta), 0.0), axis=-1)
+    return grid_to_triangles(grid)
 
-def draw_simple_bush(x, y, z, size=60):
-    """Draw a simple bush using one large sphere"""
-    quad = gluNewQuadric()
+def tessellate_cone(base_radius, height, slices, stacks):
+    """Triangles for a gluCylinder with a zero top radius"""
+    return tessellate_cylinder(base_radius, 0, height, slices, stacks)
+
+PRIMITIVE_TESSELLATORS = {
+    'cylinder': tessellate_cylinder,
+    'sphere': tessellate_sphere,
+    'disk': tessellate_disk,
+    'cone': tessellate_cone
+}
+
+# Shared LRU of tessellated primitives keyed by (kind, *params), bounded by bytes
+PRIMITIVE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+primitive_cache = OrderedDict()
+primitive_cache_bytes = 0
+primitive_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+primitive_cache_lock = threading.Lock()
+
+def get_primitive_mesh(kind, *params):
+    """Cached float32 GL_TRIANGLES vertices for a quadric primitive"""
+    global primitive_cache_bytes
     
-    glPushMatrix()
-    glTranslatef(x, y, z + size*0.4)
-    glColor3f(0.2, 0.4, 0.2)
-    gluSphere(quad, size*0.5, 6, 6)
-    glPopMatrix()
+    key = (kind,) + params
+    # Background chunk builds tessellate too
+    with primitive_cache_lock:
+        mesh = primitive_cache.get(key)
+        if mesh is not None:
+            primitive_cache_stats['hits'] += 1
+            primitive_cache.move_to_end(key)
+            return mesh
+        
+        primitive_cache_stats['misses'] += 1
+        mesh = np.ascontiguousarray(PRIMITIVE_TESSELLATORS[kind](*params), dtype=np.float32)
+        primitive_cache[key] = mesh
+        primitive_cache_bytes += mesh.nbytes
+        
+        while primitive_cache_bytes > PRIMITIVE_CACHE_MAX_BYTES and len(primitive_cache) > 1:
+            _, evicted = primitive_cache.popitem(last=False)
+            primitive_cache_bytes -= evicted.nbytes
+            primitive_cache_stats['evictions'] += 1
+        return mesh
+
+def primitive_cache_info():
+    """Hit/miss counts and memory use of the primitive cache"""
+    info = dict(primitive_cache_stats)
+    info['entries'] = len(primitive_cache)
+    info['bytes'] = primitive_cache_bytes
+    return info
+
+def draw_primitive(kind, *params):
+    """Draw a cached primitive with the current color and transform"""
+    draw_vertex_array(get_primitive_mesh(kind, *params))
+
+def draw_cylinder(base_radius, top_radius, height, slices, stacks):
+    """Cached replacement for gluCylinder"""
+    draw_primitive('cylinder', base_radius, top_radius, height, slices, stacks)
+
+def draw_sphere(radius, slices, stacks):
+    """Cached replacement for gluSphere"""
+    draw_primitive('sphere', radius, slices, stacks)
+
+def draw_disk(inner_radius, outer_radius, slices, loops):
+    """Cached replacement for gluDisk"""
+    draw_primitive('disk', inner_radius, outer_radius, slices, loops)
 
-def draw_multi_colored_grid():
-    """Draw a grid with multiple shades of green"""
+def solid_colors(vertices, color):
+    """Per-vertex color array filled with one color"""
+    return np.tile(np.asarray(color, dtype=np.float64), (len(vertices), 1))
+
+def make_tree_template(lod, trunk_segments, crown_segments):
+    """Tree template at size 100: trunk cylinder and crown sphere"""
+    trunk = tessellate_cylinder(15, 10, 80, *trunk_segments)
+    crown = tessellate_sphere(60, *crown_segments) + [0, 0, 60]
+    return make_template(
+        f'tree_lod{lod}',
+        np.concatenate((trunk, crown)),
+        np.concatenate((solid_colors(trunk, [0.4, 0.2, 0.1]), solid_colors(crown, [0.1, 0.5, 0.1]))),
+        GL_TRIANGLES
+    )
+
+def make_bush_template(lod, segments):
+    """Bush template at size 100: one sphere"""
+    sphere = tessellate_sphere(50, *segments) + [0, 0, 40]
+    return make_template(f'bush_lod{lod}', sphere, solid_colors(sphere, [0.2, 0.4, 0.2]), GL_TRIANGLES)
+
+# Tree and bush templates per LOD tier, scaled per instance
+TREE_TEMPLATES = [
+    make_tree_template(0, (6, 10), (8, 8)),
+    make_tree_template(1, (6, 2), (6, 5)),
+    make_tree_template(2, (4, 1), (4, 3))
+]
+BUSH_TEMPLATES = [
+    make_bush_template(0, (6, 6)),
+    make_bush_template(1, (5, 4)),
+    make_bush_template(2, (4, 3))
+]
+
+def draw_simple_tree(x, y, z, size=100, lod=0):
+    """Queue a simple tree (trunk cylinder and crown sphere)"""
+    queue_instances(TREE_TEMPLATES[lod], pack_instances([x, y, z], size / 100, 0, [1, 1, 1]))
+
+def draw_simple_bush(x, y, z, size=60, lod=0):
+    """Queue a simple bush (one large sphere)"""
+    queue_instances(BUSH_TEMPLATES[lod], pack_instances([x, y, z], size / 100, 0, [1, 1, 1]))
+
+# Ground: chunks of GROUND_CHUNK_QUADS x GROUND_CHUNK_QUADS quads, each one interleaved
+# (r, g, b, x, y, z) buffer holding the quads followed by their grid lines. Only chunks
+# within GROUND_STREAM_RADIUS of the player are resident, least recently used evicted first.
+GROUND_QUAD_SIZE = 800
+GROUND_CHUNK_QUADS = 16
+GROUND_STREAM_RADIUS = CAMERA_FAR
+GROUND_MAX_CHUNKS = 64
+GROUND_COLORS = np.array([
+    [0.15, 0.4, 0.15], [0.2, 0.5, 0.2], [0.25, 0.6, 0.25], [0.3, 0.7, 0.3],
+    [0.35, 0.75, 0.35], [0.4, 0.8, 0.4], [0.2, 0.45, 0.2], [0.18, 0.55, 0.18]
+])
+GROUND_LINE_COLOR = [0.1, 0.3, 0.1]
+ground_chunks = OrderedDict()
+ground_grid_length = None
+ground_stats = {'resident': 0, 'drawn': 0, 'built': 0, 'evicted': 0}
+
+def get_ground_extent():
+    """Half size of the ground and number of quads along each axis"""
     grid_size = GRID_LENGTH * 20
-    quad_size = 800
-    num_quads = (grid_size * 2) // quad_size
+    return grid_size, (grid_size * 2) // GROUND_QUAD_SIZE
+
+def build_ground_chunk_mesh(chunk_i, chunk_j):
+    """Interleaved GL_C3F_V3F buffer for one chunk: quad vertices first, then line vertices"""
+    grid_size, num_quads = get_ground_extent()
+    i0, j0 = chunk_i * GROUND_CHUNK_QUADS, chunk_j * GROUND_CHUNK_QUADS
+    i1, j1 = min(i0 + GROUND_CHUNK_QUADS, num_quads), min(j0 + GROUND_CHUNK_QUADS, num_quads)
     
-    green_colors = [
-        [0.15, 0.4, 0.15], [0.2, 0.5, 0.2], [0.25, 0.6, 0.25], [0.3, 0.7, 0.3],
-        [0.35, 0.75, 0.35], [0.4, 0.8, 0.4], [0.2, 0.45, 0.2], [0.18, 0.55, 0.18]
-    ]
+    i, j = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    x1 = -grid_size + i * GROUND_QUAD_SIZE
+    y1 = -grid_size + j * GROUND_QUAD_SIZE
+    x2, y2 = x1 + GROUND_QUAD_SIZE, y1 + GROUND_QUAD_SIZE
     
-    for i in range(num_quads):
-        for j in range(num_quads):
-            x1 = -grid_size + i * quad_size
-            y1 = -grid_size + j * quad_size
-            x2 = x1 + quad_size
-            y2 = y1 + quad_size
-            
-            color_index = (i + j) % len(green_colors)
-            color = green_colors[color_index]
-            
-            glColor3f(color[0], color[1], color[2])
-            glBegin(GL_QUADS)
-            glVertex3f(x1, y1, 0)
-            glVertex3f(x2, y1, 0)
-            glVertex3f(x2, y2, 0)
-            glVertex3f(x1, y2, 0)
-            glEnd()
-    
-    # Draw grid lines
-    glColor3f(0.1, 0.3, 0.1)
+    quads = np.zeros((len(i), 4, 6))
+    quads[:, :, 0:3] = GROUND_COLORS[(i + j) % len(GROUND_COLORS)][:, None, :]
+    quads[:, :, 3] = np.column_stack((x1, x2, x2, x1))
+    quads[:, :, 4] = np.column_stack((y1, y1, y2, y2))
+    
+    # Grid lines along the chunk's quad boundaries, slightly above the ground
+    min_x, max_x = -grid_size + i0 * GROUND_QUAD_SIZE, -grid_size + i1 * GROUND_QUAD_SIZE
+    min_y, max_y = -grid_size + j0 * GROUND_QUAD_SIZE, -grid_size + j1 * GROUND_QUAD_SIZE
+    line_x = -grid_size + np.arange(i0, i1 + 1) * GROUND_QUAD_SIZE
+    line_y = -grid_size + np.arange(j0, j1 + 1) * GROUND_QUAD_SIZE
+    lines = np.zeros((len(line_x) + len(line_y), 2, 6))
+    lines[:, :, 0:3] = GROUND_LINE_COLOR
+    lines[:len(line_x), :, 3] = line_x[:, None]
+    lines[:len(line_x), :, 4] = [min_y, max_y]
+    lines[len(line_x):, :, 3] = [min_x, max_x]
+    lines[len(line_x):, :, 4] = line_y[:, None]
+    lines[:, :, 5] = 1
+    
+    buffer = np.concatenate((quads.reshape(-1, 6), lines.reshape(-1, 6))).astype(np.float32)
+    return buffer, len(i) * 4, ([min_x, min_y, 0], [max_x, max_y, 1])
+
+def build_ground_chunk(chunk_i, chunk_j):
+    """Compile one ground chunk into a display list"""
+    buffer, quad_vertices, (min_corner, max_corner) = build_ground_chunk_mesh(chunk_i, chunk_j)
+    display_list = glGenLists(1)
+    glNewList(display_list, GL_COMPILE)
+    glInterleavedArrays(GL_C3F_V3F, 0, buffer)
+    glDrawArrays(GL_QUADS, 0, quad_vertices)
     glLineWidth(1.0)
-    glBegin(GL_LINES)
-    for i in range(num_quads + 1):
-        line_x = -grid_size + i * quad_size
-        glVertex3f(line_x, -grid_size, 1)
-        glVertex3f(line_x, grid_size, 1)
-    
-    for j in range(num_quads + 1):
-        line_y = -grid_size + j * quad_size
-        glVertex3f(-grid_size, line_y, 1)
-        glVertex3f(grid_size, line_y, 1)
-    glEnd()
+    glDrawArrays(GL_LINES, quad_vertices, len(buffer) - quad_vertices)
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glEndList()
+    ground_stats['built'] += 1
+    return {'list': display_list, 'min': np.array(min_corner, dtype=np.float64), 'max': np.array(max_corner, dtype=np.float64)}
 
-def draw_minimal_vegetation():
-    """Add minimal vegetation"""
-    tree_positions = [
-        (-5000, -3000), (-4000, 2000), (-2000, -4000), (3000, -2000), (4000, 3000),
-        (-6000, 1000), (2000, -5000), (5000, -1000), (-1000, -6000), (6000, 2000),
-        (-3000, 4000), (1000, 5000), (-5000, 0), (0, -3000), (4000, 0)
-    ]
+def release_ground_chunks():
+    """Free every resident ground chunk"""
+    while ground_chunks:
+        _, chunk = ground_chunks.popitem()
+        glDeleteLists(chunk['list'], 1)
+
+def draw_multi_colored_grid(planes=None):
+    """Draw the ground chunks around the player, streaming chunks in and out as it moves"""
+    global ground_grid_length
     
-    bush_positions = [
-        (-4500, -2500), (-3500, 1500), (-1500, -3500), (2500, -1500), (3500, 2500),
-        (-5500, 500), (1500, -4500), (4500, -500), (-500, -5500), (5500, 1500),
-        (-2500, 3500), (500, 4500), (-4500, -500), (-500, -2500), (3500, -500),
-        (-1500, 4500), (4500, 500), (-3500, -1500), (2500, 3500), (-500, 5500),
-        (-6000, -1000), (1000, -6000), (6000, 1000), (-1000, 6000), (0, -4000)
-    ]
+    if ground_grid_length != GRID_LENGTH:
+        release_ground_chunks()
+        ground_grid_length = GRID_LENGTH
+    
+    grid_size, num_quads = get_ground_extent()
+    chunk_span = GROUND_CHUNK_QUADS * GROUND_QUAD_SIZE
+    num_chunks = -(-num_quads // GROUND_CHUNK_QUADS)
+    
+    def chunk_range(center):
+        first = int((center - GROUND_STREAM_RADIUS + grid_size) // chunk_span)
+        last = int((center + GROUND_STREAM_RADIUS + grid_size) // chunk_span)
+        return range(max(first, 0), min(last, num_chunks - 1) + 1)
     
-    def is_safe_position(x, y):
-        castle_centers = [[-800, -1600], [900, 1000], [-3300, 400], [-1000, 1500]]
-        for cx, cy in castle_centers:
-            if sqrt((x - cx)**2 + (y - cy)**2) < 900:
-                return False
-        return True
+    ground_stats['drawn'] = 0
+    for chunk_i in chunk_range(player_pos[0]):
+        for chunk_j in chunk_range(player_pos[1]):
+            key = (chunk_i, chunk_j)
+            chunk = ground_chunks.get(key)
+            if chunk is None:
+                chunk = ground_chunks[key] = build_ground_chunk(chunk_i, chunk_j)
+            ground_chunks.move_to_end(key)
+            
+            if planes is None or classify_aabb(planes, chunk['min'], chunk['max']) >= 0:
+                glCallList(chunk['list'])
+                ground_stats['drawn'] += 1
+    
+    # Chunks touched this frame are at the end, so eviction only drops stale ones
+    while len(ground_chunks) > GROUND_MAX_CHUNKS:
+        _, chunk = ground_chunks.popitem(last=False)
+        glDeleteLists(chunk['list'], 1)
+        ground_stats['evicted'] += 1
+    ground_stats['resident'] = len(ground_chunks)
+
+def safe_vegetation_mask(points):
+    """True for each (x, y) point farther than vegetation_clearance from every castle and the rock tower
+    
+    The centers go in a uniform grid one clearance wide, sorted by cell key, so every point
+    is only measured against the centers in its own and the eight neighbouring cells.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    centers = np.array([config['position'][:2] for config in castle_configs] + [central_rock_pos[:2]],
+                       dtype=np.float64)
+    cell = max(vegetation_clearance, 1.0)
+    center_cells = np.floor(centers / cell).astype(np.int64)
+    keys = cell_keys(center_cells[:, 0], center_cells[:, 1])
+    order = np.argsort(keys, kind='stable')
+    keys, centers = keys[order], centers[order]
     
-    for x, y in tree_positions:
-        if is_safe_position(x, y):
-            draw_simple_tree(x, y, 30, 240)
+    point_cells = np.floor(points / cell).astype(np.int64)
+    safe = np.ones(len(points), dtype=bool)
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            neighbour = cell_keys(point_cells[:, 0] + di, point_cells[:, 1] + dj)
+            first = np.searchsorted(keys, neighbour, side='left')
+            last = np.searchsorted(keys, neighbour, side='right')
+            for k in range(int((last - first).max(initial=0))):
+                rows = np.flatnonzero(first + k < last)
+                offset = points[rows] - centers[first[rows] + k]
+                safe[rows[np.hypot(offset[:, 0], offset[:, 1]) < vegetation_clearance]] = False
+    return safe
+
+def get_safe_vegetation():
+    """Tree and bush positions clear of the castles, filtered again only when the scene changed"""
+    key = get_static_scene_key()
+    if safe_vegetation['key'] != key:
+        for kind, positions in (('trees', tree_positions), ('bushes', bush_positions)):
+            mask = safe_vegetation_mask(positions)
+            safe_vegetation[kind] = [p for p, safe in zip(positions, mask) if safe]
+        safe_vegetation['key'] = key
+    return safe_vegetation['trees'], safe_vegetation['bushes']
+
+def draw_vegetation(trees, bushes, lod=0):
+    """Draw the given tree and bush positions (already filtered by get_safe_vegetation)"""
+    for x, y in trees:
+        draw_simple_tree(x, y, 30, 240, lod)
     
-    for x, y in bush_positions:
-        if is_safe_position(x, y):
-            draw_simple_bush(x, y, 0, 190)
+    for x, y in bushes:
+        draw_simple_bush(x, y, 0, 190, lod)
+    
+    flush_instances()
+
+def draw_minimal_vegetation():
+    """Add minimal vegetation"""
+    draw_vegetation(*get_safe_vegetation())
 
 def draw_mountain_range():
     """Draw dense clusters of rocky mountains around the scene"""
-    mountain_positions = [
-        # NORTH CLUSTER
-        (-2746, 6714, 0, 825, 1079, 740), (-1150, 8828, 0, 942, 1077, 652),
-        (-2708, 7358, 0, 1358, 744, 816), (-1368, 8630, 0, 895, 811, 719),
-        (-2883, 7216, 0, 827, 987, 701), (-1100, 9100, 0, 1200, 900, 800),
-        (-2600, 6900, 0, 1000, 850, 750),
-        # SOUTH CLUSTER
-        (-167, -6735, 0, 1358, 914, 712), (-2441, -8797, 0, 1084, 703, 681),
-        (-186, -6968, 0, 1148, 842, 679), (-2680, -8619, 0, 1144, 752, 647),
-        (-511, -7301, 0, 1167, 876, 735), (-2300, -8800, 0, 1100, 800, 700),
-        (-800, -7000, 0, 900, 750, 650),
-        # EAST CLUSTER
-        (6644, -1653, 0, 1270, 974, 663), (8987, -320, 0, 1365, 850, 785),
-        (7191, -2204, 0, 871, 723, 716), (9391, -104, 0, 881, 819, 651),
-        (6989, -2116, 0, 1264, 1025, 786), (9100, 200, 0, 1000, 900, 750),
-        (6800, -2000, 0, 1200, 850, 700),
-        # WEST CLUSTER
-        (-7234, 479, 0, 1163, 807, 736), (-8682, -1201, 0, 873, 1011, 687),
-        (-6854, 846, 0, 1050, 783, 836), (-9012, -1624, 0, 1370, 812, 766),
-        (-6614, 894, 0, 857, 817, 616), (-8900, -1400, 0, 1100, 950, 800),
-        (-7200, 700, 0, 950, 800, 650)
-    ]
-    
     for x, y, z, width, height, depth in mountain_positions:
         draw_rocky_mountain(x, y, z, width, height, depth)
 
-def draw_rocky_mountain(x, y, z, width=800, height=600, depth=600):
+def draw_rocky_mountain(x, y, z, width=800, height=600, depth=600, lod=0):
     """Draw a rocky mountain using quadric objects"""
-    quad = gluNewQuadric()
     base_color = [0.5, 0.4, 0.35]
     
     glPushMatrix()
@@ -800,13 +1249,13 @@ def draw_rocky_mountain(x, y, z, width=800, height=600, depth=600):
     
     glPushMatrix()
     glScalef(width/200, depth/200, height/200)
-    gluSphere(quad, 100, 12, 8)
+    draw_sphere(100, *MOUNTAIN_LOD_SEGMENTS[lod])
     glPopMatrix()
     
     glPopMatrix()
 
 def draw_all_structures():
-    """Draw complete castle complex"""
+    """Draw complete castle complex (static parts only, no player)"""
     for config in castle_configs:
         draw_single_castle(config)
     
@@ -815,227 +1264,2943 @@ def draw_all_structures():
     draw_spiral_stairs_around_rock()
     draw_rope_connections()
     draw_perimeter_wall()
-    draw_human(player_pos[0], player_pos[1], player_pos[2], scale=60)
+    flush_instances()
 
-def draw_text(x, y, text, font=None):
-    """Draw text on screen"""
-    if font is None:
-        font = GLUT_BITMAP_HELVETICA_18
-    
-    glColor3f(1, 1, 1)
-    glMatrixMode(GL_PROJECTION)
-    glPushMatrix()
-    glLoadIdentity()
-    gluOrtho2D(0, 1000, 0, 800)
-    glMatrixMode(GL_MODELVIEW)
-    glPushMatrix()
-    glLoadIdentity()
-    glRasterPos2f(x, y)
-    for ch in text:
-        glutBitmapCharacter(font, ord(ch))
-    glPopMatrix()
-    glMatrixMode(GL_PROJECTION)
-    glPopMatrix()
-    glMatrixMode(GL_MODELVIEW)
+# Static scene: display-listed objects with bounds, organised in an AABB tree
+VEGETATION_CELL_SIZE = 4000
+BVH_LEAF_SIZE = 1
+scene_objects = []
+scene_bvh = None
+scene_key = None
+scene_version = 0  # bumped by invalidate_static_scene
+cull_stats = {'tested': 0, 'culled': 0, 'drawn': 0}
 
-def clamp_player_position():
-    """FIXED COMPREHENSIVE COLLISION DETECTION - No return to center, proper boundaries"""
-    global player_pos, teleport_skip_clamp
+def get_castle_fingerprint():
+    """Every castle's config values, so in-place edits to a castle change the scene keys
     
-    if teleport_skip_clamp:
-        teleport_skip_clamp = False
-        return
-    
-    x, y, z = player_pos
+    O(castles), unlike the prop lists, which are only compared by identity. Positions are
+    copied since they are lists that can be edited in place.
+    """
+    shape = itemgetter(*SCENE_CASTLE_KEYS[1:])
+    return tuple((tuple(config['position']), shape(config)) for config in castle_configs)
+
+def get_static_scene_key():
+    """Changed castles or replaced scene globals; other in-place edits go through invalidate_static_scene"""
+    return (scene_version, get_castle_fingerprint(), tuple(central_rock_pos), id(mountain_positions),
+            id(tree_positions), id(bush_positions), vegetation_clearance, id(perimeter_wall_layout))
+
+def invalidate_static_scene():
+    """Force the static scenery to be rebuilt on the next frame"""
+    global scene_key, scene_version
+    scene_key = None
+    scene_version += 1
+    invalidate_collision_index()
+    invalidate_nav_graph()
+    invalidate_static_colliders()
+
+def make_scene_object(name, kind, draw, min_corner, max_corner, scheme=None):
+    """Scene object with an axis-aligned bounding box and one display list per LOD tier
     
-    def get_castle_boundaries(castle_config):
-        """Get exact castle boundaries using railing coordinates"""
-        pos = castle_config['position']
-        size = castle_config['size']
-        wall_height = castle_config['wall_height']
-        wall_inset = 50  # Same as in draw_single_castle
-        
-        half_size = size / 2
-        # Calculate actual wall boundaries (with inset)
-        min_x = pos[0] - half_size + wall_inset
-        max_x = pos[0] + half_size - wall_inset
-        min_y = pos[1] - half_size + wall_inset
-        max_y = pos[1] + half_size - wall_inset
-        z_min = 0
-        z_max = pos[2] + wall_height + 200  # Allow margin above walls
+    draw takes the LOD tier; kinds without LOD_DISTANCES are always drawn at tier 0.
+    scheme is the color scheme the object is drawn with, if any.
+    """
+    return {
+        'name': name,
+        'kind': kind,
+        'draw': draw,
+        'scheme': scheme,
+        'min': np.array(min_corner, dtype=np.float64),
+        'max': np.array(max_corner, dtype=np.float64),
+        'lists': {},
+        'lod': 0
+    }
+
+def collect_scene_objects():
+    """Split the static scenery into cullable objects"""
+    objects = []
+    for i, config in enumerate(castle_configs):
+        pos = config['position']
+        # Towers sit on the corners; platforms and battlements stick out past the tower radius
+        reach = config['size'] / 2 + config['tower_radius'] + 80
+        objects.append(make_scene_object(
+            f'castle {i + 1}', 'castle', lambda lod, c=config: draw_single_castle(c, lod),
+            [pos[0] - reach, pos[1] - reach, pos[2]],
+            [pos[0] + reach, pos[1] + reach, pos[2] + config['height'] + 150], config['color_scheme']))
         
-        return min_x, max_x, min_y, max_y, z_min, z_max
+        start, end = get_rope_endpoints(config)
+        objects.append(make_scene_object(
+            f'rope {i + 1}', 'rope', lambda lod, c=config: draw_rope_connection(c, with_rope=False),
+            np.minimum(start, end) - [10, 10, 400], np.maximum(start, end) + [10, 10, 10]))
     
-    # Check each castle individually
-    for i, castle in enumerate(castle_configs):
-        min_x, max_x, min_y, max_y, z_min, z_max = get_castle_boundaries(castle)
+    def draw_rock_complex(lod):
+        draw_rock_tower()
+        draw_rock_tower_platform()
+        draw_spiral_stairs_around_rock()
+        draw_rock_support_bar()
+    
+    x, y, z = central_rock_pos
+    objects.append(make_scene_object('rock tower', 'rock', draw_rock_complex,
+                                     [x - 300, y - 300, z - 100], [x + 300, y + 300, z + 1800]))
+    
+    # Guard tower (radius 60 plus battlements) and roof at each segment start
+    pad = PERIMETER_WALL_THICKNESS / 2 + 90
+    for i, (x1, y1, x2, y2) in enumerate(get_perimeter_wall_segments()):
+        objects.append(make_scene_object(
+            f'perimeter wall {i + 1}', 'perimeter',
+            lambda lod, seg=(x1, y1, x2, y2): draw_perimeter_wall_segment(*seg, lod=lod),
+            [min(x1, x2) - pad, min(y1, y2) - pad, 0],
+            [max(x1, x2) + pad, max(y1, y2) + pad, PERIMETER_WALL_HEIGHT + 300]))
+    
+    for i, (x, y, z, width, height, depth) in enumerate(mountain_positions):
+        objects.append(make_scene_object(
+            f'mountain {i + 1}', 'mountain',
+            lambda lod, m=(x, y, z, width, height, depth): draw_rocky_mountain(*m, lod=lod),
+            [x - width/2, y - depth/2, z - height/2], [x + width/2, y + depth/2, z + height/2]))
+    
+    # Vegetation is grouped per grid cell so each cell stays one instanced draw
+    cells = {}
+    for kind, positions in zip(('trees', 'bushes'), get_safe_vegetation()):
+        for x, y in positions:
+            key = (int(x // VEGETATION_CELL_SIZE), int(y // VEGETATION_CELL_SIZE))
+            cells.setdefault(key, {'trees': [], 'bushes': []})[kind].append((x, y))
+    
+    for (cx, cy), cell in sorted(cells.items()):
+        points = np.array(cell['trees'] + cell['bushes'], dtype=np.float64)
+        objects.append(make_scene_object(
+            f'vegetation {cx},{cy}', 'vegetation', lambda lod, c=cell: draw_vegetation(c['trees'], c['bushes'], lod),
+            [points[:, 0].min() - 150, points[:, 1].min() - 150, 0],
+            [points[:, 0].max() + 150, points[:, 1].max() + 150, 330]))
+    
+    return objects
+
+def build_bvh(objects):
+    """Build an AABB tree by median split along the longest axis of object centers"""
+    node = {
+        'min': np.min([obj['min'] for obj in objects], axis=0),
+        'max': np.max([obj['max'] for obj in objects], axis=0),
+        'objects': objects,
+        'children': []
+    }
+    if len(objects) > BVH_LEAF_SIZE:
+        centers = np.array([(obj['min'] + obj['max']) / 2 for obj in objects])
+        axis = int(np.argmax(centers.max(axis=0) - centers.min(axis=0)))
+        order = np.argsort(centers[:, axis], kind='stable')
+        half = len(objects) // 2
+        node['children'] = [build_bvh([objects[i] for i in order[:half]]),
+                            build_bvh([objects[i] for i in order[half:]])]
+    return node
+
+def build_static_scene():
+    """Collect scene objects and their BVH; display lists are compiled on first draw"""
+    global scene_objects, scene_bvh, scene_key
+    
+    for obj in scene_objects:
+        for display_list in obj['lists'].values():
+            glDeleteLists(display_list, 1)
+    
+    scene_objects = collect_scene_objects()
+    reset_world_streaming(scene_objects)
+    # The profiler wants to see the draw functions run, so it always gets live geometry
+    if SCENE_CACHE_DIR and not profiler['enabled'] and not world_stream['enabled']:
+        attach_baked_geometry(scene_objects)
+    scene_bvh = build_bvh(scene_objects)
+    scene_key = get_static_scene_key()
+    # The same config change moves the collision volumes and the walkable cells
+    invalidate_collision_index()
+    invalidate_nav_graph()
+    invalidate_static_colliders()
+
+def invalidate_color_scheme(name):
+    """Drop the display lists, baked geometry and streamed chunks of objects drawn with a scheme"""
+    stale_chunks = {}
+    for obj in scene_objects:
+        if obj['scheme'] != name:
+            continue
+        for display_list in obj['lists'].values():
+            glDeleteLists(display_list, 1)
+        obj['lists'] = {}
+        # Baked colors are stale too; the object draws live until the next bake
+        obj['baked'] = None
+        if world_stream['enabled']:
+            chunk = world_chunks[obj['chunk']]
+            stale_chunks[chunk['key']] = chunk
+    for chunk in stale_chunks.values():
+        reset_world_chunk(chunk)
+
+def select_lod(obj, eye):
+    """Pick the object's LOD tier from camera distance, with hysteresis against popping"""
+    thresholds = LOD_DISTANCES.get(obj['kind'])
+    if thresholds is None:
+        return 0
+    
+    distance = np.linalg.norm(np.clip(eye, obj['min'], obj['max']) - eye)
+    lod = obj['lod']
+    while lod < len(thresholds) and distance > thresholds[lod] * (1 + LOD_HYSTERESIS):
+        lod += 1
+    while lod > 0 and distance < thresholds[lod - 1] * (1 - LOD_HYSTERESIS):
+        lod -= 1
+    obj['lod'] = lod
+    return lod
+
+def draw_scene_object(obj, lod=0):
+    """Replay an object's display list for a LOD tier, recording it the first time"""
+    if lod not in obj['lists']:
+        obj['lists'][lod] = glGenLists(1)
+        glNewList(obj['lists'][lod], GL_COMPILE)
+        if obj.get('baked') is not None:
+            draw_baked_batches(obj['baked'][lod])
+        else:
+            obj['draw'](lod)
+            flush_instances()
+        glEndList()
+    glCallList(obj['lists'][lod])
+
+def perspective_matrix(fovy, aspect, near, far):
+    """Same matrix as gluPerspective"""
+    f = 1.0 / np.tan(np.radians(fovy) / 2)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+        [0, 0, -1, 0]
+    ])
+
+def look_at_matrix(eye, center, up):
+    """Same matrix as gluLookAt"""
+    eye = np.asarray(eye, dtype=np.float64)
+    forward = np.asarray(center, dtype=np.float64) - eye
+    forward /= np.linalg.norm(forward)
+    side = np.cross(forward, up)
+    side /= np.linalg.norm(side)
+    true_up = np.cross(side, forward)
+    
+    m = np.identity(4)
+    m[0, :3], m[1, :3], m[2, :3] = side, true_up, -forward
+    m[:3, 3] = -m[:3, :3] @ eye
+    return m
+
+def get_view_frustum():
+    """Six inward-facing planes (a, b, c, d) of the current camera frustum"""
+    eye = get_camera_eye()
+    m = perspective_matrix(fovY, CAMERA_ASPECT, CAMERA_NEAR, CAMERA_FAR) @ look_at_matrix(eye, player_pos, [0, 0, 1])
+    planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+def classify_aabb(planes, min_corner, max_corner):
+    """-1 if the box is outside the frustum, 1 if fully inside, 0 if it straddles a plane"""
+    normals, offsets = planes[:, :3], planes[:, 3]
+    far_corner = np.where(normals >= 0, max_corner, min_corner)
+    if np.any(np.einsum('ij,ij->i', normals, far_corner) + offsets < 0):
+        return -1
+    near_corner = np.where(normals >= 0, min_corner, max_corner)
+    if np.all(np.einsum('ij,ij->i', normals, near_corner) + offsets >= 0):
+        return 1
+    return 0
+
+def collect_visible(node, planes, visible):
+    """Walk the BVH, appending objects whose bounds touch the frustum"""
+    cull_stats['tested'] += 1
+    state = classify_aabb(planes, node['min'], node['max'])
+    if state < 0:
+        cull_stats['culled'] += len(node['objects'])
+    elif state > 0 or not node['children']:
+        visible.extend(node['objects'])
+    else:
+        for child in node['children']:
+            collect_visible(child, planes, visible)
+
+def draw_static_scene():
+    """Draw the ground and the cached scenery that is inside the view frustum"""
+    if scene_key != get_static_scene_key():
+        build_static_scene()
+    
+    planes = get_view_frustum()
+    draw_multi_colored_grid(planes)
+    
+    cull_stats['tested'] = cull_stats['culled'] = 0
+    visible = []
+    if world_stream['enabled']:
+        update_world_streaming()
+        # Only uploaded chunks can be drawn, so cull those instead of the whole world
+        collect_visible_world_chunks(planes, visible)
+    else:
+        collect_visible(scene_bvh, planes, visible)
+    cull_stats['drawn'] = len(visible)
+    
+    eye = np.array(get_camera_eye())
+    for obj in visible:
+        draw_scene_object(obj, select_lod(obj, eye))
+
+# Scene files: JSON or TOML with castles, central_rock, mountains and vegetation, plus
+# optional perimeter_walls ([x1, y1, x2, y2] segments), grid_length (ground size) and
+# color_schemes ({name: [r, g, b] gains}, see register_color_scheme).
+# The static objects of a scene are baked once into world-space (r, g, b, x, y, z) float32
+# vertices by replaying their draw functions against a CPU recorder instead of GL. The
+# bake is stored in SCENE_CACHE_DIR as <key>.bin plus a <key>.json batch index, keyed by
+# a hash of the scene contents and this file's source, and memory-mapped on later runs.
+# Each new bake deletes the bakes of older sources and the least recently used bakes past
+# SCENE_CACHE_MAX_BYTES.
+SCENE_CACHE_DIR = os.environ.get('CASTLE_SCENE_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   '.scene_cache'))
+SCENE_CACHE_MAX_BYTES = 1 << 30
+SCENE_CASTLE_KEYS = ['position', 'size', 'height', 'roof_z', 'tower_radius', 'floors',
+                     'wall_thickness', 'wall_height', 'color_scheme']
+BAKE_GL_HOOKS = ['glPushMatrix', 'glPopMatrix', 'glTranslatef', 'glRotatef', 'glScalef', 'glColor3f',
+                 'glBegin', 'glEnd', 'glVertex3f', 'glLineWidth', 'glEnableClientState',
+                 'glDisableClientState', 'glVertexPointer', 'glColorPointer', 'glDrawArrays']
+with open(os.path.abspath(__file__), 'rb') as source_file:
+    SOURCE_HASH = hashlib.sha256(source_file.read()).hexdigest()
+# While any bake runs, the GL names in BAKE_GL_HOOKS dispatch per thread: calls from a
+# baking thread go to its recorder, everything else to the real GL
+bake_local = threading.local()
+bake_lock = threading.Lock()
+bake_hooks = {'active': 0, 'originals': {}, 'installed': {}}
+# Cache misses bake in a process pool of this many workers (1 bakes in-process)
+BAKE_WORKERS = int(os.environ.get('CASTLE_BAKE_WORKERS', os.cpu_count() or 1))
+BAKE_PARALLEL_MIN_OBJECTS = 64
+bake_worker_objects = {}
+scene_cache_stats = {'hash': None, 'hit': False, 'bake_time': 0.0, 'load_time': 0.0, 'bytes': 0}
+
+def load_scene_file(path):
+    """Parse a .json or .toml scene file and check it has everything apply_scene needs"""
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            scene = tomllib.load(f)
+    else:
+        with open(path) as f:
+            scene = json.load(f)
+    
+    for key in ('castles', 'central_rock', 'mountains', 'vegetation'):
+        if key not in scene:
+            raise ValueError(f"{path}: scene is missing '{key}'")
+    for i, castle in enumerate(scene['castles']):
+        missing = [key for key in SCENE_CASTLE_KEYS if key not in castle]
+        if missing:
+            raise ValueError(f"{path}: castle {i + 1} is missing {', '.join(missing)}")
+    for i, mountain in enumerate(scene['mountains']):
+        if not {'position', 'width', 'height', 'depth'} <= set(mountain):
+            raise ValueError(f"{path}: mountain {i + 1} needs position, width, height and depth")
+    return scene
+
+def apply_scene(scene):
+    """Replace the scene globals with a parsed scene and put the player on the rock tower"""
+    global castle_configs, central_rock_pos, mountain_positions, tree_positions, bush_positions
+    global vegetation_clearance, perimeter_wall_layout, GRID_LENGTH
+    
+    castle_configs = [{key: castle[key] for key in SCENE_CASTLE_KEYS} for castle in scene['castles']]
+    central_rock_pos = list(scene['central_rock'])
+    mountain_positions = [tuple(m['position']) + (m['width'], m['height'], m['depth']) for m in scene['mountains']]
+    vegetation = scene['vegetation']
+    tree_positions = [tuple(p) for p in vegetation.get('trees', [])]
+    bush_positions = [tuple(p) for p in vegetation.get('bushes', [])]
+    vegetation_clearance = vegetation.get('clearance', 900)
+    perimeter_wall_layout = scene.get('perimeter_walls')
+    GRID_LENGTH = scene.get('grid_length', 500)
+    for name, gains in scene.get('color_schemes', {}).items():
+        register_color_scheme(name, gains)
+    
+    player_pos[:] = [central_rock_pos[0], central_rock_pos[1], central_rock_pos[2] + 1630]
+    invalidate_static_scene()
+
+def load_scene(path=SCENE_PATH):
+    """Load a scene file into the game"""
+    apply_scene(load_scene_file(path))
+
+def scene_to_dict():
+    """The current scene globals in scene file form"""
+    return {
+        'castles': castle_configs,
+        'central_rock': central_rock_pos,
+        'mountains': [{'position': list(m[:3]), 'width': m[3], 'height': m[4], 'depth': m[5]}
+                      for m in mountain_positions],
+        'vegetation': {'clearance': vegetation_clearance,
+                       'trees': [list(p) for p in tree_positions],
+                       'bushes': [list(p) for p in bush_positions]},
+        'perimeter_walls': perimeter_wall_layout,
+        'grid_length': GRID_LENGTH,
+        'color_schemes': {name: list(gains) for name, gains in COLOR_SCHEMES.items()}
+    }
+
+def get_scene_hash():
+    """Content hash of the current scene and the code that draws it"""
+    content = json.dumps(scene_to_dict(), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256((SOURCE_HASH + content).encode('utf-8')).hexdigest()[:32]
+
+def rotation_matrix(angle, x, y, z):
+    """Same matrix as glRotatef"""
+    axis = np.array([x, y, z], dtype=np.float64)
+    axis /= np.linalg.norm(axis)
+    x, y, z = axis
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    m = np.identity(4)
+    m[:3, :3] = [
+        [x*x*(1 - c) + c, x*y*(1 - c) - z*s, x*z*(1 - c) + y*s],
+        [y*x*(1 - c) + z*s, y*y*(1 - c) + c, y*z*(1 - c) - x*s],
+        [x*z*(1 - c) - y*s, y*z*(1 - c) + x*s, z*z*(1 - c) + c]
+    ]
+    return m
+
+def primitive_indices(mode, count):
+    """Base mode (GL_TRIANGLES, GL_QUADS or GL_LINES) and vertex order that split a strip, fan or loop"""
+    i = np.arange(count)
+    if mode in (GL_TRIANGLES, GL_QUADS, GL_LINES):
+        return mode, i
+    if mode in (GL_TRIANGLE_FAN, GL_POLYGON):
+        k = i[1:-1]
+        return GL_TRIANGLES, np.column_stack((np.zeros_like(k), k, k + 1)).ravel()
+    if mode == GL_TRIANGLE_STRIP:
+        k = i[:-2]
+        odd = k % 2 == 1
+        tris = np.column_stack((np.where(odd, k + 1, k), np.where(odd, k, k + 1), k + 2))
+        return GL_TRIANGLES, tris.ravel()
+    if mode == GL_QUAD_STRIP:
+        k = 2 * np.arange(max(count - 2, 0) // 2)
+        return GL_QUADS, np.column_stack((k, k + 1, k + 3, k + 2)).ravel()
+    if mode == GL_LINE_STRIP:
+        return GL_LINES, np.column_stack((i[:-1], i[1:])).ravel()
+    if mode == GL_LINE_LOOP:
+        return GL_LINES, np.column_stack((i, np.roll(i, -1))).ravel() if count > 1 else i[:0]
+    raise ValueError(f"Cannot bake primitive mode {mode}")
+
+def new_recorder():
+    """Empty recording state: identity transform, white, no batches"""
+    return {
+        'matrices': [np.identity(4)],
+        'color': (1.0, 1.0, 1.0),
+        'line_width': 1.0,
+        'begin': None,
+        'client_states': set(),
+        'vertex_pointer': None,
+        'color_pointer': None,
+        'batches': []
+    }
+
+def record_geometry(recorder, mode, vertices, colors):
+    """Transform a primitive batch to world space and append it to the recording"""
+    base_mode, order = primitive_indices(mode, len(vertices))
+    if len(order) == 0:
+        return
+    matrix = recorder['matrices'][-1]
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)[order]
+    world = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+    data = np.empty((len(order), 6), dtype=np.float32)
+    data[:, 0:3] = np.asarray(colors, dtype=np.float64).reshape(-1, 3)[order]
+    data[:, 3:6] = world
+    
+    line_width = recorder['line_width'] if base_mode == GL_LINES else 1.0
+    batches = recorder['batches']
+    # Consecutive primitives with the same state share one draw call
+    if batches and batches[-1][0] == base_mode and batches[-1][1] == line_width:
+        batches[-1][2].append(data)
+    else:
+        batches.append([base_mode, line_width, [data]])
+
+def make_recording_gl_hook(name, recorder):
+    """CPU stand-in for a GL entry point used by the static draw functions"""
+    if name == 'glPushMatrix':
+        def hook():
+            recorder['matrices'].append(recorder['matrices'][-1].copy())
+    elif name == 'glPopMatrix':
+        def hook():
+            recorder['matrices'].pop()
+    elif name == 'glTranslatef':
+        def hook(x, y, z):
+            translation = np.identity(4)
+            translation[:3, 3] = (x, y, z)
+            recorder['matrices'][-1] = recorder['matrices'][-1] @ translation
+    elif name == 'glRotatef':
+        def hook(angle, x, y, z):
+            recorder['matrices'][-1] = recorder['matrices'][-1] @ rotation_matrix(angle, x, y, z)
+    elif name == 'glScalef':
+        def hook(x, y, z):
+            recorder['matrices'][-1] = recorder['matrices'][-1] @ np.diag([x, y, z, 1.0])
+    elif name == 'glColor3f':
+        def hook(r, g, b):
+            recorder['color'] = (r, g, b)
+    elif name == 'glBegin':
+        def hook(mode):
+            recorder['begin'] = (mode, [], [])
+    elif name == 'glVertex3f':
+        def hook(x, y, z):
+            recorder['begin'][1].append((x, y, z))
+            recorder['begin'][2].append(recorder['color'])
+    elif name == 'glEnd':
+        def hook():
+            mode, vertices, colors = recorder['begin']
+            record_geometry(recorder, mode, vertices, colors)
+            recorder['begin'] = None
+    elif name == 'glLineWidth':
+        def hook(width):
+            recorder['line_width'] = width
+    elif name == 'glEnableClientState':
+        def hook(state):
+            recorder['client_states'].add(state)
+    elif name == 'glDisableClientState':
+        def hook(state):
+            recorder['client_states'].discard(state)
+    elif name == 'glVertexPointer':
+        def hook(size, data_type, stride, pointer):
+            recorder['vertex_pointer'] = np.asarray(pointer).reshape(-1, size)
+    elif name == 'glColorPointer':
+        def hook(size, data_type, stride, pointer):
+            recorder['color_pointer'] = np.asarray(pointer).reshape(-1, size)
+    else:
+        def hook(mode, first, count):
+            vertices = recorder['vertex_pointer'][first:first + count]
+            if GL_COLOR_ARRAY in recorder['client_states']:
+                colors = recorder['color_pointer'][first:first + count, :3]
+            else:
+                colors = np.tile(recorder['color'], (count, 1))
+            record_geometry(recorder, mode, vertices, colors)
+    return hook
+
+def make_dispatching_gl_hook(name, original):
+    """GL entry point that goes to the calling thread's recorder while it is baking"""
+    def hook(*args):
+        hooks = getattr(bake_local, 'hooks', None)
+        if hooks is None:
+            return original(*args)
+        return hooks[name](*args)
+    return hook
+
+def install_bake_hooks():
+    with bake_lock:
+        if bake_hooks['active'] == 0:
+            module = globals()
+            bake_hooks['originals'] = {name: module[name] for name in BAKE_GL_HOOKS}
+            bake_hooks['installed'] = {name: make_dispatching_gl_hook(name, module[name]) for name in BAKE_GL_HOOKS}
+            module.update(bake_hooks['installed'])
+        bake_hooks['active'] += 1
+
+def remove_bake_hooks():
+    with bake_lock:
+        bake_hooks['active'] -= 1
+        if bake_hooks['active'] == 0:
+            module = globals()
+            # Leave a name alone if something (the profiler) wrapped it after us
+            for name, original in bake_hooks['originals'].items():
+                if module[name] is bake_hooks['installed'][name]:
+                    module[name] = original
+
+def record_draw(draw):
+    """Run draw() through a recorder; returns [(mode, line_width, (count, 6) float32 array), ...]
+    
+    Instances the caller has queued are set aside, so this is safe in the middle of a frame.
+    """
+    recorder = new_recorder()
+    outer_queue = get_instance_queue()
+    instance_queues.queue = {}
+    install_bake_hooks()
+    try:
+        bake_local.hooks = {name: make_recording_gl_hook(name, recorder) for name in BAKE_GL_HOOKS}
+        draw()
+        flush_instances()
+    finally:
+        bake_local.hooks = None
+        instance_queues.queue = outer_queue
+        remove_bake_hooks()
+    return [(mode, width, np.concatenate(chunks)) for mode, width, chunks in recorder['batches']]
+
+def bake_object(obj):
+    """Run an object's draw function for every LOD tier through a recorder
+    
+    Returns {lod: [(mode, line_width, (count, 6) float32 array), ...]}. No GL context is
+    needed, and it is safe to call from a worker thread while the main thread draws.
+    """
+    tiers = range(LOD_FAR + 1) if obj['kind'] in LOD_DISTANCES else [0]
+    return {lod: record_draw(lambda: obj['draw'](lod)) for lod in tiers}
+
+def pack_baked_object(baked):
+    """One object's tiers as a single float32 array plus [mode, width, row, count] batches"""
+    tiers, arrays, rows = {}, [], 0
+    for lod, batches in baked.items():
+        tiers[str(lod)] = []
+        for mode, width, data in batches:
+            tiers[str(lod)].append([int(mode), width, rows, len(data)])
+            arrays.append(data)
+            rows += len(data)
+    return tiers, np.concatenate(arrays) if arrays else np.zeros((0, 6), dtype=np.float32)
+
+def bake_worker_init(scene):
+    """Pool initializer: rebuild the scene objects (draw closures do not pickle)"""
+    global bake_worker_objects
+    apply_scene(scene)
+    bake_worker_objects = {obj['name']: obj for obj in collect_scene_objects()}
+
+def bake_worker_task(names):
+    """Bake a run of objects into one shared memory block; only its name and the index are pickled"""
+    packed = [(name,) + pack_baked_object(bake_object(bake_worker_objects[name])) for name in names]
+    total = sum(data.nbytes for _, _, data in packed)
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+    results, start = [], 0
+    for name, tiers, data in packed:
+        block.buf[start:start + data.nbytes] = data.tobytes()
+        results.append((name, tiers, start, data.nbytes))
+        start += data.nbytes
+    block.close()
+    return block.name, results
+
+def bake_objects_parallel(objects, workers):
+    """Yield (name, tiers, bytes) per object, in order, baked by a process pool"""
+    names = [obj['name'] for obj in objects]
+    # Several small contiguous runs per worker keep the cores busy despite uneven objects
+    run = max(1, len(names) // (workers * 8))
+    runs = [names[i:i + run] for i in range(0, len(names), run)]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=bake_worker_init, initargs=(scene_to_dict(),)) as pool:
+        for block_name, results in pool.imap(bake_worker_task, runs):
+            block = shared_memory.SharedMemory(name=block_name)
+            try:
+                for name, tiers, start, size in results:
+                    yield name, tiers, bytes(block.buf[start:start + size])
+            finally:
+                block.close()
+                block.unlink()
+
+def bake_objects_serial(objects):
+    """Yield (name, tiers, bytes) per object, baked in this process"""
+    for obj in objects:
+        tiers, data = pack_baked_object(bake_object(obj))
+        yield obj['name'], tiers, data.tobytes()
+
+def bake_scene(path, objects, workers=None):
+    """Bake objects straight into the cache files, written atomically
+    
+    Vertices go to <path>.bin as raw float32 rows, so only a few objects' geometry is in
+    memory at a time; <path>.json maps object name and LOD tier to its batches. With more
+    than one worker and at least BAKE_PARALLEL_MIN_OBJECTS objects the baking runs in a
+    process pool; objects are written in the same order, so the files are byte-identical.
+    """
+    workers = BAKE_WORKERS if workers is None else workers
+    if workers > 1 and len(objects) >= BAKE_PARALLEL_MIN_OBJECTS:
+        baked_objects = bake_objects_parallel(objects, workers)
+    else:
+        baked_objects = bake_objects_serial(objects)
+    
+    index, offset = {}, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.bin.tmp', 'wb') as f:
+        for name, tiers, data in baked_objects:
+            index[name] = {lod: [[mode, width, offset + row, count] for mode, width, row, count in batches]
+                           for lod, batches in tiers.items()}
+            f.write(data)
+            offset += len(data) // 24  # six float32 per vertex
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.bin.tmp', path + '.bin')
+    os.replace(path + '.json.tmp', path + '.json')
+
+def load_baked_scene(path):
+    """Memory-map a baked scene; returns (geometry, index) or None if it is not cached"""
+    if not (os.path.exists(path + '.bin') and os.path.exists(path + '.json')):
+        return None
+    with open(path + '.json') as f:
+        index = json.load(f)
+    if os.path.getsize(path + '.bin') == 0:
+        return np.zeros((0, 6), dtype=np.float32), index
+    return np.memmap(path + '.bin', dtype=np.float32, mode='r').reshape(-1, 6), index
+
+def prune_scene_cache(keep):
+    """Delete bakes made by other versions of this file, then least recently used ones past the cap
+    
+    The bake named keep always stays, even if it alone is bigger than SCENE_CACHE_MAX_BYTES.
+    """
+    bakes = []
+    for name in os.listdir(SCENE_CACHE_DIR):
+        key, ext = os.path.splitext(name)
+        if ext != '.bin' or key == keep:
+            continue
+        path = os.path.join(SCENE_CACHE_DIR, key)
+        try:
+            stat = os.stat(path + '.bin')
+        except FileNotFoundError:
+            continue
+        bakes.append((not key.startswith(SOURCE_HASH[:12] + '-'), stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, _, size, _ in bakes) + os.path.getsize(os.path.join(SCENE_CACHE_DIR, keep + '.bin'))
+    # Other sources first, then oldest first
+    for stale, _, size, path in sorted(bakes, key=lambda bake: (not bake[0], bake[1])):
+        if not stale and total <= SCENE_CACHE_MAX_BYTES:
+            break
+        for ext in ('.bin', '.json'):
+            try:
+                os.remove(path + ext)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+def attach_baked_geometry(objects):
+    """Give every object its baked batches, baking and caching the scene on a miss"""
+    scene_hash = get_scene_hash()
+    # The source prefix lets prune_scene_cache spot bakes no version of this file will load
+    key = f'{SOURCE_HASH[:12]}-{scene_hash}'
+    path = os.path.join(SCENE_CACHE_DIR, key)
+    
+    start = time.perf_counter()
+    cached = load_baked_scene(path)
+    scene_cache_stats.update(hash=scene_hash, hit=cached is not None, bake_time=0.0)
+    if cached is None:
+        bake_scene(path, objects)
+        prune_scene_cache(key)
+        scene_cache_stats['bake_time'] = time.perf_counter() - start
+        start = time.perf_counter()
+        cached = load_baked_scene(path)
+    else:
+        os.utime(path + '.bin')
+    geometry, index = cached
+    scene_cache_stats.update(load_time=time.perf_counter() - start, bytes=geometry.nbytes)
+    
+    for obj in objects:
+        obj['baked'] = {int(lod): [(mode, width, geometry[offset:offset + count])
+                                   for mode, width, offset, count in batches]
+                        for lod, batches in index[obj['name']].items()}
+
+def draw_baked_batches(batches):
+    """Draw baked (mode, line_width, interleaved C3F_V3F array) batches"""
+    for mode, width, data in batches:
+        if width != 1.0:
+            glLineWidth(width)
+        glInterleavedArrays(GL_C3F_V3F, 0, np.ascontiguousarray(data))
+        glDrawArrays(mode, 0, len(data))
+        if width != 1.0:
+            glLineWidth(1.0)
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+# World streaming for scenes larger than the stock ground: scene objects are grouped into
+# WORLD_CHUNK_SIZE cells, chunks near the player are baked on a worker thread and turned
+# into display lists on the main thread within WORLD_UPLOAD_BUDGET_MS per frame, and the
+# least recently drawn chunks are evicted once resident geometry passes the memory cap.
+WORLD_STREAMING = os.environ.get('CASTLE_STREAMING', 'auto')  # 'on', 'off' or 'auto'
+WORLD_STREAMING_AUTO_EXTENT = 10000  # 'auto' streams once the ground is bigger than this
+WORLD_CHUNK_SIZE = 8000
+WORLD_STREAM_RADIUS = 24000
+WORLD_MAX_RESIDENT_BYTES = 512 * 1024 * 1024
+WORLD_UPLOAD_BUDGET_MS = 4.0
+world_chunks = {}
+world_resident = OrderedDict()  # chunk key -> chunk, least recently drawn first
+world_stream = {
+    'enabled': False,
+    'generation': 0,
+    'jobs': queue.PriorityQueue(),
+    'done': queue.Queue(),
+    'sequence': itertools.count(),
+    'uploading': deque(),
+    'worker': None
+}
+world_stream_stats = {
+    'resident': 0, 'resident_bytes': 0, 'pending': 0, 'requested': 0, 'built': 0, 'evicted': 0,
+    'build_ms_last': 0.0, 'build_ms_max': 0.0, 'build_ms_total': 0.0,
+    'upload_ms_last': 0.0, 'upload_stalls': 0
+}
+
+def world_streaming_wanted():
+    """Whether the current scene should stream; the profiler always sees live drawing"""
+    if profiler['enabled'] or WORLD_STREAMING == 'off':
+        return False
+    return WORLD_STREAMING == 'on' or get_ground_extent()[0] > WORLD_STREAMING_AUTO_EXTENT
+
+def reset_world_streaming(objects):
+    """Forget all chunks (their display lists are already gone) and regroup the objects"""
+    world_stream['generation'] += 1
+    world_stream['enabled'] = world_streaming_wanted()
+    world_stream['uploading'].clear()
+    world_chunks.clear()
+    world_resident.clear()
+    world_stream_stats.update(resident=0, resident_bytes=0, pending=0)
+    if not world_stream['enabled']:
+        return
+    
+    for obj in objects:
+        center = (obj['min'] + obj['max']) / 2
+        key = (int(center[0] // WORLD_CHUNK_SIZE), int(center[1] // WORLD_CHUNK_SIZE))
+        obj['chunk'] = key
+        chunk = world_chunks.setdefault(key, {'key': key, 'objects': [], 'state': 'idle', 'bytes': 0,
+                                             'baked': None, 'pending': [],
+                                             'min': obj['min'].copy(), 'max': obj['max'].copy()})
+        chunk['objects'].append(obj)
+        chunk['min'] = np.minimum(chunk['min'], obj['min'])
+        chunk['max'] = np.maximum(chunk['max'], obj['max'])
+
+def world_chunk_distance(key, x, y):
+    """Distance from a point to the nearest edge of a chunk (0 inside it)"""
+    dx = max(key[0] * WORLD_CHUNK_SIZE - x, 0, x - (key[0] + 1) * WORLD_CHUNK_SIZE)
+    dy = max(key[1] * WORLD_CHUNK_SIZE - y, 0, y - (key[1] + 1) * WORLD_CHUNK_SIZE)
+    return sqrt(dx * dx + dy * dy)
+
+def world_worker_loop():
+    """Bake requested chunks nearest first; results go back to the main thread"""
+    while True:
+        _, _, generation, chunk = world_stream['jobs'].get()
+        if generation != world_stream['generation'] or chunk['state'] != 'queued':
+            continue
+        chunk['state'] = 'building'
+        start = time.perf_counter()
+        try:
+            baked = {obj['name']: bake_object(obj) for obj in chunk['objects']}
+            error = None
+        except Exception as exc:
+            baked, error = None, exc
+        world_stream['done'].put((generation, chunk, baked, error, time.perf_counter() - start))
+
+def request_world_chunk(chunk, distance):
+    chunk['state'] = 'queued'
+    world_stream['jobs'].put((distance, next(world_stream['sequence']), world_stream['generation'], chunk))
+    world_stream_stats['requested'] += 1
+    if world_stream['worker'] is None:
+        world_stream['worker'] = threading.Thread(target=world_worker_loop, name='castle-world-builder', daemon=True)
+        world_stream['worker'].start()
+
+def collect_built_world_chunks():
+    """Take finished bakes off the worker's queue and line them up for upload"""
+    while True:
+        try:
+            generation, chunk, baked, error, elapsed = world_stream['done'].get_nowait()
+        except queue.Empty:
+            return
+        if generation != world_stream['generation'] or chunk['state'] != 'building':
+            continue
+        if error is not None:
+            raise RuntimeError(f"Building world chunk {chunk['key']} failed") from error
         
-        # DEBUG: Print boundaries for Castle 3
-        if i == 2:  # Castle 3 at index 2
-            print(f"Castle 3 boundaries: X[{min_x}, {max_x}] Y[{min_y}, {max_y}] Z[{z_min}, {z_max}]")
-            print(f"Player at: ({x}, {y}, {z})")
+        chunk.update(state='built', baked=baked, pending=list(chunk['objects']))
+        chunk['bytes'] = sum(data.nbytes for tiers in baked.values()
+                             for batches in tiers.values() for _, _, data in batches)
+        world_stream['uploading'].append(chunk)
+        
+        build_ms = elapsed * 1000
+        world_stream_stats['built'] += 1
+        world_stream_stats['build_ms_last'] = build_ms
+        world_stream_stats['build_ms_max'] = max(world_stream_stats['build_ms_max'], build_ms)
+        world_stream_stats['build_ms_total'] += build_ms
+
+def upload_world_chunks(budget_ms):
+    """Compile display lists for built chunks, one object at a time, until the budget is spent"""
+    start = time.perf_counter()
+    uploading = world_stream['uploading']
+    while uploading:
+        if (time.perf_counter() - start) * 1000 >= budget_ms:
+            world_stream_stats['upload_stalls'] += 1
+            break
+        chunk = uploading[0]
+        obj = chunk['pending'].pop()
+        for lod, batches in chunk['baked'][obj['name']].items():
+            obj['lists'][lod] = glGenLists(1)
+            glNewList(obj['lists'][lod], GL_COMPILE)
+            draw_baked_batches(batches)
+            glEndList()
         
-        # Add buffer zone for detection
-        BUFFER_ZONE = 100  # Allow 100 units outside boundaries for detection
+        if not chunk['pending']:
+            uploading.popleft()
+            chunk.update(state='resident', baked=None)
+            world_resident[chunk['key']] = chunk
+            world_stream_stats['resident_bytes'] += chunk['bytes']
+    world_stream_stats['upload_ms_last'] = (time.perf_counter() - start) * 1000
+
+def evict_world_chunk(chunk):
+    for obj in chunk['objects']:
+        for display_list in obj['lists'].values():
+            glDeleteLists(display_list, 1)
+        obj['lists'] = {}
+    chunk['state'] = 'idle'
+    del world_resident[chunk['key']]
+    world_stream_stats['resident_bytes'] -= chunk['bytes']
+    world_stream_stats['evicted'] += 1
+
+def reset_world_chunk(chunk):
+    """Send a chunk back to idle wherever it is, so it is built again with current data"""
+    if chunk['state'] == 'resident':
+        evict_world_chunk(chunk)
+        return
+    if chunk in world_stream['uploading']:
+        world_stream['uploading'].remove(chunk)
+        for obj in chunk['objects']:
+            for display_list in obj['lists'].values():
+                glDeleteLists(display_list, 1)
+            obj['lists'] = {}
+    # A bake still running for it is dropped by collect_built_world_chunks
+    chunk.update(state='idle', baked=None, pending=[])
+
+def update_world_streaming(budget_ms=WORLD_UPLOAD_BUDGET_MS):
+    """Request chunks near the player, upload finished ones and evict over the memory cap
+    
+    Returns the keys of the chunks within WORLD_STREAM_RADIUS.
+    """
+    x, y = player_pos[0], player_pos[1]
+    reach = int(WORLD_STREAM_RADIUS // WORLD_CHUNK_SIZE) + 1
+    ci, cj = int(x // WORLD_CHUNK_SIZE), int(y // WORLD_CHUNK_SIZE)
+    wanted = {}
+    for i in range(ci - reach, ci + reach + 1):
+        for j in range(cj - reach, cj + reach + 1):
+            if (i, j) in world_chunks:
+                distance = world_chunk_distance((i, j), x, y)
+                if distance <= WORLD_STREAM_RADIUS:
+                    wanted[(i, j)] = distance
+    
+    for key, chunk in world_chunks.items():
+        if chunk['state'] == 'idle' and key in wanted:
+            request_world_chunk(chunk, wanted[key])
+        elif chunk['state'] == 'queued' and key not in wanted:
+            # The worker skips it; it is requested again if the player comes back
+            chunk['state'] = 'idle'
+    
+    collect_built_world_chunks()
+    upload_world_chunks(budget_ms)
+    
+    for chunk in list(world_resident.values()):
+        if world_stream_stats['resident_bytes'] <= WORLD_MAX_RESIDENT_BYTES:
+            break
+        if chunk['key'] not in wanted:
+            evict_world_chunk(chunk)
+    
+    world_stream_stats['resident'] = len(world_resident)
+    world_stream_stats['pending'] = sum(1 for key in wanted if key not in world_resident)
+    return list(wanted)
+
+def collect_visible_world_chunks(planes, visible):
+    """Frustum-cull the resident chunks, then the objects of partially visible ones"""
+    for chunk in list(world_resident.values()):
+        cull_stats['tested'] += 1
+        state = classify_aabb(planes, chunk['min'], chunk['max'])
+        if state < 0:
+            cull_stats['culled'] += len(chunk['objects'])
+            continue
+        world_resident.move_to_end(chunk['key'])
+        if state > 0:
+            visible.extend(chunk['objects'])
+            continue
+        for obj in chunk['objects']:
+            cull_stats['tested'] += 1
+            if classify_aabb(planes, obj['min'], obj['max']) < 0:
+                cull_stats['culled'] += 1
+            else:
+                visible.append(obj)
+
+def wait_for_world_chunks(timeout=120.0):
+    """Block until every chunk near the player is resident; True unless it timed out
+    
+    For headless renders and benchmarks that must not see half-streamed frames.
+    """
+    if scene_key != get_static_scene_key():
+        build_static_scene()
+    deadline = time.perf_counter() + timeout
+    while world_stream['enabled']:
+        wanted = update_world_streaming(budget_ms=float('inf'))
+        if all(key in world_resident for key in wanted):
+            return True
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+# HUD text: the GLUT bitmap fonts are rasterized once into an alpha texture atlas, each
+# string becomes a cached run of textured quads, and flush_text draws every string queued
+# this frame with one vertex array under one orthographic projection.
+TEXT_FONTS = [GLUT_BITMAP_HELVETICA_18, GLUT_BITMAP_HELVETICA_12]
+TEXT_CHARS = range(32, 127)  # anything else is drawn as '?'
+TEXT_ATLAS_COLUMNS = 16
+TEXT_CACHE_LIMIT = 256
+text_atlas = None
+text_cache = OrderedDict()  # (font, text) -> (N, 5) float32 T2F_V3F quads, least recently used first
+text_batch = []
+text_stats = {'strings': 0, 'cache_hits': 0, 'cache_misses': 0}
+
+def font_key(font):
+    return getattr(font, 'value', font)
+
+def build_text_atlas():
+    """Draw every glyph with glutBitmapCharacter once and read the result back as a texture
+    
+    Draws into the color buffer, so it runs before the frame is cleared. Each glyph gets a
+    cell with a margin of half the font height on every side, enough for the bitmap's
+    origin offset, and its quad covers the whole cell so it lands where the bitmap would.
+    """
+    global text_atlas
+    
+    fonts, atlas_width, atlas_height = [], 0, 0
+    for font in TEXT_FONTS:
+        height = glutBitmapHeight(font)
+        pad = height // 2
+        cell = (max(glutBitmapWidth(font, ch) for ch in TEXT_CHARS) + 2 * pad, height + 2 * pad)
+        rows = -(-len(TEXT_CHARS) // TEXT_ATLAS_COLUMNS)
+        fonts.append((font, pad, cell, atlas_height))
+        atlas_width = max(atlas_width, TEXT_ATLAS_COLUMNS * cell[0])
+        atlas_height += rows * cell[1]
+    if atlas_width > WINDOW_WIDTH or atlas_height > WINDOW_HEIGHT:
+        raise RuntimeError(f"Text atlas {atlas_width}x{atlas_height} does not fit the {WINDOW_WIDTH}x{WINDOW_HEIGHT} window")
+    
+    glViewport(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluOrtho2D(0, WINDOW_WIDTH, 0, WINDOW_HEIGHT)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    glColor3f(1, 1, 1)
+    
+    glyphs = {}
+    for font, pad, (cell_w, cell_h), top in fonts:
+        for i, ch in enumerate(TEXT_CHARS):
+            cell_x, cell_y = (i % TEXT_ATLAS_COLUMNS) * cell_w, top + (i // TEXT_ATLAS_COLUMNS) * cell_h
+            glRasterPos2f(cell_x + pad, cell_y + pad)
+            glutBitmapCharacter(font, ch)
+            glyphs[(font_key(font), ch)] = (
+                cell_x / atlas_width, cell_y / atlas_height,
+                (cell_x + cell_w) / atlas_width, (cell_y + cell_h) / atlas_height,
+                -pad, -pad, cell_w, cell_h, glutBitmapWidth(font, ch)
+            )
+    
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, atlas_width, atlas_height, GL_RED, GL_UNSIGNED_BYTE)
+    alpha = np.frombuffer(pixels, dtype=np.uint8)[:atlas_width * atlas_height].copy()
+    
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_ALPHA, atlas_width, atlas_height, 0, GL_ALPHA, GL_UNSIGNED_BYTE, alpha)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    text_atlas = {'texture': texture, 'width': atlas_width, 'height': atlas_height, 'glyphs': glyphs}
+    text_cache.clear()
+
+def build_text_mesh(text, font):
+    """T2F_V3F quads for a string with its baseline starting at the origin"""
+    glyphs, key = text_atlas['glyphs'], font_key(font)
+    quads = np.zeros((len(text), 4, 5), dtype=np.float32)
+    pen = 0
+    for i, ch in enumerate(text):
+        u0, v0, u1, v1, ox, oy, w, h, advance = glyphs.get((key, ord(ch))) or glyphs[(key, ord('?'))]
+        x0, y0 = pen + ox, oy
+        quads[i, :, 0:2] = [[u0, v0], [u1, v0], [u1, v1], [u0, v1]]
+        quads[i, :, 2:4] = [[x0, y0], [x0 + w, y0], [x0 + w, y0 + h], [x0, y0 + h]]
+        pen += advance
+    return quads.reshape(-1, 5)
+
+def get_text_mesh(text, font):
+    """Cached build_text_mesh; the HUD's fixed lines never get rebuilt"""
+    key = (font_key(font), text)
+    mesh = text_cache.get(key)
+    if mesh is not None:
+        text_cache.move_to_end(key)
+        text_stats['cache_hits'] += 1
+        return mesh
+    text_stats['cache_misses'] += 1
+    mesh = text_cache[key] = build_text_mesh(text, font)
+    if len(text_cache) > TEXT_CACHE_LIMIT:
+        text_cache.popitem(last=False)
+    return mesh
+
+def draw_text(x, y, text, font=None):
+    """Queue text for this frame's flush_text, at (x, y) in the HUD's 1000x800 space"""
+    if font is None:
+        font = GLUT_BITMAP_HELVETICA_18
+    if text_atlas is None:
+        raise RuntimeError("draw_text needs the text atlas; render_scene builds it when show_hud is set")
+    text_batch.append((x, y, get_text_mesh(text, font)))
+
+def flush_text():
+    """Draw all queued text as one textured vertex array"""
+    if not text_batch:
+        return
+    meshes = []
+    for x, y, mesh in text_batch:
+        mesh = mesh.copy()
+        mesh[:, 2] += x
+        mesh[:, 3] += y
+        meshes.append(mesh)
+    vertices = np.concatenate(meshes)
+    text_stats['strings'] = len(text_batch)
+    text_batch.clear()
+    
+    glMatrixMode(GL_PROJECTION)
+    glPushMatrix()
+    glLoadIdentity()
+    gluOrtho2D(0, 1000, 0, 800)
+    glMatrixMode(GL_MODELVIEW)
+    glPushMatrix()
+    glLoadIdentity()
+    
+    glColor3f(1, 1, 1)
+    glEnable(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, text_atlas['texture'])
+    # Like the bitmaps this replaces, only set glyph pixels are written (color and depth)
+    glEnable(GL_ALPHA_TEST)
+    glAlphaFunc(GL_GREATER, 0.5)
+    glInterleavedArrays(GL_T2F_V3F, 0, vertices)
+    glDrawArrays(GL_QUADS, 0, len(vertices))
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisable(GL_ALPHA_TEST)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    glDisable(GL_TEXTURE_2D)
+    
+    glPopMatrix()
+    glMatrixMode(GL_PROJECTION)
+    glPopMatrix()
+    glMatrixMode(GL_MODELVIEW)
+
+# Structured event log: call sites check log_levels before building an event, so a
+# category that is off costs one dict lookup. Events are buffered and written as JSON
+# lines by a background thread. Enable with e.g. CASTLE_LOG="clamp=debug,teleport=info".
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_OFF = 100
+LOG_LEVEL_NAMES = {'debug': LOG_DEBUG, 'info': LOG_INFO, 'warning': LOG_WARNING, 'off': LOG_OFF}
+LOG_CATEGORIES = ['collision', 'clamp', 'teleport', 'profiler']
+LOG_PATH = os.environ.get('CASTLE_LOG_PATH', 'castle_events.jsonl')
+LOG_FLUSH_INTERVAL = 0.5
+LOG_BUFFER_LIMIT = 100000
+# Token bucket per category: (events per second, burst)
+LOG_RATE_LIMITS = {'collision': (30, 60), 'clamp': (30, 60), 'teleport': (10, 20), 'profiler': (10, 20)}
+log_levels = {category: LOG_OFF for category in LOG_CATEGORIES}
+event_log = {
+    'buffer': deque(maxlen=LOG_BUFFER_LIMIT),
+    'buckets': {},
+    'suppressed': {},
+    'written': 0,
+    'writer': None,
+    'wake': threading.Event(),
+    'stop': False
+}
+
+def set_log_level(category, level):
+    """Set a category's level by name or number; 'all' sets every category"""
+    level = LOG_LEVEL_NAMES[level] if isinstance(level, str) else level
+    for name in (LOG_CATEGORIES if category == 'all' else [category]):
+        log_levels[name] = level
+
+def configure_logging(spec):
+    """Apply a "category=level,..." spec such as the CASTLE_LOG environment variable"""
+    for item in spec.split(','):
+        if item.strip():
+            category, _, level = item.partition('=')
+            set_log_level(category.strip(), level.strip() or 'info')
+
+def log_event(category, level, message, **fields):
+    """Buffer one event if the category's rate limit allows it
+    
+    Callers guard with `log_levels[category] <= level` so disabled categories never get here.
+    """
+    now = time.perf_counter()
+    rate, burst = LOG_RATE_LIMITS.get(category, (float('inf'), 1))
+    tokens, last = event_log['buckets'].get(category, (burst, now))
+    tokens = min(burst, tokens + (now - last) * rate)
+    if tokens < 1:
+        event_log['buckets'][category] = (tokens, now)
+        event_log['suppressed'][category] = event_log['suppressed'].get(category, 0) + 1
+        return
+    event_log['buckets'][category] = (tokens - 1, now)
+    
+    event = {'time': time.time(), 'category': category, 'level': level, 'message': message}
+    event.update(fields)
+    suppressed = event_log['suppressed'].pop(category, 0)
+    if suppressed:
+        event['suppressed'] = suppressed
+    event_log['buffer'].append(event)
+    
+    if event_log['writer'] is None:
+        start_log_writer()
+
+def flush_event_log(path=None):
+    """Append buffered events to the log file; returns how many were written"""
+    events = []
+    buffer = event_log['buffer']
+    while buffer:
+        events.append(buffer.popleft())
+    if events:
+        with open(path or LOG_PATH, 'a') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+        event_log['written'] += len(events)
+    return len(events)
+
+def log_writer_loop():
+    while not event_log['stop']:
+        event_log['wake'].wait(LOG_FLUSH_INTERVAL)
+        event_log['wake'].clear()
+        flush_event_log()
+
+def start_log_writer():
+    """Start the background writer the first time something is logged"""
+    event_log['stop'] = False
+    event_log['writer'] = threading.Thread(target=log_writer_loop, name='castle-event-log', daemon=True)
+    event_log['writer'].start()
+
+def shutdown_event_log():
+    """Stop the writer and dump whatever is still buffered"""
+    writer = event_log['writer']
+    if writer is not None:
+        event_log['stop'] = True
+        event_log['wake'].set()
+        writer.join()
+        event_log['writer'] = None
+    flush_event_log()
+
+configure_logging(os.environ.get('CASTLE_LOG', ''))
+atexit.register(shutdown_event_log)
+
+CASTLE_WALL_INSET = 50  # Same as in draw_single_castle
+COLLISION_BUFFER_ZONE = 100  # Allow 100 units outside boundaries for detection
+ROCK_PLATFORM_RADIUS = 120
+ROCK_STAIR_RADII = (180, 260)
+collision_index = None
+collision_key = None
+
+def get_collision_key():
+    """Cheap check for changed castles, rock position or perimeter walls"""
+    return (get_castle_fingerprint(), tuple(central_rock_pos), id(perimeter_wall_layout))
+
+def get_castle_boundaries(castle_config):
+    """Get exact castle boundaries using railing coordinates"""
+    pos = castle_config['position']
+    size = castle_config['size']
+    wall_height = castle_config['wall_height']
+    
+    half_size = size / 2
+    # Calculate actual wall boundaries (with inset)
+    min_x = pos[0] - half_size + CASTLE_WALL_INSET
+    max_x = pos[0] + half_size - CASTLE_WALL_INSET
+    min_y = pos[1] - half_size + CASTLE_WALL_INSET
+    max_y = pos[1] + half_size - CASTLE_WALL_INSET
+    z_min = 0
+    z_max = pos[2] + wall_height + 200  # Allow margin above walls
+    
+    return min_x, max_x, min_y, max_y, z_min, z_max
+
+def grid_cells(min_x, max_x, min_y, max_y, cell_size):
+    """Uniform grid cells overlapped by a rectangle"""
+    return [(i, j)
+            for i in range(int(min_x // cell_size), int(max_x // cell_size) + 1)
+            for j in range(int(min_y // cell_size), int(max_y // cell_size) + 1)]
 
-        if (min_x - BUFFER_ZONE <= x <= max_x + BUFFER_ZONE and 
-            min_y - BUFFER_ZONE <= y <= max_y + BUFFER_ZONE and 
+def cell_keys(i, j):
+    """One sortable int64 per grid cell, for searchsorted lookups"""
+    return np.asarray(i, dtype=np.int64) * (1 << 32) + np.asarray(j, dtype=np.int64)
+
+def build_collision_index():
+    """Bucket castle boxes and centers into a uniform grid and precompute the fixed regions
+    
+    Cells are as large as the biggest buffered castle box, so a box touches at most four
+    cells and a point query looks at a single cell. box_cells is also kept as arrays
+    (sorted cell keys and a -1 padded table of castles per cell) for array queries.
+    """
+    global collision_index, collision_key
+    
+    boxes = [get_castle_boundaries(castle) for castle in castle_configs]
+    cell_size = max([max(box[1] - box[0], box[3] - box[2]) + 2 * COLLISION_BUFFER_ZONE for box in boxes] + [1.0])
+    
+    box_cells, center_cells = {}, {}
+    for i, (castle, box) in enumerate(zip(castle_configs, boxes)):
+        for cell in grid_cells(box[0] - COLLISION_BUFFER_ZONE, box[1] + COLLISION_BUFFER_ZONE,
+                               box[2] - COLLISION_BUFFER_ZONE, box[3] + COLLISION_BUFFER_ZONE, cell_size):
+            box_cells.setdefault(cell, []).append(i)
+        cx, cy = castle['position'][0], castle['position'][1]
+        center_cells.setdefault((int(cx // cell_size), int(cy // cell_size)), []).append(i)
+    
+    # Ground enclosed by the perimeter walls, the same segments the walls are drawn from
+    perimeter = []
+    if perimeter_wall_layout is not None or len(castle_configs) > 2:
+        perimeter = perimeter_regions(get_perimeter_wall_segments())
+    
+    cells = sorted(box_cells)
+    cell_table = np.full((len(cells), max([len(v) for v in box_cells.values()] + [1])), -1, dtype=np.int32)
+    for row, cell in enumerate(cells):
+        cell_table[row, :len(box_cells[cell])] = box_cells[cell]
+    
+    collision_index = {
+        'cell_size': cell_size,
+        'boxes': boxes,
+        'box_cells': box_cells,
+        'box_array': np.array(boxes, dtype=np.float64).reshape(-1, 6),
+        'cell_keys': cell_keys([i for i, _ in cells], [j for _, j in cells]),
+        'cell_table': cell_table,
+        'center_cells': center_cells,
+        'center_min': np.array(list(center_cells)).min(axis=0) if center_cells else None,
+        'center_max': np.array(list(center_cells)).max(axis=0) if center_cells else None,
+        'perimeter': perimeter
+    }
+    collision_key = get_collision_key()
+    return collision_index
+
+def perimeter_regions(segments):
+    """Bounding rectangles (min_x, max_x, min_y, max_y) of each run of joined wall segments"""
+    parent = list(range(len(segments)))
+    
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    ends = {}
+    for i, (x1, y1, x2, y2) in enumerate(segments):
+        for end in ((x1, y1), (x2, y2)):
+            if end in ends:
+                parent[root(i)] = root(ends[end])
+            else:
+                ends[end] = i
+    
+    regions = {}
+    for i, (x1, y1, x2, y2) in enumerate(segments):
+        min_x, max_x, min_y, max_y = regions.get(root(i), (x1, x1, y1, y1))
+        regions[root(i)] = (min(min_x, x1, x2), max(max_x, x1, x2), min(min_y, y1, y2), max(max_y, y1, y2))
+    return list(regions.values())
+
+def get_collision_index():
+    """The collision index, rebuilt when the castle configs or rock position changed"""
+    if collision_index is None or collision_key != get_collision_key():
+        build_collision_index()
+    return collision_index
+
+def invalidate_collision_index():
+    """Force the collision index to be rebuilt on the next query"""
+    global collision_index
+    collision_index = None
+
+def find_containing_castle(index, x, y, z):
+    """Lowest-numbered castle whose buffered box contains the point, or None"""
+    cell_size = index['cell_size']
+    boxes = index['boxes']
+    for i in index['box_cells'].get((int(x // cell_size), int(y // cell_size)), ()):
+        min_x, max_x, min_y, max_y, z_min, z_max = boxes[i]
+        if (min_x - COLLISION_BUFFER_ZONE <= x <= max_x + COLLISION_BUFFER_ZONE and
+            min_y - COLLISION_BUFFER_ZONE <= y <= max_y + COLLISION_BUFFER_ZONE and
             z_min <= z <= z_max):
-            
-            # FORCE clamp to actual boundaries (not buffer boundaries)
-            player_pos[0] = max(min_x, min(x, max_x))
-            player_pos[1] = max(min_y, min(y, max_y))  # This will now clamp 1375.1 → 1350.0
-            player_pos[2] = max(z_min, min(z, z_max))
-            
-            print(f"Clamped in Castle {i+1}")
-            return
+            return i
+    return None
+
+def find_containing_castles(index, x, y, z, buffer=COLLISION_BUFFER_ZONE):
+    """find_containing_castle for arrays of points; -1 where no castle box contains the point"""
+    result = np.full(len(x), -1, dtype=np.int32)
+    keys = index['cell_keys']
+    if len(keys) == 0 or len(x) == 0:
+        return result
+    
+    cell_size = index['cell_size']
+    point_keys = cell_keys(np.floor(x / cell_size), np.floor(y / cell_size))
+    rows = np.searchsorted(keys, point_keys).clip(max=len(keys) - 1)
+    candidates = np.where((keys[rows] == point_keys)[:, None], index['cell_table'][rows], -1)
+    box = index['box_array'][candidates.clip(min=0)]
+    x, y, z = x[:, None], y[:, None], z[:, None]
+    inside = ((candidates >= 0) &
+              (box[..., 0] - buffer <= x) & (x <= box[..., 1] + buffer) &
+              (box[..., 2] - buffer <= y) & (y <= box[..., 3] + buffer) &
+              (box[..., 4] <= z) & (z <= box[..., 5]))
+    # Candidates are in castle order, so the first hit is the lowest-numbered castle
+    first = inside.argmax(axis=1)
+    hit = inside.any(axis=1)
+    result[hit] = candidates[hit, first[hit]]
+    return result
+
+def ring_cells(ci, cj, ring):
+    """Cells at exactly Chebyshev distance ring from (ci, cj)"""
+    if ring == 0:
+        return [(ci, cj)]
+    cells = [(i, j) for i in range(ci - ring, ci + ring + 1) for j in (cj - ring, cj + ring)]
+    cells += [(i, j) for i in (ci - ring, ci + ring) for j in range(cj - ring + 1, cj + ring)]
+    return cells
+
+def find_nearest_castle(index, x, y):
+    """Castle with the closest center, searching grid rings outward from the point's cell"""
+    if not index['center_cells']:
+        return None
+    
+    cell_size = index['cell_size']
+    ci, cj = int(x // cell_size), int(y // cell_size)
+    # Rings needed to reach the farthest occupied cell from a point that may lie outside them
+    low, high = index['center_min'], index['center_max']
+    max_ring = int(max(abs(ci - low[0]), abs(ci - high[0]), abs(cj - low[1]), abs(cj - high[1])))
+    
+    best, best_dist_sq = None, float('inf')
+    for ring in range(max_ring + 1):
+        # Anything in this ring or beyond is at least (ring - 1) cells away
+        if best is not None and best_dist_sq < ((ring - 1) * cell_size) ** 2:
+            break
+        for cell in ring_cells(ci, cj, ring):
+            for k in index['center_cells'].get(cell, ()):
+                cx, cy = castle_configs[k]['position'][0], castle_configs[k]['position'][1]
+                dist_sq = (x - cx)**2 + (y - cy)**2
+                # Ties go to the lower index, like a linear scan
+                if dist_sq < best_dist_sq or (dist_sq == best_dist_sq and k < best):
+                    best, best_dist_sq = k, dist_sq
+    return best
+
+def clamp_player_position():
+    """FIXED COMPREHENSIVE COLLISION DETECTION - No return to center, proper boundaries"""
+    global player_pos, teleport_skip_clamp
+    
+    if teleport_skip_clamp:
+        teleport_skip_clamp = False
+        return
+    
+    x, y, z = player_pos
+    index = get_collision_index()
+    
+    # Check each castle individually
+    i = find_containing_castle(index, x, y, z)
+    if log_levels['collision'] <= LOG_DEBUG:
+        log_event('collision', LOG_DEBUG, "Castle query", player=[x, y, z],
+                  castle=None if i is None else i + 1,
+                  bounds=None if i is None else index['boxes'][i])
+    
+    if i is not None:
+        min_x, max_x, min_y, max_y, z_min, z_max = index['boxes'][i]
+        # FORCE clamp to actual boundaries (not buffer boundaries)
+        player_pos[0] = max(min_x, min(x, max_x))
+        player_pos[1] = max(min_y, min(y, max_y))  # This will now clamp 1375.1 → 1350.0
+        player_pos[2] = max(z_min, min(z, z_max))
+        
+        if log_levels['clamp'] <= LOG_INFO:
+            log_event('clamp', LOG_INFO, f"Clamped in Castle {i+1}", castle=i + 1,
+                      before=[x, y, z], after=list(player_pos))
+        return
     
     # Central rock platform (circular boundary)
     rock_x, rock_y, rock_z = central_rock_pos
-    rock_radius = 120  # Platform radius
-    rock_height_min = rock_z + 1600
-    rock_height_max = rock_z + 1800
-    
-    if rock_height_min <= z <= rock_height_max:
-        dist_from_center = sqrt((x - rock_x)**2 + (y - rock_y)**2)
-        if dist_from_center <= rock_radius:
-            # Keep player within circular platform - no center forcing
-            if dist_from_center > rock_radius - 10:  # Near edge
-                direction_x = (x - rock_x) / max(dist_from_center, 0.1)  # Avoid division by zero
-                direction_y = (y - rock_y) / max(dist_from_center, 0.1)
-                player_pos[0] = rock_x + direction_x * (rock_radius - 10)
-                player_pos[1] = rock_y + direction_y * (rock_radius - 10)
-            return
+    rock_radius = ROCK_PLATFORM_RADIUS
+    dist_sq = (x - rock_x)**2 + (y - rock_y)**2
+    
+    if rock_z + 1600 <= z <= rock_z + 1800 and dist_sq <= rock_radius**2:
+        # Keep player within circular platform - no center forcing
+        if dist_sq > (rock_radius - 10)**2:  # Near edge
+            dist_from_center = sqrt(dist_sq)
+            direction_x = (x - rock_x) / max(dist_from_center, 0.1)  # Avoid division by zero
+            direction_y = (y - rock_y) / max(dist_from_center, 0.1)
+            player_pos[0] = rock_x + direction_x * (rock_radius - 10)
+            player_pos[1] = rock_y + direction_y * (rock_radius - 10)
+            
+            if log_levels['clamp'] <= LOG_INFO:
+                log_event('clamp', LOG_INFO, "Kept on rock platform", before=[x, y, z], after=list(player_pos))
+        return
     
     # Spiral stairs around rock tower
-    if rock_z <= z <= rock_z + 1600:
-        stair_radius = 220
-        dist_from_rock = sqrt((x - rock_x)**2 + (y - rock_y)**2)
-        if 180 <= dist_from_rock <= 260:  # On spiral stairs
-            return  # Allow movement on stairs
-    
-    # Perimeter wall area (ground level only)
-    buildings = [castle_configs[0], castle_configs[2], {'position': central_rock_pos, 'size': 800}]
-    min_x = min([pos['position'][0] - pos['size']/2 for pos in buildings]) - 500
-    max_x = max([pos['position'][0] + pos['size']/2 for pos in buildings]) + 500
-    min_y = min([pos['position'][1] - pos['size']/2 for pos in buildings]) - 500
-    max_y = max([pos['position'][1] + pos['size']/2 for pos in buildings]) + 500
+    inner, outer = ROCK_STAIR_RADII
+    if rock_z <= z <= rock_z + 1600 and inner**2 <= dist_sq <= outer**2:
+        return  # Allow movement on stairs
     
+    # Perimeter wall areas (ground level only)
     if 0 <= z <= 450:  # Ground level
-        if min_x <= x <= max_x and min_y <= y <= max_y:
-            # Player is in perimeter area - clamp to boundaries, don't move to center
-            if x < min_x: player_pos[0] = min_x
-            elif x > max_x: player_pos[0] = max_x
-            
-            if y < min_y: player_pos[1] = min_y
-            elif y > max_y: player_pos[1] = max_y
-            return
+        for min_x, max_x, min_y, max_y in index['perimeter']:
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                # Player is already inside a perimeter area, nothing to clamp
+                return
     
     # Only if completely outside all areas, find nearest castle and move to edge (not center)
-    min_dist = float('inf')
-    nearest_castle = None
+    nearest = find_nearest_castle(index, x, y)
+    if nearest is not None:
+        # Move player to nearest EDGE of castle, not center
+        min_x, max_x, min_y, max_y, z_min, z_max = index['boxes'][nearest]
+        
+        # Find closest boundary point
+        player_pos[0] = max(min_x, min(x, max_x))
+        player_pos[1] = max(min_y, min(y, max_y))
+        player_pos[2] = castle_configs[nearest]['position'][2] + castle_configs[nearest]['wall_height']
+        
+        if log_levels['clamp'] <= LOG_INFO:
+            log_event('clamp', LOG_INFO, f"Moved to nearest Castle {nearest+1}", castle=nearest + 1,
+                      before=[x, y, z], after=list(player_pos))
+
+# Navigation grid: the ground as one grid layer with castles, perimeter walls and the rock
+# tower blocked, each castle top as a layer of its own reached through its gate, and the
+# spiral stairs as a chain of step nodes up to the rock platform. Grid nodes are numbered
+# layer by layer (first + i * ny + j); the stairs and platform come after the last layer.
+NAV_CELL_SIZE = 100
+NAV_MAX_CELLS = 512  # per axis of the ground layer; bigger worlds get coarser cells
+NAV_AGENT_RADIUS = 50  # obstacles are grown by this much
+NAV_LAYER_TOLERANCE = 100  # how far below a castle top a point still counts as on it
+NAV_PATH_CACHE_LIMIT = 1024
+NAV_FLOW_CACHE_LIMIT = 64
+NAV_FLOW_BUILDS_PER_TICK = 1  # gate fields a siege tick may build for retargeted attackers
+NAV_FLOW_MAX_PASSES = 64
+NAV_STAIR_RADIUS = 220  # Same as in draw_spiral_stairs_around_rock
+NAV_STAIR_STEPS = 80
+NAV_STAIR_HEIGHT = 1600
+NAV_PLATFORM_HEIGHT = 1630  # standing height on the rock platform, as the T teleport uses
+NAV_STEPS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+nav_graph = None
+nav_key = None
+nav_paths = OrderedDict()  # (start node, goal node) -> node tuple or None, least recent first
+nav_flows = OrderedDict()  # goal node -> flow field, least recent first
+nav_gate_flows = {}  # castle -> flow field to its gate (None if it has none), kept with the graph
+nav_stats = {'path_hits': 0, 'path_misses': 0, 'expanded': 0, 'flow_builds': 0}
+
+def get_nav_key():
+    return (get_collision_key(), GRID_LENGTH, id(perimeter_wall_layout))
+
+def make_nav_layer(min_x, max_x, min_y, max_y, cell, z, first):
+    """All-walkable grid layer covering a rectangle at height z; its nodes start at first"""
+    shape = (max(1, int(np.ceil((max_x - min_x) / cell))), max(1, int(np.ceil((max_y - min_y) / cell))))
+    return {'origin': (min_x, min_y), 'cell': cell, 'shape': shape, 'z': z, 'first': first,
+            'walkable': np.ones(shape, dtype=bool)}
+
+def layer_window(layer, min_x, max_x, min_y, max_y):
+    """Slices of the cells whose centers may lie in a rectangle, and those centers"""
+    (x0, y0), cell, (nx, ny) = layer['origin'], layer['cell'], layer['shape']
+    i0, i1 = max(int((min_x - x0) // cell), 0), min(int((max_x - x0) // cell) + 1, nx)
+    j0, j1 = max(int((min_y - y0) // cell), 0), min(int((max_y - y0) // cell) + 1, ny)
+    xs = x0 + (np.arange(i0, max(i1, i0)) + 0.5) * cell
+    ys = y0 + (np.arange(j0, max(j1, j0)) + 0.5) * cell
+    return (slice(i0, max(i1, i0)), slice(j0, max(j1, j0))), xs[:, None], ys[None, :]
+
+def block_rect(layer, min_x, max_x, min_y, max_y):
+    window, xs, ys = layer_window(layer, min_x, max_x, min_y, max_y)
+    layer['walkable'][window] &= ~((min_x <= xs) & (xs <= max_x) & (min_y <= ys) & (ys <= max_y))
+
+def block_disc(layer, x, y, radius):
+    window, xs, ys = layer_window(layer, x - radius, x + radius, y - radius, y + radius)
+    layer['walkable'][window] &= (xs - x) ** 2 + (ys - y) ** 2 > radius ** 2
+
+def block_segment(layer, x1, y1, x2, y2, half_width):
+    """Block cells closer than half_width to the segment"""
+    window, xs, ys = layer_window(layer, min(x1, x2) - half_width, max(x1, x2) + half_width,
+                                  min(y1, y2) - half_width, max(y1, y2) + half_width)
+    dx, dy = x2 - x1, y2 - y1
+    t = (((xs - x1) * dx + (ys - y1) * dy) / max(dx * dx + dy * dy, 1e-9)).clip(0, 1)
+    layer['walkable'][window] &= (xs - x1 - t * dx) ** 2 + (ys - y1 - t * dy) ** 2 > half_width ** 2
+
+def nearest_walkable(layer, x, y):
+    """Node of the walkable cell closest to (x, y), searching outward from its cell, or None"""
+    cell, (nx, ny) = layer['cell'], layer['shape']
+    reach = 2
+    while True:
+        window, xs, ys = layer_window(layer, x - reach * cell, x + reach * cell, y - reach * cell, y + reach * cell)
+        dist_sq = np.where(layer['walkable'][window], (xs - x) ** 2 + (ys - y) ** 2, np.inf)
+        if dist_sq.size and np.isfinite(dist_sq.min()):
+            i, j = np.unravel_index(dist_sq.argmin(), dist_sq.shape)
+            return layer['first'] + (window[0].start + i) * ny + window[1].start + j
+        if reach > max(nx, ny):
+            return None
+        reach *= 4
+
+def build_nav_graph():
+    """Build the navigation layers, stair nodes and the gate and stair links between them"""
+    global nav_graph, nav_key
     
+    half_size = get_ground_extent()[0]
+    cell = max(NAV_CELL_SIZE, 2 * half_size / NAV_MAX_CELLS)
+    ground = make_nav_layer(-half_size, half_size, -half_size, half_size, cell, 0.0, 0)
     for castle in castle_configs:
         cx, cy = castle['position'][0], castle['position'][1]
-        dist = sqrt((x - cx)**2 + (y - cy)**2)
-        if dist < min_dist:
-            min_dist = dist
-            nearest_castle = castle
+        # Walls stick out past the castle square by half their thickness, towers by their radius
+        reach = (castle['size'] / 2 + NAV_AGENT_RADIUS +
+                 max(castle['wall_thickness'] / 2 - CASTLE_WALL_INSET, castle['tower_radius']))
+        block_rect(ground, cx - reach, cx + reach, cy - reach, cy + reach)
+    if perimeter_wall_layout is not None or len(castle_configs) > 2:
+        for x1, y1, x2, y2 in get_perimeter_wall_segments():
+            block_segment(ground, x1, y1, x2, y2, PERIMETER_WALL_THICKNESS / 2 + NAV_AGENT_RADIUS)
+    rock_x, rock_y, rock_z = central_rock_pos
+    block_disc(ground, rock_x, rock_y, ROCK_STAIR_RADII[1] + NAV_AGENT_RADIUS)
     
-    if nearest_castle:
-        # Move player to nearest EDGE of castle, not center
-        min_x, max_x, min_y, max_y, z_min, z_max = get_castle_boundaries(nearest_castle)
-        
-        # Find closest boundary point
-        clamp_x = max(min_x, min(x, max_x))
-        clamp_y = max(min_y, min(y, max_y))
+    layers, links, gates = [ground], {}, []
+    first = ground['shape'][0] * ground['shape'][1]
+    for castle in castle_configs:
+        cx, cy, cz = castle['position']
+        half = castle['size'] / 2
+        min_x, max_x, min_y, max_y, _, _ = get_castle_boundaries(castle)
+        top = make_nav_layer(min_x, max_x, min_y, max_y, cell, cz + castle['wall_height'], first)
+        for corner_x, corner_y in ((cx - half, cy - half), (cx + half, cy - half),
+                                   (cx + half, cy + half), (cx - half, cy + half)):
+            block_disc(top, corner_x, corner_y, castle['tower_radius'] + NAV_AGENT_RADIUS)
+        layers.append(top)
+        first += top['shape'][0] * top['shape'][1]
         
-        player_pos[0] = clamp_x
-        player_pos[1] = clamp_y
-        player_pos[2] = nearest_castle['position'][2] + nearest_castle['wall_height']
+        # The gate cube sits in the middle of the south wall
+        wall_y = cy - half + CASTLE_WALL_INSET
+        outside = nearest_walkable(ground, cx, wall_y - castle['wall_thickness'] / 2 - NAV_AGENT_RADIUS - cell)
+        inside = nearest_walkable(top, cx, min_y)
+        gates.append(-1 if outside is None else outside)
+        if outside is not None and inside is not None:
+            links.setdefault(outside, []).append(inside)
+            links.setdefault(inside, []).append(outside)
+    
+    i, _, cos_t, sin_t = spiral_table(NAV_STAIR_STEPS, 1800 / NAV_STAIR_STEPS)
+    points = np.vstack((
+        np.column_stack((rock_x + NAV_STAIR_RADIUS * cos_t, rock_y + NAV_STAIR_RADIUS * sin_t,
+                         rock_z + NAV_STAIR_HEIGHT / NAV_STAIR_STEPS * i)),
+        [[rock_x, rock_y, rock_z + NAV_PLATFORM_HEIGHT]]
+    ))
+    # Steps in a chain, the last one onto the platform and the first one off to the ground
+    for k in range(NAV_STAIR_STEPS):
+        links.setdefault(first + k, []).append(first + k + 1)
+        links.setdefault(first + k + 1, []).append(first + k)
+    bottom = nearest_walkable(ground, points[0, 0], points[0, 1])
+    if bottom is not None:
+        links.setdefault(bottom, []).append(first)
+        links[first].append(bottom)
+    
+    nav_graph = {
+        'cell': cell,
+        'layers': layers,
+        'layer_starts': [layer['first'] for layer in layers],
+        'points': points,
+        'points_first': first,
+        'stairs': first,
+        'platform': first + NAV_STAIR_STEPS,
+        'gates': gates,
+        'links': links
+    }
+    # Link costs are the straight-line distances between the linked nodes
+    nav_graph['links'] = {a: [(b, float(np.linalg.norm(np.subtract(node_position(nav_graph, a),
+                                                                   node_position(nav_graph, b)))))
+                              for b in targets]
+                          for a, targets in links.items()}
+    nav_key = get_nav_key()
+    nav_paths.clear()
+    nav_flows.clear()
+    nav_gate_flows.clear()
+    return nav_graph
+
+def get_nav_graph():
+    """The navigation graph, rebuilt when the scene it was built from changed"""
+    if nav_graph is None or nav_key != get_nav_key():
+        build_nav_graph()
+    return nav_graph
+
+def invalidate_nav_graph():
+    """Force the navigation graph (and its cached paths and flow fields) to be rebuilt"""
+    global nav_graph
+    nav_graph = None
+
+def node_layer(graph, node):
+    """Grid layer a node belongs to, or None for stair and platform nodes"""
+    if node >= graph['points_first']:
+        return None
+    return graph['layers'][bisect.bisect_right(graph['layer_starts'], node) - 1]
+
+def node_position(graph, node):
+    """World position (x, y, z) of a node: its cell center or stair point"""
+    layer = node_layer(graph, node)
+    if layer is None:
+        return tuple(graph['points'][node - graph['points_first']])
+    i, j = divmod(node - layer['first'], layer['shape'][1])
+    (x0, y0), cell = layer['origin'], layer['cell']
+    return (x0 + (i + 0.5) * cell, y0 + (j + 0.5) * cell, layer['z'])
+
+def node_neighbors(graph, node):
+    """(node, cost) pairs reachable in one step; diagonals may not cut blocked corners"""
+    neighbors = list(graph['links'].get(node, ()))
+    layer = node_layer(graph, node)
+    if layer is None:
+        return neighbors
+    
+    nx, ny = layer['shape']
+    walkable = layer['walkable']
+    i, j = divmod(node - layer['first'], ny)
+    for di, dj in NAV_STEPS:
+        ni, nj = i + di, j + dj
+        if not (0 <= ni < nx and 0 <= nj < ny and walkable[ni, nj]):
+            continue
+        if di and dj:
+            if not (walkable[ni, j] and walkable[i, nj]):
+                continue
+            neighbors.append((layer['first'] + ni * ny + nj, layer['cell'] * sqrt(2)))
+        else:
+            neighbors.append((layer['first'] + ni * ny + nj, layer['cell']))
+    return neighbors
+
+def nav_node_at(graph, x, y, z):
+    """Node a world position stands on: platform, stair step, castle top or nearest ground cell"""
+    rock_x, rock_y, rock_z = central_rock_pos
+    rock_dist = sqrt((x - rock_x) ** 2 + (y - rock_y) ** 2)
+    if z >= rock_z + NAV_STAIR_HEIGHT and rock_dist <= ROCK_PLATFORM_RADIUS:
+        return graph['platform']
+    inner, outer = ROCK_STAIR_RADII
+    if rock_z < z < rock_z + NAV_STAIR_HEIGHT and inner <= rock_dist <= outer:
+        steps = graph['points'][:NAV_STAIR_STEPS]
+        return graph['stairs'] + int(np.linalg.norm(steps - [x, y, z], axis=1).argmin())
+    
+    castle = find_containing_castle(get_collision_index(), x, y, z)
+    if castle is not None:
+        top = graph['layers'][castle + 1]
+        if z >= top['z'] - NAV_LAYER_TOLERANCE:
+            return nearest_walkable(top, x, y)
+    return nearest_walkable(graph['layers'][0], x, y)
+
+def astar(graph, start, goal):
+    """Cheapest node path from start to goal as a tuple, or None if goal cannot be reached"""
+    goal_x, goal_y, goal_z = node_position(graph, goal)
+    
+    def heuristic(node):
+        x, y, z = node_position(graph, node)
+        return sqrt((x - goal_x) ** 2 + (y - goal_y) ** 2 + (z - goal_z) ** 2)
+    
+    costs, parents = {start: 0.0}, {start: None}
+    frontier = [(heuristic(start), start)]
+    closed = set()
+    while frontier:
+        _, node = heapq.heappop(frontier)
+        if node == goal:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = parents[node]
+            return tuple(reversed(path))
+        if node in closed:
+            continue
+        closed.add(node)
+        nav_stats['expanded'] += 1
+        for neighbor, step in node_neighbors(graph, node):
+            cost = costs[node] + step
+            if cost < costs.get(neighbor, float('inf')):
+                costs[neighbor] = cost
+                parents[neighbor] = node
+                heapq.heappush(frontier, (cost + heuristic(neighbor), neighbor))
+    return None
+
+def find_node_path(start, goal):
+    """astar through the LRU path cache keyed by (start node, goal node)"""
+    key = (start, goal)
+    if key in nav_paths:
+        nav_paths.move_to_end(key)
+        nav_stats['path_hits'] += 1
+        return nav_paths[key]
+    
+    nav_stats['path_misses'] += 1
+    path = nav_paths[key] = astar(get_nav_graph(), start, goal)
+    if len(nav_paths) > NAV_PATH_CACHE_LIMIT:
+        nav_paths.popitem(last=False)
+    return path
+
+def find_path(start, goal):
+    """Waypoints [(x, y, z), ...] between two world positions, or None if there is no way"""
+    graph = get_nav_graph()
+    start_node, goal_node = nav_node_at(graph, *start), nav_node_at(graph, *goal)
+    if start_node is None or goal_node is None:
+        return None
+    nodes = find_node_path(start_node, goal_node)
+    return None if nodes is None else [node_position(graph, node) for node in nodes]
+
+def sweep_flow_rows(distance, walkable, rows, step, cell):
+    """One Gauss-Seidel sweep over padded rows, relaxing each row from the previous one"""
+    diagonal = cell * sqrt(2)
+    for r in rows:
+        p = r - step
+        source = distance[p]
+        best = source[1:-1] + cell
+        # From (p, j -/+ 1) only if neither corner cell is blocked
+        best = np.minimum(best, np.where(walkable[p, 1:-1] & walkable[r, :-2], source[:-2] + diagonal, np.inf))
+        best = np.minimum(best, np.where(walkable[p, 1:-1] & walkable[r, 2:], source[2:] + diagonal, np.inf))
+        row = distance[r, 1:-1]
+        np.minimum(row, np.where(walkable[r, 1:-1], best, np.inf), out=row)
+
+def build_flow_field(layer, goal):
+    """Distance to goal and the unit direction to follow for every cell of a grid layer
+    
+    Distances are the same 8-neighbour costs astar uses, found with row sweeps in all four
+    directions until nothing changes; unreachable cells get inf and a zero direction.
+    """
+    nx, ny = layer['shape']
+    cell = layer['cell']
+    walkable = np.pad(layer['walkable'], 1, constant_values=False)
+    distance = np.full((nx + 2, ny + 2), np.inf)
+    gi, gj = divmod(goal - layer['first'], ny)
+    distance[gi + 1, gj + 1] = 0.0
+    
+    for _ in range(NAV_FLOW_MAX_PASSES):
+        previous = distance.copy()
+        sweep_flow_rows(distance, walkable, range(1, nx + 1), 1, cell)
+        sweep_flow_rows(distance, walkable, range(nx, 0, -1), -1, cell)
+        sweep_flow_rows(distance.T, walkable.T, range(1, ny + 1), 1, cell)
+        sweep_flow_rows(distance.T, walkable.T, range(ny, 0, -1), -1, cell)
+        if np.array_equal(previous, distance):
+            break
+    
+    # Point every cell at its best neighbour
+    candidates = np.empty((len(NAV_STEPS), nx, ny))
+    for k, (di, dj) in enumerate(NAV_STEPS):
+        neighbor = distance[1 + di:nx + 1 + di, 1 + dj:ny + 1 + dj] + cell * sqrt(abs(di) + abs(dj))
+        if di and dj:
+            corners = walkable[1 + di:nx + 1 + di, 1:-1] & walkable[1:-1, 1 + dj:ny + 1 + dj]
+            neighbor = np.where(corners, neighbor, np.inf)
+        candidates[k] = neighbor
+    best = candidates.argmin(axis=0)
+    steps = np.array(NAV_STEPS, dtype=np.float64)
+    steps /= np.linalg.norm(steps, axis=1)[:, None]
+    direction = steps[best].astype(np.float32)
+    distance = distance[1:-1, 1:-1]
+    direction[~np.isfinite(distance) | (distance == 0)] = 0.0
+    nav_stats['flow_builds'] += 1
+    return {'layer': layer, 'goal': goal, 'distance': distance.astype(np.float32), 'direction': direction}
+
+def get_flow_field(goal):
+    """Flow field toward a ground node, shared by every unit heading there (LRU cached)"""
+    graph = get_nav_graph()
+    if goal in nav_flows:
+        nav_flows.move_to_end(goal)
+        return nav_flows[goal]
+    if node_layer(graph, goal) is not graph['layers'][0]:
+        raise ValueError(f"Flow fields only cover the ground, node {goal} is not on it")
+    
+    field = nav_flows[goal] = build_flow_field(graph['layers'][0], goal)
+    if len(nav_flows) > NAV_FLOW_CACHE_LIMIT:
+        nav_flows.popitem(last=False)
+    return field
+
+def get_gate_flow_field(castle, build=True):
+    """Flow field toward the ground in front of a castle's gate, or None if it has no way in
+    
+    Gate fields are kept for the life of the nav graph, outside the LRU, since a siege uses
+    one per target castle every tick. With build=False a field not built yet is also None.
+    Only a miss checks the graph is current; callers asking for many castles check it once
+    with get_nav_graph first.
+    """
+    castle = int(castle)
+    if castle not in nav_gate_flows:
+        if not build:
+            return None
+        graph = get_nav_graph()
+        gate = graph['gates'][castle]
+        nav_gate_flows[castle] = None if gate < 0 else build_flow_field(graph['layers'][0], gate)
+    return nav_gate_flows[castle]
+
+def sample_flow(field, x, y):
+    """Directions (N, 2) and remaining distances (N,) of a flow field at arrays of points"""
+    layer = field['layer']
+    (x0, y0), cell, (nx, ny) = layer['origin'], layer['cell'], layer['shape']
+    i = ((x - x0) // cell).astype(np.int64).clip(0, nx - 1)
+    j = ((y - y0) // cell).astype(np.int64).clip(0, ny - 1)
+    return field['direction'][i, j], field['distance'][i, j]
+
+# Siege: attacker and defender units kept as struct-of-arrays NumPy buffers and advanced a
+# whole array at a time each simulation tick. Attackers march on the nearest standing
+# castle and fight from its walls; defenders patrol the railings. Collision uses the same
+# castle boxes and rock radii as clamp_player_position, through find_containing_castles.
+UNIT_ATTACKER, UNIT_DEFENDER = 0, 1
+UNIT_SPEED = (300.0, 150.0)  # units per second, by team
+ATTACKER_DPS = 1.0  # damage per second each engaged attacker deals; defenders shoot arrows
+UNIT_HEALTH = 100.0
+UNIT_ATTACK_RANGE = 300  # from the railing box; castle walls stick out up to 250 past it
+UNIT_SCALE = 60
+UNIT_LOD_DISTANCES = (1500, 4000)  # switch to the next draw_human LOD tier beyond these
+UNIT_LOD_BUDGET = (200, 1000)  # most units drawn at each detailed tier; the farther rest drop a tier
+UNIT_TORSO_COLORS = ((0.8, 0.15, 0.1), HUMAN_TORSO_COLOR)  # by team; defenders wear the player's blue
+UNIT_CULL_RADIUS = 2 * UNIT_SCALE  # bounding sphere around a unit's waist
+UNIT_HIT_RADIUS = 40  # projectile target box around a unit, from its feet up
+UNIT_HIT_HEIGHT = 3 * UNIT_SCALE
+UNIT_RELOAD = 1.5  # seconds between a defender's arrows
+SIEGE_ATTACKERS = 2000
+SIEGE_DEFENDERS_PER_CASTLE = 40
+# Field name -> (columns, dtype); every field holds capacity rows, the first 'count' live
+UNIT_FIELDS = {
+    'pos': (3, np.float64),
+    'vel': (2, np.float64),
+    'heading': (None, np.float64),
+    'health': (None, np.float64),
+    'team': (None, np.int8),
+    'castle': (None, np.int32),  # target castle (attackers) or home castle (defenders)
+    'patrol': (None, np.float64),  # defenders: position along the railing, 0..4 (one unit per side)
+    'reload': (None, np.float64)  # defenders: seconds until the next arrow
+}
+units = {'count': 0}
+siege = {'active': False, 'ticks': 0, 'tick_ms': 0.0, 'losses': [0, 0], 'fallen': 0, 'rng': None}
+unit_templates = {}
+
+def reset_buffers(store, fields, capacity=0):
+    """Empty a struct-of-arrays store and allocate room for capacity rows"""
+    store['count'] = 0
+    for name, (columns, dtype) in fields.items():
+        store[name] = np.zeros((capacity,) if columns is None else (capacity, columns), dtype=dtype)
+
+def append_rows(store, fields, rows, values):
+    """Append rows to a store, growing it if needed; fields missing from values are zeroed"""
+    start = store['count']
+    end = start + rows
+    capacity = len(store[next(iter(fields))])
+    if end > capacity:
+        capacity = max(end, 2 * capacity)
+        for name in fields:
+            grown = np.zeros((capacity,) + store[name].shape[1:], dtype=store[name].dtype)
+            grown[:start] = store[name][:start]
+            store[name] = grown
+    
+    for name in fields:
+        store[name][start:end] = values.get(name, 0)
+    store['count'] = end
+
+def compact_rows(store, fields, keep):
+    """Move the rows where keep is set, in order, to the front of the store"""
+    for name in fields:
+        kept = store[name][:store['count']][keep]
+        store[name][:len(kept)] = kept
+    store['count'] = int(np.count_nonzero(keep))
+
+def reset_units(capacity=0):
+    """Drop every unit and allocate empty buffers for capacity units"""
+    reset_buffers(units, UNIT_FIELDS, capacity)
+
+def add_units(team, positions, castles, patrol=0.0, reload=0.0):
+    """Append units at positions (N, 3) with their castle indices, growing the buffers if needed"""
+    append_rows(units, UNIT_FIELDS, len(positions), {
+        'pos': positions, 'health': UNIT_HEALTH, 'team': team, 'castle': castles, 'patrol': patrol,
+        'reload': reload
+    })
+
+def remove_dead_units():
+    """Compact the buffers so the live units stay contiguous at the front"""
+    count = units['count']
+    alive = units['health'][:count] > 0
+    if alive.all():
+        return
+    losses = np.bincount(units['team'][:count][~alive], minlength=2)
+    siege['losses'][0] += int(losses[0])
+    siege['losses'][1] += int(losses[1])
+    compact_rows(units, UNIT_FIELDS, alive)
+
+def nearest_castles(x, y, candidates):
+    """Index of the closest candidate castle center for every point"""
+    centers = np.array([castle_configs[i]['position'][:2] for i in candidates], dtype=np.float64).reshape(-1, 2)
+    nearest = np.empty(len(x), dtype=np.int32)
+    # Chunked so the point x castle distance matrix stays small on big scenes
+    chunk = max(1, (1 << 22) // max(len(centers), 1))
+    for start in range(0, len(x), chunk):
+        dist_sq = ((x[start:start + chunk, None] - centers[:, 0]) ** 2 +
+                   (y[start:start + chunk, None] - centers[:, 1]) ** 2)
+        nearest[start:start + chunk] = np.asarray(candidates)[dist_sq.argmin(axis=1)]
+    return nearest
+
+def railing_points(boxes, s):
+    """Points at parameter s (0..4, one per side) around each castle box, and the walk direction"""
+    side = np.floor(s).astype(np.int64) % 4
+    t = (s - np.floor(s))[:, None]
+    corners = np.stack([boxes[:, [0, 2]], boxes[:, [1, 2]], boxes[:, [1, 3]], boxes[:, [0, 3]]], axis=1)
+    rows = np.arange(len(boxes))
+    start, end = corners[rows, side], corners[rows, (side + 1) % 4]
+    return start + t * (end - start), end - start
+
+def start_siege(attackers=SIEGE_ATTACKERS, defenders_per_castle=SIEGE_DEFENDERS_PER_CASTLE, seed=0):
+    """Spawn defenders spread along every castle's railing and attackers in a ring around the world"""
+    rng = np.random.default_rng(seed)
+    castle_count = len(castle_configs)
+    reset_units(attackers + defenders_per_castle * castle_count)
+    boxes = get_collision_index()['box_array']
+    
+    if castle_count and defenders_per_castle:
+        castles = np.repeat(np.arange(castle_count), defenders_per_castle)
+        patrol = np.tile((np.arange(defenders_per_castle) + 0.5) * 4 / defenders_per_castle, castle_count)
+        points, _ = railing_points(boxes[castles], patrol)
+        walls = np.array([c['position'][2] + c['wall_height'] for c in castle_configs], dtype=np.float64)
+        add_units(UNIT_DEFENDER, np.column_stack((points, walls[castles])), castles, patrol,
+                  rng.uniform(0, UNIT_RELOAD, len(castles)))
+    
+    if castle_count and attackers:
+        half_size = get_ground_extent()[0]
+        radius = rng.uniform(0.6, 0.95, attackers) * half_size
+        angle = rng.uniform(0, 2 * np.pi, attackers)
+        x = (radius * np.cos(angle)).clip(-half_size, half_size)
+        y = (radius * np.sin(angle)).clip(-half_size, half_size)
+        targets = nearest_castles(x, y, range(castle_count))
+        add_units(UNIT_ATTACKER, np.column_stack((x, y, np.zeros(attackers))), targets)
+        # Build the gate flow fields up front rather than in the first tick
+        get_nav_graph()
+        for target in np.unique(targets):
+            get_gate_flow_field(target)
+    
+    siege.update(active=True, ticks=0, tick_ms=0.0, losses=[0, 0], fallen=0, rng=rng)
+
+def stop_siege():
+    siege['active'] = False
+    reset_units()
+
+def push_out_of_castles(index, pos):
+    """Move ground units standing inside a castle box to its nearest edge"""
+    inside = find_containing_castles(index, pos[:, 0], pos[:, 1], pos[:, 2], buffer=0)
+    rows = np.flatnonzero(inside >= 0)
+    if len(rows) == 0:
+        return
+    box = index['box_array'][inside[rows]]
+    x, y = pos[rows, 0], pos[rows, 1]
+    gaps = np.column_stack((x - box[:, 0], box[:, 1] - x, y - box[:, 2], box[:, 3] - y))
+    edge = gaps.argmin(axis=1)
+    pos[rows, 0] = np.where(edge == 0, box[:, 0], np.where(edge == 1, box[:, 1], x))
+    pos[rows, 1] = np.where(edge == 2, box[:, 2], np.where(edge == 3, box[:, 3], y))
+
+def push_out_of_rock(pos):
+    """Keep ground units off the rock tower, outside its stair radius"""
+    rock_x, rock_y, rock_z = central_rock_pos
+    outer = ROCK_STAIR_RADII[1]
+    dx, dy = pos[:, 0] - rock_x, pos[:, 1] - rock_y
+    dist_sq = dx * dx + dy * dy
+    rows = np.flatnonzero((dist_sq < outer ** 2) & (pos[:, 2] <= rock_z + 1600))
+    if len(rows) == 0:
+        return
+    dist = np.maximum(np.sqrt(dist_sq[rows]), 0.1)
+    pos[rows, 0] = rock_x + dx[rows] / dist * outer
+    pos[rows, 1] = rock_y + dy[rows] / dist * outer
+
+def siege_tick(dt):
+    """Advance every unit by one fixed step: steer, move, collide, fight, remove the dead"""
+    tick_start = time.perf_counter()
+    index = get_collision_index()
+    boxes = index['box_array']
+    count = units['count']
+    pos, vel = units['pos'][:count], units['vel'][:count]
+    heading, health = units['heading'][:count], units['health'][:count]
+    castle, patrol = units['castle'][:count], units['patrol'][:count]
+    attackers = np.flatnonzero(units['team'][:count] == UNIT_ATTACKER)
+    defenders = np.flatnonzero(units['team'][:count] == UNIT_DEFENDER)
+    
+    defenders_at = np.bincount(castle[defenders], minlength=len(boxes))
+    standing = np.flatnonzero(defenders_at > 0)
+    siege['fallen'] = len(boxes) - len(standing)
+    # Attackers whose castle has fallen move on to the nearest one still standing
+    retarget = attackers[defenders_at[castle[attackers]] == 0]
+    if len(retarget) and len(standing):
+        castle[retarget] = nearest_castles(pos[retarget, 0], pos[retarget, 1], standing)
+    
+    # Attackers follow their castle's gate flow field and stop in range of its walls. Past
+    # the gate, where the field has no route or is not built yet, they head straight for the closest wall
+    box = boxes[castle[attackers]]
+    x, y = pos[attackers, 0], pos[attackers, 1]
+    to_x = x.clip(box[:, 0], box[:, 1]) - x
+    to_y = y.clip(box[:, 2], box[:, 3]) - y
+    distance = np.hypot(to_x, to_y)
+    steer = np.column_stack((to_x, to_y)) / np.maximum(distance, 1e-9)[:, None]
+    targets = castle[attackers]
+    # start_siege builds the first targets' fields; retargeting builds a few more per tick
+    get_nav_graph()
+    builds = nav_stats['flow_builds']
+    for target in np.unique(targets):
+        field = get_gate_flow_field(target, build=nav_stats['flow_builds'] - builds < NAV_FLOW_BUILDS_PER_TICK)
+        if field is None:
+            continue
+        rows = np.flatnonzero(targets == target)
+        direction, remaining = sample_flow(field, x[rows], y[rows])
+        routed = np.isfinite(remaining) & (remaining > 0)
+        steer[rows[routed]] = direction[routed]
+    engaged = (distance <= UNIT_ATTACK_RANGE) & (defenders_at[targets] > 0)
+    speed = np.where(engaged | (defenders_at[targets] == 0), 0.0, UNIT_SPEED[UNIT_ATTACKER])
+    vel[attackers] = steer * speed[:, None]
+    pos[attackers, 0] += vel[attackers, 0] * dt
+    pos[attackers, 1] += vel[attackers, 1] * dt
+    
+    # Defenders walk their railing at a steady speed (a box side is one patrol unit)
+    box = boxes[castle[defenders]]
+    perimeter = 2 * ((box[:, 1] - box[:, 0]) + (box[:, 3] - box[:, 2]))
+    patrol[defenders] = (patrol[defenders] + 4 * UNIT_SPEED[UNIT_DEFENDER] * dt / perimeter) % 4
+    points, direction = railing_points(box, patrol[defenders])
+    length = np.maximum(np.hypot(direction[:, 0], direction[:, 1]), 1e-9)[:, None]
+    vel[defenders] = direction / length * UNIT_SPEED[UNIT_DEFENDER]
+    # Clamped to the castle box, like the player inside a castle
+    pos[defenders, 0] = points[:, 0].clip(box[:, 0], box[:, 1])
+    pos[defenders, 1] = points[:, 1].clip(box[:, 2], box[:, 3])
+    
+    ground = pos[attackers]
+    push_out_of_castles(index, ground)
+    push_out_of_rock(ground)
+    half_size = get_ground_extent()[0]
+    pos[attackers] = ground.clip([-half_size, -half_size, 0], [half_size, half_size, 0])
+    
+    moving = (vel[:, 0] != 0) | (vel[:, 1] != 0)
+    heading[moving] = np.degrees(np.arctan2(vel[moving, 1], vel[moving, 0])) - 90
+    
+    engaged = attackers[engaged]
+    attackers_at = np.bincount(castle[engaged], minlength=len(boxes))
+    fire_defender_arrows(boxes, defenders, engaged, attackers_at, dt)
+    # The attackers' damage at a castle is shared evenly by its defenders
+    health[defenders] -= (ATTACKER_DPS * dt * attackers_at[castle[defenders]] /
+                          defenders_at[castle[defenders]])
+    remove_dead_units()
+    
+    siege['ticks'] += 1
+    siege['tick_ms'] = (time.perf_counter() - tick_start) * 1000
+
+def fire_defender_arrows(boxes, defenders, engaged, attackers_at, dt):
+    """Defenders whose bow is ready shoot at a random attacker engaged with their castle
+    
+    Arrows leave from just outside the wall's outer face, so they clear the wall they stand on;
+    a target behind the shooter's wall is passed over and another is drawn next tick.
+    """
+    reload, castle = units['reload'], units['castle']
+    reload[defenders] -= dt
+    shooters = defenders[(reload[defenders] <= 0) & (attackers_at[castle[defenders]] > 0)]
+    if len(shooters) == 0:
+        return
+    
+    by_castle = engaged[np.argsort(castle[engaged], kind='stable')]
+    first = np.searchsorted(castle[by_castle], castle[shooters])
+    offset = (siege['rng'].random(len(shooters)) * attackers_at[castle[shooters]]).astype(np.int64)
+    targets = units['pos'][by_castle[first + offset]] + [0, 0, UNIT_HIT_HEIGHT / 2]
+    
+    # Outward normal of the railing side each shooter is on (sides run y-min, x-max, y-max, x-min)
+    side = np.floor(units['patrol'][shooters]).astype(np.int64) % 4
+    normals = np.array([[0, -1], [1, 0], [0, 1], [-1, 0]], dtype=np.float64)[side]
+    overhang = np.array([castle_configs[c]['wall_thickness'] / 2 for c in range(len(boxes))])[castle[shooters]]
+    origins = units['pos'][shooters] + [0, 0, 2.5 * UNIT_SCALE]
+    origins[:, :2] += normals * (overhang + CASTLE_WALL_INSET + 2 * PROJECTILE_RADIUS[PROJECTILE_ARROW])[:, None]
+    
+    facing = np.einsum('ij,ij->i', targets[:, :2] - origins[:, :2], normals) > 0
+    origins, targets = origins[facing], targets[facing]
+    fire_projectiles(PROJECTILE_ARROW, origins, ballistic_velocity(origins, targets, ARROW_SPEED), UNIT_DEFENDER)
+    reload[shooters[facing]] = UNIT_RELOAD
+
+def get_unit_template(team, lod):
+    """draw_human at one LOD tier recorded once as a GL_TRIANGLES instance template"""
+    key = (team, lod)
+    if key not in unit_templates:
+        batches = record_draw(lambda: draw_human(0, 0, 0, scale=100, angle=0, lod=lod,
+                                                 torso_color=UNIT_TORSO_COLORS[team]))
+        data = []
+        for mode, _, rows in batches:
+            if mode == GL_QUADS:
+                rows = rows.reshape(-1, 4, 6)[:, [0, 1, 2, 0, 2, 3]].reshape(-1, 6)
+            data.append(rows)
+        data = np.concatenate(data)
+        unit_templates[key] = make_template(f'unit {team} {lod}', data[:, 3:6], data[:, 0:3], GL_TRIANGLES)
+    return unit_templates[key]
+
+def draw_units():
+    """Draw the visible units as one instanced mesh per team and LOD tier"""
+    count = units['count']
+    if count == 0:
+        return
+    
+    pos = units['pos'][:count]
+    centers = pos + [0, 0, UNIT_CULL_RADIUS]
+    planes = get_view_frustum()
+    visible = np.all(centers @ planes[:, :3].T + planes[:, 3] >= -UNIT_CULL_RADIUS, axis=1)
+    distance = np.linalg.norm(centers - get_camera_eye(), axis=1)
+    lod = np.searchsorted(UNIT_LOD_DISTANCES, distance)
+    # A crowd around the camera would otherwise expand thousands of full-detail meshes
+    rows = np.flatnonzero(visible)
+    rank = np.empty(len(rows), dtype=np.int64)
+    rank[np.argsort(distance[rows], kind='stable')] = np.arange(len(rows))
+    lod[rows] = np.maximum(lod[rows], np.searchsorted(np.cumsum(UNIT_LOD_BUDGET), rank, side='right'))
+    headings = units['heading'][:count]
+    team = units['team'][:count]
+    for t in (UNIT_ATTACKER, UNIT_DEFENDER):
+        for tier in range(len(HUMAN_LOD_SEGMENTS)):
+            rows = np.flatnonzero(visible & (team == t) & (lod == tier))
+            if len(rows):
+                queue_instances(get_unit_template(t, tier),
+                                pack_instances(pos[rows], UNIT_SCALE / 100, headings[rows], 1.0))
+    flush_instances()
+
+# Physics: projectiles (arrows, catapult stones) and swinging ropes. Projectile state is a
+# struct-of-arrays store stepped a whole array at a time; collisions go through uniform
+# grids of boxes (static walls, towers and the rock, plus the units rebuilt every tick)
+# that hand the narrow phase only the pairs sharing a cell. Ropes are verlet chains kept
+# as one (ropes, points, 3) array.
+GRAVITY = 1500.0
+PHYSICS_CELL_SIZE = 400
+PROJECTILE_ARROW, PROJECTILE_STONE = 0, 1
+PROJECTILE_RADIUS = (5.0, 40.0)  # by kind
+PROJECTILE_DAMAGE = (25.0, 60.0)
+PROJECTILE_LIFETIME = (6.0, 12.0)  # seconds
+ARROW_SPEED = 2500.0  # horizontal speed an arrow is aimed with
+STONE_SPEED = 2000.0
+PROJECTILE_FIELDS = {
+    'pos': (3, np.float64),
+    'vel': (3, np.float64),
+    'kind': (None, np.int8),
+    'team': (None, np.int8),  # units of this team are not hit
+    'age': (None, np.float64)
+}
+ROCK_TOWER_HALF_SIZE = (176, 165)  # widest block in draw_rock_tower
+ROPE_ITERATIONS = 8
+ROPE_DAMPING = 0.99
+ROPE_WIND = 800.0  # peak sideways acceleration of the gusts that swing the ropes
+ROPE_WIND_PERIOD = 5.0
+projectiles = {'count': 0}
+physics = {'colliders': None, 'key': None, 'hits': [0, 0, 0], 'tick_ms': 0.0}  # hits: ground, static, units
+rope_sim = {'enabled': False, 'key': None, 'time': 0.0}
+
+def reset_projectiles():
+    reset_buffers(projectiles, PROJECTILE_FIELDS)
+
+reset_projectiles()
+
+def fire_projectiles(kind, origins, velocities, team):
+    """Launch projectiles of one kind from origins (N, 3) with velocities (N, 3)"""
+    append_rows(projectiles, PROJECTILE_FIELDS, len(origins),
+                {'pos': origins, 'vel': velocities, 'kind': kind, 'team': team})
+
+def ballistic_velocity(origins, targets, speed):
+    """Launch velocities that reach targets under gravity at the given horizontal speed"""
+    offset = np.asarray(targets, dtype=np.float64) - origins
+    flight = np.maximum(np.hypot(offset[:, 0], offset[:, 1]) / speed, 0.05)[:, None]
+    velocity = offset / flight
+    velocity[:, 2] += 0.5 * GRAVITY * flight[:, 0]
+    return velocity
+
+def build_box_grid(boxes, cell_size=PHYSICS_CELL_SIZE):
+    """Uniform grid over (M, 6) boxes: sorted cell keys, each with a run of box indices
+    
+    A box is listed in every cell it overlaps, so a point only looks at its own cell.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+    i0, i1 = np.floor(boxes[:, 0] / cell_size), np.floor(boxes[:, 1] / cell_size)
+    j0, j1 = np.floor(boxes[:, 2] / cell_size), np.floor(boxes[:, 3] / cell_size)
+    columns = (j1 - j0 + 1).astype(np.int64)
+    counts = (i1 - i0 + 1).astype(np.int64) * columns
+    owner = np.repeat(np.arange(len(boxes)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = cell_keys(i0[owner] + local // columns[owner], j0[owner] + local % columns[owner])
+    order = np.argsort(keys, kind='stable')
+    cells, starts, runs = np.unique(keys[order], return_index=True, return_counts=True)
+    return {'cell_size': cell_size, 'boxes': boxes, 'keys': cells, 'starts': starts, 'runs': runs,
+            'items': owner[order]}
+
+def query_box_grid(grid, x, y):
+    """Candidate (point, box) index pairs: the boxes listed in each point's cell"""
+    keys = grid['keys']
+    if len(keys) == 0 or len(x) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    cell_size = grid['cell_size']
+    point_keys = cell_keys(np.floor(x / cell_size), np.floor(y / cell_size))
+    rows = np.searchsorted(keys, point_keys).clip(max=len(keys) - 1)
+    points = np.flatnonzero(keys[rows] == point_keys)
+    rows = rows[points]
+    runs = grid['runs'][rows]
+    local = np.arange(runs.sum()) - np.repeat(np.cumsum(runs) - runs, runs)
+    return np.repeat(points, runs), grid['items'][np.repeat(grid['starts'][rows], runs) + local]
+
+def first_box_hits(grid, pos, radius, allowed=None):
+    """For each point, the first box it touches (grown by its radius), or -1
+    
+    allowed(points, boxes) can veto candidate pairs, e.g. to skip a projectile's own team.
+    """
+    points, boxes = query_box_grid(grid, pos[:, 0], pos[:, 1])
+    hits = np.full(len(pos), -1, dtype=np.int64)
+    if len(points) == 0:
+        return hits
+    box, r, p = grid['boxes'][boxes], radius[points], pos[points]
+    touching = ((box[:, 0] - r <= p[:, 0]) & (p[:, 0] <= box[:, 1] + r) &
+                (box[:, 2] - r <= p[:, 1]) & (p[:, 1] <= box[:, 3] + r) &
+                (box[:, 4] - r <= p[:, 2]) & (p[:, 2] <= box[:, 5] + r))
+    if allowed is not None:
+        touching &= allowed(points, boxes)
+    points, boxes = points[touching], boxes[touching]
+    first_points, first = np.unique(points, return_index=True)
+    hits[first_points] = boxes[first]
+    return hits
+
+def collect_static_colliders():
+    """Boxes (min_x, max_x, min_y, max_y, min_z, max_z) for castle walls, towers and interiors,
+    the perimeter walls and the rock tower"""
+    boxes = []
+    for castle in castle_configs:
+        cx, cy, cz = castle['position']
+        half = castle['size'] / 2
+        along, across = half - CASTLE_WALL_INSET, castle['wall_thickness'] / 2
+        top = cz + castle['wall_height']
+        boxes += [(cx - along, cx + along, cy + side * half - across, cy + side * half + across, cz, top)
+                  for side in (-1, 1)]
+        boxes += [(cx + side * half - across, cx + side * half + across, cy - along, cy + along, cz, top)
+                  for side in (-1, 1)]
+        radius = castle['tower_radius']
+        boxes += [(cx + sx * half - radius, cx + sx * half + radius, cy + sy * half - radius,
+                   cy + sy * half + radius, cz, cz + castle['height'])
+                  for sx in (-1, 1) for sy in (-1, 1)]
+        interior = castle['size'] * 0.4
+        boxes.append((cx - interior, cx + interior, cy - interior, cy + interior, cz, top))
+    
+    if perimeter_wall_layout is not None or len(castle_configs) > 2:
+        half_width = PERIMETER_WALL_THICKNESS / 2
+        for x1, y1, x2, y2 in get_perimeter_wall_segments():
+            # Boxes around the segment; exact for the axis-aligned walls every scene uses
+            boxes.append((min(x1, x2) - half_width, max(x1, x2) + half_width,
+                          min(y1, y2) - half_width, max(y1, y2) + half_width, 0, PERIMETER_WALL_HEIGHT))
+    
+    rock_x, rock_y, rock_z = central_rock_pos
+    half_x, half_y = ROCK_TOWER_HALF_SIZE
+    boxes.append((rock_x - half_x, rock_x + half_x, rock_y - half_y, rock_y + half_y, rock_z, rock_z + 1600))
+    return np.array(boxes, dtype=np.float64).reshape(-1, 6)
+
+def get_static_collider_grid():
+    """Broad-phase grid of the static colliders, rebuilt when the scene changed"""
+    key = get_nav_key()
+    if physics['colliders'] is None or physics['key'] != key:
+        physics['colliders'] = build_box_grid(collect_static_colliders())
+        physics['key'] = key
+    return physics['colliders']
+
+def invalidate_static_colliders():
+    physics['colliders'] = None
+
+def projectile_tick(dt):
+    """Move every projectile, then resolve ground, static and unit hits and drop spent ones"""
+    count = projectiles['count']
+    if count == 0:
+        return
+    pos, vel = projectiles['pos'][:count], projectiles['vel'][:count]
+    kind, team, age = projectiles['kind'][:count], projectiles['team'][:count], projectiles['age'][:count]
+    vel[:, 2] -= GRAVITY * dt
+    pos += vel * dt
+    age += dt
+    radius = np.take(PROJECTILE_RADIUS, kind)
+    
+    grounded = pos[:, 2] <= 0
+    static = first_box_hits(get_static_collider_grid(), pos, radius) >= 0
+    live = ~(grounded | static)
+    
+    struck = np.zeros(count, dtype=bool)
+    unit_count = units['count']
+    rows = np.flatnonzero(live)
+    if unit_count and len(rows):
+        unit_pos = units['pos'][:unit_count]
+        unit_boxes = np.column_stack((unit_pos[:, 0] - UNIT_HIT_RADIUS, unit_pos[:, 0] + UNIT_HIT_RADIUS,
+                                      unit_pos[:, 1] - UNIT_HIT_RADIUS, unit_pos[:, 1] + UNIT_HIT_RADIUS,
+                                      unit_pos[:, 2], unit_pos[:, 2] + UNIT_HIT_HEIGHT))
+        unit_team, health = units['team'][:unit_count], units['health'][:unit_count]
+        hits = first_box_hits(build_box_grid(unit_boxes), pos[rows], radius[rows],
+                              lambda p, u: (unit_team[u] != team[rows[p]]) & (health[u] > 0))
+        hit = hits >= 0
+        np.subtract.at(health, hits[hit], np.take(PROJECTILE_DAMAGE, kind[rows[hit]]))
+        struck[rows[hit]] = True
+        remove_dead_units()
+    
+    physics['hits'][0] += int(grounded.sum())
+    physics['hits'][1] += int((static & ~grounded).sum())
+    physics['hits'][2] += int(struck.sum())
+    compact_rows(projectiles, PROJECTILE_FIELDS, live & ~struck & (age < np.take(PROJECTILE_LIFETIME, kind)))
+
+def fire_stone():
+    """Catapult stone from the player, thrown forward at 45 degrees"""
+    rad = radians(player_angle + 90)
+    speed = STONE_SPEED * sqrt(0.5)
+    origin = [player_pos[0], player_pos[1], player_pos[2] + 150]
+    fire_projectiles(PROJECTILE_STONE, [origin], [[speed * cos(rad), speed * sin(rad), speed]], UNIT_DEFENDER)
+
+def get_rope_state():
+    """Verlet state of every castle's rope, started from its static curve"""
+    endpoints = [get_rope_endpoints(config) for config in castle_configs]
+    if rope_sim['key'] != repr(endpoints):
+        points = np.array([rope_curve(start, end) for start, end in endpoints], dtype=np.float64)
+        points = points.reshape(-1, ROPE_SEGMENTS + 1, 3)
+        rope_sim.update(
+            key=repr(endpoints),
+            pos=points,
+            prev=points.copy(),
+            # Rest lengths keep the static curve's slack
+            rest=np.linalg.norm(np.diff(points, axis=1), axis=2).mean(axis=1)[:, None]
+        )
+    return rope_sim
+
+def rope_tick(dt):
+    """Verlet step for all ropes at once, then length constraints with both ends pinned"""
+    state = get_rope_state()
+    pos, prev = state['pos'], state['prev']
+    if len(pos) == 0:
+        return
+    rope_sim['time'] += dt
+    gust = ROPE_WIND * sin(2 * np.pi * rope_sim['time'] / ROPE_WIND_PERIOD)
+    anchors = pos[:, [0, -1]].copy()
+    
+    velocity = (pos - prev) * ROPE_DAMPING
+    prev[:] = pos
+    pos += velocity + np.array([gust, 0.6 * gust, -GRAVITY]) * dt * dt
+    for _ in range(ROPE_ITERATIONS):
+        delta = pos[:, 1:] - pos[:, :-1]
+        length = np.maximum(np.linalg.norm(delta, axis=2), 1e-9)
+        correction = delta * ((length - state['rest']) / length / 2)[:, :, None]
+        pos[:, :-1] += correction
+        pos[:, 1:] -= correction
+        pos[:, [0, -1]] = anchors
+
+def physics_active():
+    return projectiles['count'] > 0 or rope_sim['enabled']
+
+def physics_tick(dt):
+    """One fixed physics step: projectiles, and the ropes while they are simulated"""
+    tick_start = time.perf_counter()
+    projectile_tick(dt)
+    if rope_sim['enabled']:
+        rope_tick(dt)
+    physics['tick_ms'] = (time.perf_counter() - tick_start) * 1000
+
+def draw_ropes():
+    """Draw every castle's rope to the rock tower, simulated or at rest, in one call"""
+    if rope_sim['enabled']:
+        ropes = get_rope_state()['pos'].astype(np.float32)
+    else:
+        ropes = np.array([rope_curve(*get_rope_endpoints(config)) for config in castle_configs],
+                         dtype=np.float32).reshape(-1, ROPE_SEGMENTS + 1, 3)
+    if len(ropes) == 0:
+        return
+    glColor3f(0.4, 0.3, 0.2)
+    glLineWidth(3.0)
+    draw_vertex_array(np.stack((ropes[:, :-1], ropes[:, 1:]), axis=2).reshape(-1, 3), GL_LINES)
+    glLineWidth(1.0)
+
+def draw_projectiles():
+    """Draw projectiles as instanced cubes, arrows stretched along their flight"""
+    count = projectiles['count']
+    if count == 0:
+        return
+    pos, vel, kind = projectiles['pos'][:count], projectiles['vel'][:count], projectiles['kind'][:count]
+    sizes = np.where((kind == PROJECTILE_ARROW)[:, None], [60, 6, 6], [80, 80, 80])
+    colors = np.where((kind == PROJECTILE_ARROW)[:, None], [0.35, 0.25, 0.15], [0.45, 0.45, 0.4])
+    queue_cubes(pos, sizes, np.degrees(np.arctan2(vel[:, 1], vel[:, 0])), colors)
+    flush_instances()
+
+def get_camera_eye():
+    """Camera position orbiting the player"""
+    eye_x = cam_dist * cos(radians(cam_angle_v)) * cos(radians(cam_angle_h))
+    eye_y = cam_dist * cos(radians(cam_angle_v)) * sin(radians(cam_angle_h))
+    eye_z = cam_dist * sin(radians(cam_angle_v))
+    return [eye_x + player_pos[0], eye_y + player_pos[1], eye_z + player_pos[2]]
 
 def setup_camera():
     """Setup camera perspective"""
     glMatrixMode(GL_PROJECTION)
     glLoadIdentity()
-    gluPerspective(fovY, 1.25, 0.1, 30000)
+    gluPerspective(fovY, CAMERA_ASPECT, CAMERA_NEAR, CAMERA_FAR)
     glMatrixMode(GL_MODELVIEW)
     glLoadIdentity()
     
-    eye_x = cam_dist * cos(radians(cam_angle_v)) * cos(radians(cam_angle_h))
-    eye_y = cam_dist * cos(radians(cam_angle_v)) * sin(radians(cam_angle_h))
-    eye_z = cam_dist * sin(radians(cam_angle_v))
-    
-    gluLookAt(eye_x + player_pos[0], eye_y + player_pos[1], eye_z + player_pos[2],
+    eye_x, eye_y, eye_z = get_camera_eye()
+    gluLookAt(eye_x, eye_y, eye_z,
               player_pos[0], player_pos[1], player_pos[2], 0, 0, 1)
 
-def show_screen():
-    """Main display function"""
+def init_gl():
+    """GL state shared by the window and the headless renderer"""
+    glEnable(GL_DEPTH_TEST)
+    glDepthFunc(GL_LESS)
+
+def render_scene(show_hud=True):
+    """Render one frame into the current framebuffer (no buffer swap)"""
+    frame_start = time.perf_counter()
+    if show_hud and text_atlas is None:
+        build_text_atlas()
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
     glLoadIdentity()
-    glViewport(0, 0, 1000, 800)
+    glViewport(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
     setup_camera()
     
-    draw_multi_colored_grid()
-    draw_all_structures()
-    draw_mountain_range()
-    draw_minimal_vegetation()
+    draw_static_scene()
+    draw_ropes()
+    draw_human(player_pos[0], player_pos[1], player_pos[2], scale=60)
+    draw_units()
+    draw_projectiles()
     
-    # Display info
+    if profiler['enabled']:
+        elapsed = time.perf_counter() - frame_start
+        profiler['frames'] += 1
+        profiler['frame_times'].append(elapsed)
+        profiler['trace'].append(('frame', frame_start, elapsed, 0))
+    
+    if show_hud:
+        draw_hud()
+        if profiler['enabled']:
+            draw_profiler_hud()
+        flush_text()
+
+def draw_hud():
+    """Display info"""
     draw_text(10, 770, f"Castle Complex - Fixed Clamping & Tower Navigation")
     draw_text(10, 740, "Controls: Arrows=Rotate, Z/X=Zoom, WASD=Move")
-    draw_text(10, 710, "Teleport: 1/2/3=Castles, T=Tower Top, G=Ground")
+    draw_text(10, 710, "Teleport: 1/2/3=Castles, T=Tower Top, G=Ground, P=Profiler, O=Save Trace, V=Siege, "
+                       "F=Fire Stone, R=Rope Physics")
     draw_text(10, 680, f"Position: ({int(player_pos[0])}, {int(player_pos[1])}, {int(player_pos[2])})")
+    draw_text(10, 650, f"Objects: {cull_stats['drawn']} drawn, {cull_stats['culled']} culled, {cull_stats['tested']} tested")
+    if world_stream['enabled']:
+        stats = world_stream_stats
+        draw_text(10, 620, f"Chunks: {stats['resident']} resident ({stats['resident_bytes'] // (1 << 20)} MB), "
+                           f"{stats['pending']} pending, build {stats['build_ms_last']:.0f} ms, "
+                           f"{stats['upload_stalls']} upload stalls")
+    if siege['active']:
+        teams = np.bincount(units['team'][:units['count']], minlength=2)
+        draw_text(10, 590, f"Siege: {teams[UNIT_ATTACKER]} attackers, {teams[UNIT_DEFENDER]} defenders, "
+                           f"{siege['fallen']} castles fallen, tick {siege['tick_ms']:.1f} ms")
+    if physics_active():
+        ground, static, hit_units = physics['hits']
+        draw_text(10, 560, f"Physics: {projectiles['count']} projectiles, hits {hit_units} units / "
+                           f"{static} walls / {ground} ground, ropes {'on' if rope_sim['enabled'] else 'off'}, "
+                           f"tick {physics['tick_ms']:.1f} ms")
+
+# Opt-in profiler. enable_profiling() swaps the module's draw_* functions (and the GL
+# entry points that emit geometry) for recording wrappers and disable_profiling() puts
+# the originals back, so nothing is wrapped and nothing is paid while it is off.
+PROFILE_TOP_N = 6
+PROFILE_HISTORY = 120
+PROFILE_TRACE_LIMIT = 200000
+PROFILE_TRACE_PATH = 'castle_trace.json'
+PROFILE_EXCLUDE = {'draw_text', 'draw_hud', 'draw_profiler_hud', 'draw_frame_time_graph'}
+PROFILE_GL_HOOKS = ['glBegin', 'glEnd', 'glVertex3f', 'glDrawArrays', 'glCallList', 'glNewList', 'glEndList']
+PRIMITIVE_SIZES = {GL_QUADS: 4, GL_TRIANGLES: 3, GL_LINES: 2}
+profiler = {
+    'enabled': False,
+    'originals': {},
+    'stats': {},
+    'stack': [],
+    'frames': 0,
+    'frame_times': deque(maxlen=PROFILE_HISTORY),
+    'trace': deque(maxlen=PROFILE_TRACE_LIMIT),
+    'list_counts': {},
+    'compiling': None,
+    'begin': None,
+    'epoch': 0.0,
+    'exported': None  # event count of the last trace export, shown in the HUD
+}
+
+def count_primitives(mode, vertices):
+    """Number of primitives a draw of the given mode and vertex count produces"""
+    if mode in PRIMITIVE_SIZES:
+        return vertices // PRIMITIVE_SIZES[mode]
+    if mode == GL_LINE_STRIP:
+        return max(vertices - 1, 0)
+    if mode == GL_QUAD_STRIP:
+        return max(vertices - 2, 0) // 2
+    return max(vertices - 2, 0)
+
+def profile_geometry(vertices, primitives):
+    """Charge geometry to the display list being compiled, or to the innermost profiled call"""
+    if profiler['compiling'] is not None:
+        counts = profiler['list_counts'][profiler['compiling']]
+        counts[0] += vertices
+        counts[1] += primitives
+    elif profiler['stack']:
+        frame = profiler['stack'][-1]
+        frame['vertices'] += vertices
+        frame['primitives'] += primitives
+
+def make_profiled_function(name, func):
+    """Wrap a draw function to record wall time, calls and geometry per call"""
+    def profiled(*args, **kwargs):
+        label = name
+        if name == 'draw_scene_object':
+            label = f"draw_scene_object[{args[0]['kind']}]"
+        frame = {'child_time': 0.0, 'vertices': 0, 'primitives': 0}
+        profiler['stack'].append(frame)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler['stack'].pop()
+            if profiler['stack']:
+                profiler['stack'][-1]['child_time'] += elapsed
+            entry = profiler['stats'].setdefault(label, {'calls': 0, 'time': 0.0, 'self_time': 0.0,
+                                                         'vertices': 0, 'primitives': 0})
+            entry['calls'] += 1
+            entry['time'] += elapsed
+            entry['self_time'] += elapsed - frame['child_time']
+            entry['vertices'] += frame['vertices']
+            entry['primitives'] += frame['primitives']
+            profiler['trace'].append((label, start, elapsed, frame['vertices']))
+    return profiled
+
+def make_profiled_gl_hook(name, func):
+    """Wrap a GL entry point to count the geometry it submits"""
+    if name == 'glBegin':
+        def hook(mode):
+            profiler['begin'] = [mode, 0]
+            return func(mode)
+    elif name == 'glVertex3f':
+        def hook(x, y, z):
+            if profiler['begin'] is not None:
+                profiler['begin'][1] += 1
+            return func(x, y, z)
+    elif name == 'glEnd':
+        def hook():
+            if profiler['begin'] is not None:
+                mode, vertices = profiler['begin']
+                profile_geometry(vertices, count_primitives(mode, vertices))
+                profiler['begin'] = None
+            return func()
+    elif name == 'glDrawArrays':
+        def hook(mode, first, count):
+            profile_geometry(count, count_primitives(mode, count))
+            return func(mode, first, count)
+    elif name == 'glNewList':
+        def hook(display_list, mode):
+            profiler['compiling'] = display_list
+            profiler['list_counts'][display_list] = [0, 0]
+            return func(display_list, mode)
+    elif name == 'glEndList':
+        def hook():
+            profiler['compiling'] = None
+            return func()
+    else:
+        def hook(display_list):
+            profile_geometry(*profiler['list_counts'].get(display_list, (0, 0)))
+            return func(display_list)
+    return hook
+
+def enable_profiling():
+    """Start recording draw-function timings and geometry counts"""
+    if profiler['enabled']:
+        return
+    module = globals()
+    for name, func in list(module.items()):
+        if name.startswith('draw_') and name not in PROFILE_EXCLUDE and callable(func):
+            profiler['originals'][name] = func
+            module[name] = make_profiled_function(name, func)
+    for name in PROFILE_GL_HOOKS:
+        profiler['originals'][name] = module[name]
+        module[name] = make_profiled_gl_hook(name, module[name])
+    
+    profiler.update(enabled=True, stats={}, stack=[], frames=0, list_counts={}, epoch=time.perf_counter(),
+                    exported=None)
+    profiler['frame_times'].clear()
+    profiler['trace'].clear()
+    # Re-record display lists so their geometry is counted on every replay
+    invalidate_static_scene()
+    release_ground_chunks()
+
+def disable_profiling():
+    """Restore the unwrapped functions"""
+    if not profiler['enabled']:
+        return
+    globals().update(profiler['originals'])
+    profiler['originals'] = {}
+    profiler['enabled'] = False
+
+def export_chrome_trace(path=PROFILE_TRACE_PATH):
+    """Write recorded calls as Chrome trace / Perfetto JSON (complete 'X' events)"""
+    events = [{
+        'name': label,
+        'ph': 'X',
+        'ts': (start - profiler['epoch']) * 1e6,
+        'dur': elapsed * 1e6,
+        'pid': 0,
+        'tid': 0,
+        'args': {'vertices': vertices}
+    } for label, start, elapsed, vertices in profiler['trace']]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return len(events)
+
+def draw_frame_time_graph(x, y, width, height, max_ms=100):
+    """Line graph of recent frame times in the HUD's 1000x800 coordinate space"""
+    glMatrixMode(GL_PROJECTION)
+    glPushMatrix()
+    glLoadIdentity()
+    gluOrtho2D(0, 1000, 0, 800)
+    glMatrixMode(GL_MODELVIEW)
+    glPushMatrix()
+    glLoadIdentity()
+    
+    glColor3f(0.3, 0.3, 0.3)
+    glBegin(GL_LINE_LOOP)
+    glVertex2f(x, y)
+    glVertex2f(x + width, y)
+    glVertex2f(x + width, y + height)
+    glVertex2f(x, y + height)
+    glEnd()
+    
+    glColor3f(1.0, 0.9, 0.2)
+    glBegin(GL_LINE_STRIP)
+    for i, frame_time in enumerate(profiler['frame_times']):
+        glVertex2f(x + i * width / (PROFILE_HISTORY - 1), y + min(frame_time * 1000 / max_ms, 1.0) * height)
+    glEnd()
+    
+    glPopMatrix()
+    glMatrixMode(GL_PROJECTION)
+    glPopMatrix()
+    glMatrixMode(GL_MODELVIEW)
+
+def draw_profiler_hud():
+    """FPS, frame time graph and the most expensive draw functions"""
+    frame_times = profiler['frame_times']
+    frames = max(profiler['frames'], 1)
+    average = sum(frame_times) / len(frame_times) if frame_times else 0.0
+    fps = 1.0 / average if average > 0 else 0.0
+    
+    draw_text(600, 770, f"FPS: {fps:.1f}  Frame: {average * 1000:.2f} ms")
+    draw_frame_time_graph(600, 690, 380, 70)
     
+    top = sorted(profiler['stats'].items(), key=lambda item: -item[1]['self_time'])[:PROFILE_TOP_N]
+    for i, (name, entry) in enumerate(top):
+        draw_text(520, 660 - i * 22,
+                  f"{name[:34]}: {entry['self_time'] * 1000 / frames:.2f} ms, "
+                  f"{entry['calls'] / frames:.0f} calls, {entry['vertices'] // frames} verts",
+                  GLUT_BITMAP_HELVETICA_12)
+    if profiler['exported'] is not None:
+        draw_text(520, 660 - PROFILE_TOP_N * 22,
+                  f"Wrote {profiler['exported']} trace events to {PROFILE_TRACE_PATH}", GLUT_BITMAP_HELVETICA_12)
+
+def show_screen():
+    """Main display function"""
+    scheduler['last_render'] = time.perf_counter()
+    scheduler['dirty'] = False
+    render_scene()
     glutSwapBuffers()
+    if recorder['file'] is not None:
+        record_frame((time.perf_counter() - scheduler['last_render']) * 1000)
 
-def handle_special_keys(key, x, y):
-    """Handle arrow keys"""
+def request_redisplay():
+    """Mark the frame dirty; without a running scheduler, ask GLUT for a redraw right away"""
+    scheduler['dirty'] = True
+    if window_id is not None and not scheduler['running']:
+        glutPostRedisplay()
+
+def orbit_camera(delta_h, delta_v):
+    """Rotate the camera around the player"""
     global cam_angle_h, cam_angle_v
+    cam_angle_h += delta_h
+    cam_angle_v = max(-10, min(89, cam_angle_v + delta_v))
+
+def zoom_camera(delta):
+    """Move the camera toward (negative) or away from the player"""
+    global cam_dist
+    cam_dist = max(1000, min(25000, cam_dist + delta))
+
+def turn_player(degrees):
+    """Rotate the player; positive turns left"""
+    global player_angle
+    player_angle += degrees
+
+def move_player(distance):
+    """Walk forward (or backward for negative distance) and resolve collisions"""
+    rad = radians(player_angle + 90)
+    player_pos[0] += distance * cos(rad)
+    player_pos[1] += distance * sin(rad)
+    clamp_player_position()
+
+def simulation_step(dt):
+    """Advance held-key movement by one fixed step; returns True if anything changed"""
+    # Held keys move at the speed a HELD_KEY_RATE key repeat used to give
+    scale = HELD_KEY_RATE * dt
+    changed = False
+    
+    for key, action in (('z', lambda: zoom_camera(-150 * scale)),
+                        ('x', lambda: zoom_camera(150 * scale)),
+                        ('a', lambda: turn_player(player_turn_speed * scale)),
+                        ('d', lambda: turn_player(-player_turn_speed * scale)),
+                        ('w', lambda: move_player(player_speed * scale)),
+                        ('s', lambda: move_player(-player_speed * scale))):
+        if key in keys_held:
+            action()
+            changed = True
+    
+    for key, delta_h, delta_v in ((GLUT_KEY_LEFT, -5, 0), (GLUT_KEY_RIGHT, 5, 0),
+                                  (GLUT_KEY_UP, 0, 5), (GLUT_KEY_DOWN, 0, -5)):
+        if key in special_keys_held:
+            orbit_camera(delta_h * scale, delta_v * scale)
+            changed = True
+    
+    if siege['active']:
+        siege_tick(dt)
+        changed = True
+    if physics_active():
+        physics_tick(dt)
+        changed = True
+    
+    return changed
+
+def start_scheduler():
+    """Arm the tick timer if it is not already running"""
+    if not scheduler['running']:
+        scheduler['running'] = True
+        scheduler['last_time'] = time.perf_counter()
+        scheduler['accumulator'] = 0.0
+        glutTimerFunc(int(1000 * SIM_DT), scheduler_tick, 0)
+
+def scheduler_tick(value):
+    """Run pending input and fixed simulation steps, then post a redraw if due"""
+    now = time.perf_counter()
+    scheduler['accumulator'] += now - scheduler['last_time']
+    scheduler['last_time'] = now
+    
+    while pending_keys:
+        key = pending_keys.pop(0)
+        if recorder['file'] is not None:
+            record_input(INPUT_KEY_PRESS, key)
+        handle_keyboard(key, 0, 0)
+    
+    steps = 0
+    while scheduler['accumulator'] >= SIM_DT and steps < MAX_SIM_STEPS_PER_TICK:
+        if simulation_step(SIM_DT):
+            scheduler['dirty'] = True
+        if recorder['file'] is not None:
+            record_step()
+        scheduler['accumulator'] -= SIM_DT
+        steps += 1
+    # Drop time we could not catch up on instead of spiralling
+    if steps == MAX_SIM_STEPS_PER_TICK:
+        scheduler['accumulator'] = 0.0
+    
+    if scheduler['dirty'] and now - scheduler['last_render'] >= 1.0 / MAX_FRAME_RATE:
+        glutPostRedisplay()
+    
+    # Stop ticking once nothing is held, moving or waiting to be drawn
+    if keys_held or special_keys_held or pending_keys or scheduler['dirty'] or siege['active'] \
+            or physics_active():
+        glutTimerFunc(int(1000 * SIM_DT), scheduler_tick, 0)
+    else:
+        scheduler['running'] = False
+
+def on_key_down(key, x, y):
+    """Window key press: held keys update key state, the rest run on the next tick"""
+    k = key.decode("utf-8").lower()
+    if k in HELD_KEYS:
+        keys_held.add(k)
+        if recorder['file'] is not None:
+            record_input(INPUT_KEY_DOWN, key)
+    else:
+        pending_keys.append(key)
+    start_scheduler()
+
+def on_key_up(key, x, y):
+    k = key.decode("utf-8").lower()
+    if k in HELD_KEYS and recorder['file'] is not None:
+        record_input(INPUT_KEY_UP, key)
+    keys_held.discard(k)
+
+def on_special_down(key, x, y):
+    special_keys_held.add(key)
+    if recorder['file'] is not None:
+        record_input(INPUT_SPECIAL_DOWN, key)
+    start_scheduler()
+
+def on_special_up(key, x, y):
+    special_keys_held.discard(key)
+    if recorder['file'] is not None:
+        record_input(INPUT_SPECIAL_UP, key)
+
+# Input recording: with CASTLE_RECORD=path, window key events, the player and camera state
+# after each simulation step that changed it and every rendered frame go to a compact binary
+# log. Records carry the simulation step they happened after, so replay.py can feed them
+# back through apply_input_event and simulation_step and land on exactly the same state.
+RECORD_PATH = os.environ.get('CASTLE_RECORD', '')
+RECORD_MAGIC = b'CDIR'
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct('<4sHdH')  # magic, version, SIM_DT, scene path length (path follows)
+RECORD_INPUT = struct.Struct('<BIdH')  # kind, step, seconds since start, key
+RECORD_STATE = struct.Struct('<BI7d')  # kind, step, player x/y/z, player angle, camera h/v/dist
+RECORD_FRAME = struct.Struct('<BIdf')  # kind, step, seconds since start, render ms
+RECORD_FLUSH_BYTES = 1 << 16
+INPUT_KEY_DOWN = 1  # held key pressed
+INPUT_KEY_UP = 2  # held key released
+INPUT_KEY_PRESS = 3  # any other key, logged when the scheduler hands it to handle_keyboard
+INPUT_SPECIAL_DOWN = 4
+INPUT_SPECIAL_UP = 5
+RECORD_STATE_KIND = 6
+RECORD_FRAME_KIND = 7
+RECORD_SIZES = {kind: RECORD_INPUT for kind in range(INPUT_KEY_DOWN, INPUT_SPECIAL_UP + 1)}
+RECORD_SIZES.update({RECORD_STATE_KIND: RECORD_STATE, RECORD_FRAME_KIND: RECORD_FRAME})
+recorder = {'file': None, 'buffer': bytearray(), 'start': 0.0, 'step': 0, 'last_state': None, 'records': 0}
+
+def capture_state():
+    """Player and camera values the log records and the replayer checks"""
+    return (float(player_pos[0]), float(player_pos[1]), float(player_pos[2]), float(player_angle),
+            float(cam_angle_h), float(cam_angle_v), float(cam_dist))
+
+def start_recording(path=RECORD_PATH):
+    """Open a new input log; the current state is written as its step 0"""
+    stop_recording()
+    recorder.update(file=open(path, 'wb'), buffer=bytearray(), start=time.perf_counter(), step=0,
+                    last_state=None, records=0)
+    scene = os.path.abspath(SCENE_PATH).encode('utf-8')
+    recorder['buffer'] += RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, SIM_DT, len(scene)) + scene
+    record_state()
+
+def stop_recording():
+    """Flush and close the input log if one is open; returns how many records it holds"""
+    if recorder['file'] is None:
+        return 0
+    flush_recording()
+    recorder['file'].close()
+    recorder['file'] = None
+    return recorder['records']
+
+def flush_recording():
+    recorder['file'].write(recorder['buffer'])
+    recorder['buffer'] = bytearray()
+
+def write_record(data):
+    recorder['buffer'] += data
+    recorder['records'] += 1
+    if len(recorder['buffer']) >= RECORD_FLUSH_BYTES:
+        flush_recording()
+
+def record_input(kind, key):
+    """Log a key event; keyboard keys are stored as their character code, special keys as is"""
+    code = ord(key.decode("utf-8").lower()) if isinstance(key, bytes) else key
+    write_record(RECORD_INPUT.pack(kind, recorder['step'], time.perf_counter() - recorder['start'], code))
+
+def record_state():
+    """Log the player and camera state if it changed since the last state record"""
+    state = capture_state()
+    if state != recorder['last_state']:
+        recorder['last_state'] = state
+        write_record(RECORD_STATE.pack(RECORD_STATE_KIND, recorder['step'], *state))
+
+def record_step():
+    """Count a finished simulation step and log the state it left behind"""
+    recorder['step'] += 1
+    record_state()
+
+def record_frame(render_ms):
+    write_record(RECORD_FRAME.pack(RECORD_FRAME_KIND, recorder['step'],
+                                   time.perf_counter() - recorder['start'], render_ms))
+
+def read_input_log(path):
+    """Header dict and list of record tuples (kind first) from an input log"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < RECORD_HEADER.size:
+        raise ValueError(f"{path} is not a version {RECORD_VERSION} input log")
+    magic, version, sim_dt, scene_length = RECORD_HEADER.unpack_from(data)
+    offset = RECORD_HEADER.size + scene_length
+    if magic != RECORD_MAGIC or version != RECORD_VERSION or len(data) < offset:
+        raise ValueError(f"{path} is not a version {RECORD_VERSION} input log")
+    header = {'sim_dt': sim_dt, 'scene': data[RECORD_HEADER.size:offset].decode('utf-8')}
     
+    records = []
+    while offset < len(data):
+        layout = RECORD_SIZES.get(data[offset])
+        if layout is None or offset + layout.size > len(data):
+            raise ValueError(f"{path} is truncated or corrupt at byte {offset}")
+        records.append(layout.unpack_from(data, offset))
+        offset += layout.size
+    return header, records
+
+def apply_input_event(kind, key):
+    """Apply a logged key event the way the window handlers and the scheduler did"""
+    if kind == INPUT_KEY_DOWN:
+        keys_held.add(chr(key))
+    elif kind == INPUT_KEY_UP:
+        keys_held.discard(chr(key))
+    elif kind == INPUT_KEY_PRESS:
+        handle_keyboard(chr(key).encode("utf-8"), 0, 0)
+    elif kind == INPUT_SPECIAL_DOWN:
+        special_keys_held.add(key)
+    elif kind == INPUT_SPECIAL_UP:
+        special_keys_held.discard(key)
+
+def handle_special_keys(key, x, y):
+    """Handle arrow keys"""
     if key == GLUT_KEY_LEFT:
-        cam_angle_h -= 5
+        orbit_camera(-5, 0)
     elif key == GLUT_KEY_RIGHT:
-        cam_angle_h += 5
+        orbit_camera(5, 0)
     elif key == GLUT_KEY_UP:
-        cam_angle_v = min(89, cam_angle_v + 5)
+        orbit_camera(0, 5)
     elif key == GLUT_KEY_DOWN:
-        cam_angle_v = max(-10, cam_angle_v - 5)
+        orbit_camera(0, -5)
     
-    glutPostRedisplay()
+    request_redisplay()
 
 def handle_keyboard(key, x, y):
     """Keyboard input with FIXED clamping, tower navigation, and ground drop"""
-    global cam_dist, player_pos, player_angle, player_speed, player_turn_speed, teleport_skip_clamp
+    global player_pos, teleport_skip_clamp
     
     k = key.decode("utf-8").lower()
     
     # Camera zoom
     if k == 'z':
-        cam_dist = max(1000, cam_dist - 150)
+        zoom_camera(-150)
     elif k == 'x':
-        cam_dist = min(25000, cam_dist + 150)
+        zoom_camera(150)
     
     # Player rotation
     elif k == 'a':
-        player_angle += player_turn_speed
+        turn_player(player_turn_speed)
     elif k == 'd':
-        player_angle -= player_turn_speed
+        turn_player(-player_turn_speed)
     
     # Move player forward/backward
     elif k == 'w':
-        rad = radians(player_angle + 90)
-        player_pos[0] += player_speed * cos(rad)
-        player_pos[1] += player_speed * sin(rad)
-        clamp_player_position()
+        move_player(player_speed)
     elif k == 's':
-        rad = radians(player_angle + 90)
-        player_pos[0] -= player_speed * cos(rad)
-        player_pos[1] -= player_speed * sin(rad)
-        clamp_player_position()
+        move_player(-player_speed)
     
-    # Teleport to castle centers
-    elif k in ['1', '2', '3']:
+    # Teleport to castle centers (scenes can have fewer than three)
+    elif k in ['1', '2', '3'] and int(k) <= len(castle_configs):
         teleport_skip_clamp = True
         index = int(k) - 1
         castle = castle_configs[index]
@@ -1045,7 +4210,8 @@ def handle_keyboard(key, x, y):
         player_pos[0] = float(tx)
         player_pos[1] = float(ty)
         player_pos[2] = float(tz)
-        print(f"Teleported to Castle {k} at ({player_pos[0]}, {player_pos[1]}, {player_pos[2]})")
+        if log_levels['teleport'] <= LOG_INFO:
+            log_event('teleport', LOG_INFO, f"Teleported to Castle {k}", position=list(player_pos))
     
     # NEW: Go to rock tower top (like initial position)
     elif k == 't':
@@ -1053,7 +4219,8 @@ def handle_keyboard(key, x, y):
         player_pos[0] = central_rock_pos[0]
         player_pos[1] = central_rock_pos[1] 
         player_pos[2] = central_rock_pos[2] + 1630  # Same as initial position
-        print(f"Teleported to Tower Top at ({player_pos[0]}, {player_pos[1]}, {player_pos[2]})")
+        if log_levels['teleport'] <= LOG_INFO:
+            log_event('teleport', LOG_INFO, "Teleported to Tower Top", position=list(player_pos))
     
     # NEW: Drop to ground level at current X,Y position
     elif k == 'g':
@@ -1061,26 +4228,62 @@ def handle_keyboard(key, x, y):
         # Keep X,Y the same, drop Z to ground level
         ground_level = 50  # Slightly above ground
         player_pos[2] = ground_level
-        print(f"Dropped to ground at ({player_pos[0]}, {player_pos[1]}, {player_pos[2]})")
+        if log_levels['teleport'] <= LOG_INFO:
+            log_event('teleport', LOG_INFO, "Dropped to ground", position=list(player_pos))
         clamp_player_position()  # Apply clamping to ensure valid ground position
     
-    glutPostRedisplay()
+    # Profiler HUD and trace export
+    elif k == 'p':
+        if profiler['enabled']:
+            disable_profiling()
+        else:
+            enable_profiling()
+    elif k == 'o':
+        if profiler['enabled']:
+            profiler['exported'] = export_chrome_trace()
+            if log_levels['profiler'] <= LOG_INFO:
+                log_event('profiler', LOG_INFO, "Exported trace", events=profiler['exported'],
+                          path=PROFILE_TRACE_PATH)
+    
+    # Siege simulation on/off
+    elif k == 'v':
+        if siege['active']:
+            stop_siege()
+        else:
+            start_siege()
+    
+    # Catapult stone from the player, rope physics on/off
+    elif k == 'f':
+        fire_stone()
+    elif k == 'r':
+        rope_sim['enabled'] = not rope_sim['enabled']
+    
+    request_redisplay()
 
 def main():
     """Main function"""
+    global window_id
+    
     glutInit()
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
-    glutInitWindowSize(1000, 800)
+    glutInitWindowSize(WINDOW_WIDTH, WINDOW_HEIGHT)
     glutInitWindowPosition(0, 0)
-    glutCreateWindow(b"Castle Complex - Fixed Clamping & Tower Navigation")
+    window_id = glutCreateWindow(b"Castle Complex - Fixed Clamping & Tower Navigation")
     
-    glEnable(GL_DEPTH_TEST)
-    glDepthFunc(GL_LESS)
+    init_gl()
+    if RECORD_PATH:
+        start_recording(RECORD_PATH)
+        atexit.register(stop_recording)
     
     glutDisplayFunc(show_screen)
-    glutKeyboardFunc(handle_keyboard)
-    glutSpecialFunc(handle_special_keys)
+    glutIgnoreKeyRepeat(1)
+    glutKeyboardFunc(on_key_down)
+    glutKeyboardUpFunc(on_key_up)
+    glutSpecialFunc(on_special_down)
+    glutSpecialUpFunc(on_special_up)
     glutMainLoop()
 
+load_scene(SCENE_PATH)
+
 if __name__ == "__main__":
     main()
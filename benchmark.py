@@ -0,0 +1,430 @@
+"""Frame-time benchmark: replays scripted input paths through the game's key handlers
+
+Usage:
+    python benchmark.py --out results.json                       # headless, all built-in paths
+    python benchmark.py --paths orbit,walk --window              # in a GLUT window
+    python benchmark.py --baseline base.json --tolerance 0.10    # fail on >10% regressions
+    python benchmark.py --scene big.json                         # a worldgen.py scene
+    python benchmark.py --paths '' --siege 10000                 # siege tick throughput only
+    python benchmark.py --paths '' --projectiles 50000           # projectile tick throughput only
+
+A path is a list of input events, each followed by one rendered frame:
+    ["key", "w"]          -> handle_keyboard(b"w", 0, 0)
+    ["special", "LEFT"]   -> handle_special_keys(GLUT_KEY_LEFT, 0, 0)
+Extra paths can be loaded from JSON files with --path-file name=file.json.
+"""
+import argparse
+import json
+import re
+import resource
+import sys
+import time
+
+import numpy as np
+
+# Metrics compared against the baseline; an increase beyond the tolerance is a regression
+BUDGET_METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'gl_calls_per_frame', 'vertices_per_frame']
+
+def repeat(events, times):
+    """Repeat a list of events"""
+    return [list(event) for _ in range(times) for event in events]
+
+BUILTIN_PATHS = {
+    'orbit': repeat([['special', 'LEFT']], 72) + repeat([['special', 'UP']], 10) + repeat([['special', 'DOWN']], 14),
+    'zoom': repeat([['key', 'x']], 60) + repeat([['key', 'z']], 80),
+    'walk': [['key', 'g']] + repeat([['key', 'w']], 30) + repeat([['key', 'a']], 18) +
+            repeat([['key', 'w']], 30) + repeat([['key', 'd']], 36) + repeat([['key', 's']], 30),
+    'teleport': repeat([['key', '1'], ['key', '2'], ['key', '3'], ['key', 't'], ['key', 'g']], 8)
+}
+
+class GLCounter:
+    """Counts GL/GLU calls made by a module and the vertices they submit
+
+    Display lists are followed: vertices recorded while compiling a list are charged again
+    every time glCallList replays it.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.originals = {}
+        self.calls = 0
+        self.vertices = 0
+        self.list_vertices = {}
+        self.list_calls = {}
+        self.compiling = None
+
+    def install(self):
+        source = open(self.module.__file__).read()
+        names = set(re.findall(r'\b(glu?[A-Z]\w*)\s*\(', source))
+        for name in names:
+            func = getattr(self.module, name, None)
+            if callable(func):
+                self.originals[name] = func
+                setattr(self.module, name, self.wrap(name, func))
+
+    def uninstall(self):
+        for name, func in self.originals.items():
+            setattr(self.module, name, func)
+        self.originals = {}
+
+    def record(self, calls, vertices):
+        if self.compiling is not None:
+            self.list_calls[self.compiling] += calls
+            self.list_vertices[self.compiling] += vertices
+        else:
+            self.calls += calls
+            self.vertices += vertices
+
+    def wrap(self, name, func):
+        counter = self
+
+        def counted(*args):
+            if name == 'glNewList':
+                counter.compiling = args[0]
+                counter.list_calls[args[0]] = 0
+                counter.list_vertices[args[0]] = 0
+            elif name == 'glEndList':
+                counter.compiling = None
+            elif name == 'glCallList':
+                counter.record(counter.list_calls.get(args[0], 0), counter.list_vertices.get(args[0], 0))
+            elif name == 'glDrawArrays':
+                counter.record(0, args[2])
+            elif name.startswith('glVertex'):
+                counter.record(0, 1)
+            counter.record(1, 0)
+            return func(*args)
+
+        return counted
+
+    def reset(self):
+        self.calls = 0
+        self.vertices = 0
+
+class DrawTimer:
+    """Inclusive and self Python time for every draw_* function of a module"""
+
+    def __init__(self, module):
+        self.module = module
+        self.originals = {}
+        self.stats = {}
+        self.stack = []
+
+    def install(self):
+        for name, func in list(vars(self.module).items()):
+            if name.startswith('draw_') and callable(func) and getattr(func, '__module__', None) == self.module.__name__:
+                self.originals[name] = func
+                setattr(self.module, name, self.wrap(name, func))
+
+    def uninstall(self):
+        for name, func in self.originals.items():
+            setattr(self.module, name, func)
+        self.originals = {}
+
+    def wrap(self, name, func):
+        timer = self
+
+        def timed(*args, **kwargs):
+            timer.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child_time = timer.stack.pop()
+                if timer.stack:
+                    timer.stack[-1] += elapsed
+                entry = timer.stats.setdefault(name, {'calls': 0, 'total_ms': 0.0, 'self_ms': 0.0})
+                entry['calls'] += 1
+                entry['total_ms'] += elapsed * 1000
+                entry['self_ms'] += (elapsed - child_time) * 1000
+
+        return timed
+
+    def reset(self):
+        self.stats = {}
+
+def apply_event(game, event):
+    """Feed one scripted event to the game's input handlers"""
+    kind, value = event
+    if kind == 'key':
+        game.handle_keyboard(value.encode('utf-8'), 0, 0)
+    elif kind == 'special':
+        game.handle_special_keys(getattr(game, 'GLUT_KEY_' + value), 0, 0)
+    else:
+        raise ValueError(f"Unknown event type: {kind}")
+
+def snapshot_state(game):
+    """Player and camera globals, so every path starts from the same place"""
+    return {
+        'player_pos': list(game.player_pos),
+        'player_angle': game.player_angle,
+        'cam_angle_h': game.cam_angle_h,
+        'cam_angle_v': game.cam_angle_v,
+        'cam_dist': game.cam_dist
+    }
+
+def restore_state(game, state):
+    game.player_pos[:] = state['player_pos']
+    game.player_angle = state['player_angle']
+    game.cam_angle_h = state['cam_angle_h']
+    game.cam_angle_v = state['cam_angle_v']
+    game.cam_dist = state['cam_dist']
+
+def summarize(frame_times, gl_calls, vertices, draw_stats):
+    """Percentiles and per-frame averages for one path"""
+    frame_ms = np.array(frame_times) * 1000
+    return {
+        'frames': len(frame_ms),
+        'mean_ms': float(frame_ms.mean()),
+        'p50_ms': float(np.percentile(frame_ms, 50)),
+        'p95_ms': float(np.percentile(frame_ms, 95)),
+        'p99_ms': float(np.percentile(frame_ms, 99)),
+        'max_ms': float(frame_ms.max()),
+        'gl_calls_per_frame': float(np.mean(gl_calls)),
+        'vertices_per_frame': float(np.mean(vertices)),
+        'draw_functions': {
+            name: {'calls': entry['calls'],
+                   'total_ms': round(entry['total_ms'], 3),
+                   'self_ms': round(entry['self_ms'], 3)}
+            for name, entry in sorted(draw_stats.items(), key=lambda item: -item[1]['self_ms'])
+        }
+    }
+
+def run_paths(game, paths, render, warmup=1):
+    """Replay each path, rendering one frame per event with render(), and collect metrics"""
+    counter, timer = GLCounter(game), DrawTimer(game)
+    counter.install()
+    timer.install()
+    initial = snapshot_state(game)
+    results = {}
+    try:
+        for name, events in paths.items():
+            restore_state(game, initial)
+            for _ in range(warmup):
+                render()
+            # Start every path with the chunks around the player resident (streamed scenes)
+            game.wait_for_world_chunks()
+            timer.reset()
+
+            frame_times, gl_calls, vertices = [], [], []
+            for event in events:
+                apply_event(game, event)
+                counter.reset()
+                start = time.perf_counter()
+                render()
+                frame_times.append(time.perf_counter() - start)
+                gl_calls.append(counter.calls)
+                vertices.append(counter.vertices)
+            results[name] = summarize(frame_times, gl_calls, vertices, timer.stats)
+    finally:
+        timer.uninstall()
+        counter.uninstall()
+        restore_state(game, initial)
+    return results
+
+def scene_summary(game, load_time):
+    """Size of the loaded scene and what building it cost"""
+    start = time.perf_counter()
+    game.build_static_scene()
+    return {
+        'castles': len(game.castle_configs),
+        'mountains': len(game.mountain_positions),
+        'trees': len(game.tree_positions),
+        'bushes': len(game.bush_positions),
+        'scene_objects': len(game.scene_objects),
+        'load_s': load_time,
+        'build_s': time.perf_counter() - start,
+        'baked_bytes': game.scene_cache_stats['bytes'],
+        'cache_hit': game.scene_cache_stats['hit'],
+        'streaming': game.world_stream['enabled']
+    }
+
+def load_scene(game, scene):
+    """Load a scene file into the game if one was given; returns the load time"""
+    start = time.perf_counter()
+    if scene:
+        game.load_scene(scene)
+    return time.perf_counter() - start
+
+def run_headless(paths, warmup, scene=None):
+    """Benchmark through the offscreen renderer"""
+    import headless
+    game = headless.game
+    headless.init_headless()
+    load_time = load_scene(game, scene)
+
+    def render():
+        game.render_scene(show_hud=False)
+        game.glFinish()
+
+    summary = scene_summary(game, load_time)
+    results = run_paths(game, paths, render, warmup)
+    summary['stream_stats'] = dict(game.world_stream_stats)
+    return results, summary
+
+def run_windowed(paths, warmup, scene=None):
+    """Benchmark inside a GLUT window; the HUD and buffer swap are part of each frame"""
+    import CastleDefense as game
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, \
+        glutSwapBuffers, glutDisplayFunc, glutIdleFunc, glutMainLoop, glutLeaveMainLoop, \
+        GLUT_DOUBLE, GLUT_RGB, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
+    glutInitWindowSize(game.WINDOW_WIDTH, game.WINDOW_HEIGHT)
+    glutCreateWindow(b"Castle Complex - Benchmark")
+    game.init_gl()
+    load_time = load_scene(game, scene)
+
+    def render():
+        game.render_scene()
+        glutSwapBuffers()
+        game.glFinish()
+
+    results, summary = {}, {}
+
+    def run_once():
+        glutIdleFunc(None)
+        summary.update(scene_summary(game, load_time))
+        results.update(run_paths(game, paths, render, warmup))
+        summary['stream_stats'] = dict(game.world_stream_stats)
+        glutLeaveMainLoop()
+
+    glutDisplayFunc(lambda: None)
+    glutIdleFunc(run_once)
+    glutMainLoop()
+    return results, summary
+
+def run_siege(game, units, ticks):
+    """Time fixed simulation ticks of a siege and its arrows with about this many units (nothing is rendered)"""
+    castles = len(game.castle_configs)
+    defenders = min(game.SIEGE_DEFENDERS_PER_CASTLE, units // max(castles, 1))
+    game.reset_projectiles()
+    game.physics['hits'] = [0, 0, 0]
+    game.start_siege(units - defenders * castles, defenders)
+    spawned = game.units['count']
+    tick_times = []
+    try:
+        for _ in range(ticks):
+            start = time.perf_counter()
+            game.siege_tick(game.SIM_DT)
+            game.physics_tick(game.SIM_DT)
+            tick_times.append(time.perf_counter() - start)
+        survivors = game.units['count']
+    finally:
+        game.stop_siege()
+        game.reset_projectiles()
+
+    return dict(tick_summary(tick_times), units=spawned, survivors=survivors, arrow_hits=game.physics['hits'][2])
+
+def run_projectiles(game, count, ticks, seed=0):
+    """Time physics ticks of count arrows shot at random ground points across the world"""
+    rng = np.random.default_rng(seed)
+    half_size = game.get_ground_extent()[0]
+    origins = np.column_stack((rng.uniform(-half_size, half_size, (count, 2)), rng.uniform(100, 1500, count)))
+    targets = np.column_stack((origins[:, :2] + rng.uniform(-2000, 2000, (count, 2)), np.zeros(count)))
+    game.reset_projectiles()
+    game.physics['hits'] = [0, 0, 0]
+    velocities = game.ballistic_velocity(origins, targets, game.ARROW_SPEED)
+    game.fire_projectiles(game.PROJECTILE_ARROW, origins, velocities, game.UNIT_ATTACKER)
+    tick_times = []
+    try:
+        for _ in range(ticks):
+            start = time.perf_counter()
+            game.physics_tick(game.SIM_DT)
+            tick_times.append(time.perf_counter() - start)
+        left = game.projectiles['count']
+    finally:
+        game.reset_projectiles()
+
+    ground, static, _ = game.physics['hits']
+    return dict(tick_summary(tick_times), projectiles=count, in_flight=left, ground_hits=ground, static_hits=static)
+
+def tick_summary(tick_times):
+    """Throughput and percentiles of simulation tick times in seconds"""
+    times_ms = np.array(tick_times) * 1000
+    return {
+        'ticks': len(tick_times),
+        'ticks_per_s': len(tick_times) / max(times_ms.sum() / 1000, 1e-9),
+        'tick_p50_ms': float(np.percentile(times_ms, 50)),
+        'tick_p95_ms': float(np.percentile(times_ms, 95)),
+        'tick_max_ms': float(times_ms.max())
+    }
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Regressions where a budgeted metric grew more than tolerance over the baseline"""
+    failures = []
+    for name, metrics in results['paths'].items():
+        base = baseline.get('paths', {}).get(name)
+        if base is None:
+            continue
+        for metric in BUDGET_METRICS:
+            limit = base[metric] * (1 + tolerance)
+            if metrics[metric] > limit:
+                failures.append(f"{name}.{metric}: {metrics[metric]:.3f} > {limit:.3f} "
+                                f"(baseline {base[metric]:.3f} + {tolerance:.0%})")
+    return failures
+
+def load_paths(names, path_files):
+    """Select built-in paths and add any loaded from JSON files"""
+    paths = {}
+    for name in names:
+        if name not in BUILTIN_PATHS:
+            raise SystemExit(f"Unknown path '{name}', choose from {', '.join(BUILTIN_PATHS)}")
+        paths[name] = BUILTIN_PATHS[name]
+    for spec in path_files:
+        name, _, filename = spec.partition('=')
+        with open(filename) as f:
+            paths[name] = json.load(f)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame-time benchmark for the castle scene")
+    parser.add_argument('--paths', default=','.join(BUILTIN_PATHS), help="comma separated built-in paths")
+    parser.add_argument('--path-file', action='append', default=[], help="extra path as name=file.json")
+    parser.add_argument('--window', action='store_true', help="render in a GLUT window instead of headless")
+    parser.add_argument('--scene', help="scene file to load instead of the default scene")
+    parser.add_argument('--warmup', type=int, default=1, help="unmeasured frames before each path")
+    parser.add_argument('--out', help="write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed relative increase per metric")
+    parser.add_argument('--siege', type=int, default=0, help="also time siege ticks with this many units")
+    parser.add_argument('--siege-ticks', type=int, default=600, help="simulation ticks to time for --siege")
+    parser.add_argument('--projectiles', type=int, default=0, help="also time physics ticks with this many arrows")
+    parser.add_argument('--projectile-ticks', type=int, default=120, help="simulation ticks to time for --projectiles")
+    args = parser.parse_args()
+
+    names = [name for name in args.paths.split(',') if name]
+    paths = load_paths(names, args.path_file)
+    run = run_windowed if args.window else run_headless
+    path_results, scene = run(paths, args.warmup, args.scene)
+    results = {
+        'backend': 'window' if args.window else 'headless',
+        'scene': scene,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'paths': path_results
+    }
+    if args.siege:
+        import CastleDefense as game
+        results['siege'] = run_siege(game, args.siege, args.siege_ticks)
+    if args.projectiles:
+        import CastleDefense as game
+        results['projectiles'] = run_projectiles(game, args.projectiles, args.projectile_ticks)
+
+    report = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare_to_baseline(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Headless offscreen renderer for the castle scene (software Mesa through EGL or OSMesa)
+
+Usage:
+    python headless.py --out frames                      # default orbit, PNG files
+    python headless.py --poses poses.json --format rgb   # raw RGB dumps
+
+poses.json is a list of {"camera": {...}, "player": {...}} objects, see render_frame.
+The backend is picked with CASTLE_HEADLESS_BACKEND=egl|osmesa (default egl) and has
+to be chosen before OpenGL is imported, so import this module before CastleDefense.
+"""
+import os
+
+HEADLESS_BACKEND = os.environ.get('CASTLE_HEADLESS_BACKEND', 'egl')
+os.environ.setdefault('PYOPENGL_PLATFORM', HEADLESS_BACKEND)
+if HEADLESS_BACKEND == 'egl':
+    # No display server on build boxes: ask Mesa for a surfaceless EGL display
+    os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+import argparse
+import ctypes
+import json
+import struct
+import zlib
+
+import numpy as np
+from OpenGL.GL import *
+
+import CastleDefense as game
+
+context = None
+
+def create_egl_context(width, height):
+    """EGL pbuffer context backed by a software Mesa driver"""
+    from OpenGL import EGL
+
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("eglInitialize failed")
+
+    config_attribs = (EGL.EGLint * 13)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+        EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_NONE
+    )
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    if not EGL.eglChooseConfig(display, config_attribs, ctypes.pointer(config), 1, ctypes.pointer(num_configs)) \
+            or num_configs.value == 0:
+        raise RuntimeError("No EGL config with an RGB888 color buffer and 24-bit depth")
+
+    surface_attribs = (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE)
+    surface = EGL.eglCreatePbufferSurface(display, config, surface_attribs)
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    egl_context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, egl_context):
+        raise RuntimeError("eglMakeCurrent failed")
+    return {'backend': 'egl', 'display': display, 'surface': surface, 'context': egl_context}
+
+def create_osmesa_context(width, height):
+    """OSMesa context rendering into a client-side buffer"""
+    from OpenGL import osmesa
+    from OpenGL import arrays
+
+    osmesa_context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    if not osmesa_context:
+        raise RuntimeError("OSMesaCreateContextExt failed")
+    buffer = arrays.GLubyteArray.zeros((height, width, 4))
+    if not osmesa.OSMesaMakeCurrent(osmesa_context, buffer, GL_UNSIGNED_BYTE, width, height):
+        raise RuntimeError("OSMesaMakeCurrent failed")
+    return {'backend': 'osmesa', 'context': osmesa_context, 'buffer': buffer}
+
+def init_headless(width=None, height=None):
+    """Create the offscreen context once; later calls reuse it"""
+    global context
+
+    if context is None:
+        width = width or game.WINDOW_WIDTH
+        height = height or game.WINDOW_HEIGHT
+        if HEADLESS_BACKEND == 'osmesa':
+            context = create_osmesa_context(width, height)
+        else:
+            context = create_egl_context(width, height)
+        game.init_gl()
+    return context
+
+def apply_state(camera=None, player_state=None):
+    """Copy a camera pose and player state into the game globals"""
+    if camera:
+        game.cam_angle_h = camera.get('angle_h', game.cam_angle_h)
+        game.cam_angle_v = camera.get('angle_v', game.cam_angle_v)
+        game.cam_dist = camera.get('dist', game.cam_dist)
+    if player_state:
+        if 'pos' in player_state:
+            game.player_pos[:] = [float(c) for c in player_state['pos']]
+        game.player_angle = player_state.get('angle', game.player_angle)
+
+def render_frame(camera=None, player_state=None, show_hud=False):
+    """Render one frame offscreen and return it as a (height, width, 3) uint8 array, top row first
+
+    camera: {'angle_h', 'angle_v', 'dist'}, player_state: {'pos': [x, y, z], 'angle'};
+    missing keys keep the current game values. The HUD needs GLUT fonts, so it is off by default.
+    """
+    init_headless()
+    apply_state(camera, player_state)
+    # Streamed scenes: draw the chunks around the player, not whatever has arrived so far
+    game.wait_for_world_chunks()
+
+    game.render_scene(show_hud)
+    glFinish()
+
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, game.WINDOW_WIDTH, game.WINDOW_HEIGHT, GL_RGB, GL_UNSIGNED_BYTE)
+    image = np.frombuffer(pixels, dtype=np.uint8).reshape(game.WINDOW_HEIGHT, game.WINDOW_WIDTH, 3)
+    return image[::-1].copy()
+
+def write_png(path, image):
+    """Write an RGB uint8 image as an 8-bit PNG"""
+    height, width, _ = image.shape
+    raw = b''.join(b'\x00' + image[row].tobytes() for row in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(chunk(b'IEND', b''))
+
+def render_batch(poses, out_dir, image_format='png'):
+    """Render each {'camera', 'player'} pose to out_dir as PNG or raw RGB; returns the file paths"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, pose in enumerate(poses):
+        image = render_frame(pose.get('camera'), pose.get('player'))
+        path = os.path.join(out_dir, f'frame_{i:05d}.{image_format}')
+        if image_format == 'png':
+            write_png(path, image)
+        else:
+            with open(path, 'wb') as f:
+                f.write(image.tobytes())
+        paths.append(path)
+    return paths
+
+def orbit_poses(count=8, angle_v=30, dist=4000):
+    """Camera poses circling the player at the start position"""
+    return [{'camera': {'angle_h': 360 * i / count, 'angle_v': angle_v, 'dist': dist}} for i in range(count)]
+
+def main():
+    """Batch-render camera poses from the command line"""
+    parser = argparse.ArgumentParser(description="Render the castle scene without a window")
+    parser.add_argument('--out', default='frames', help="output directory")
+    parser.add_argument('--poses', help="JSON list of {camera, player} poses (default: orbit)")
+    parser.add_argument('--format', choices=['png', 'rgb'], default='png')
+    args = parser.parse_args()
+
+    if args.poses:
+        with open(args.poses) as f:
+            poses = json.load(f)
+    else:
+        poses = orbit_poses()
+
+    for path in render_batch(poses, args.out, args.format):
+        print(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Replay an input log recorded with CASTLE_RECORD through the game's input handlers
+
+Usage:
+    CASTLE_RECORD=session.bin python CastleDefense.py        # play and record a session
+    python replay.py session.bin                             # as fast as possible, state checked per step
+    python replay.py session.bin --realtime --render         # at the recorded pace, drawing every frame
+    python replay.py session.bin --render --trace trace.json # profile the recorded frames
+
+Key events go through CastleDefense.apply_input_event right where they happened between
+simulation steps, so the replay takes the same fixed steps the session did, and every logged
+player and camera state is compared with the replayed one. The replay stops at the first
+mismatch unless --keep-going is given. Frames render offscreen through headless.py.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import headless
+
+STATE_FIELDS = ['player_x', 'player_y', 'player_z', 'player_angle', 'cam_angle_h', 'cam_angle_v', 'cam_dist']
+MAX_REPORTED_MISMATCHES = 20
+
+def restore_state(game, state):
+    """Set the player and camera globals from a logged state tuple"""
+    game.player_pos[:] = state[:3]
+    game.player_angle, game.cam_angle_h, game.cam_angle_v, game.cam_dist = state[3:]
+
+def check_state(game, step, expected, tolerance):
+    """Mismatch dict for the first field that drifted more than tolerance, or None"""
+    error = np.abs(np.array(game.capture_state()) - expected)
+    if error.max() <= tolerance:
+        return None
+    field = int(np.argmax(error))
+    return {'step': step, 'field': STATE_FIELDS[field], 'expected': expected[field],
+            'actual': game.capture_state()[field]}
+
+def replay(game, header, records, realtime=False, render=None, tolerance=1e-6, keep_going=False):
+    """Drive the game through logged records and return a summary
+
+    render, if given, is called for every logged frame. In real time the replay waits for each
+    input and frame record's timestamp; otherwise it runs flat out.
+    """
+    sim_dt = header['sim_dt']
+    step = 0
+    counts = {'inputs': 0, 'states': 0, 'frames': 0}
+    mismatches, frame_times, recorded_frame_ms = [], [], []
+    start = time.perf_counter()
+
+    for record in records:
+        kind, record_step = record[:2]
+        while step < record_step:
+            game.simulation_step(sim_dt)
+            step += 1
+
+        if kind == game.RECORD_STATE_KIND:
+            if counts['states'] == 0 and step == 0:
+                # Step 0 is where the session started, not something to check
+                restore_state(game, record[2:])
+            else:
+                mismatch = check_state(game, step, record[2:], tolerance)
+                if mismatch:
+                    mismatches.append(mismatch)
+                    if not keep_going:
+                        break
+            counts['states'] += 1
+            continue
+
+        if realtime:
+            delay = record[2] - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if kind == game.RECORD_FRAME_KIND:
+            counts['frames'] += 1
+            recorded_frame_ms.append(record[3])
+            if render:
+                frame_start = time.perf_counter()
+                render()
+                frame_times.append(time.perf_counter() - frame_start)
+        else:
+            counts['inputs'] += 1
+            game.apply_input_event(kind, record[3])
+
+    elapsed = time.perf_counter() - start
+    recorded = max((record[2] for record in records if record[0] != game.RECORD_STATE_KIND), default=0.0)
+    summary = dict(counts, steps=step, recorded_s=recorded, replay_s=elapsed,
+                   speedup=recorded / max(elapsed, 1e-9), mismatch_count=len(mismatches),
+                   mismatches=mismatches[:MAX_REPORTED_MISMATCHES])
+    for name, times_ms in (('recorded_frame', np.array(recorded_frame_ms)), ('frame', np.array(frame_times) * 1000)):
+        if len(times_ms):
+            summary[f'{name}_p50_ms'] = float(np.percentile(times_ms, 50))
+            summary[f'{name}_p95_ms'] = float(np.percentile(times_ms, 95))
+    return summary
+
+def main():
+    """Replay a log from the command line and print a JSON summary"""
+    parser = argparse.ArgumentParser(description="Replay a recorded input log deterministically")
+    parser.add_argument('log', help="input log written with CASTLE_RECORD=path")
+    parser.add_argument('--realtime', action='store_true', help="keep the recorded pace instead of running flat out")
+    parser.add_argument('--render', action='store_true', help="render every recorded frame offscreen")
+    parser.add_argument('--trace', help="profile the replay and write a Chrome trace here (implies --render)")
+    parser.add_argument('--tolerance', type=float, default=1e-6, help="allowed drift of any state value")
+    parser.add_argument('--keep-going', action='store_true', help="do not stop at the first mismatch")
+    parser.add_argument('--out', help="write the summary JSON here (default: stdout)")
+    args = parser.parse_args()
+
+    game = headless.game
+    header, records = game.read_input_log(args.log)
+    if header['sim_dt'] != game.SIM_DT:
+        print(f"Log was recorded at {1 / header['sim_dt']:.0f} steps/s, the game runs at {game.SIM_TICK_RATE}; "
+              f"replaying with the logged step", file=sys.stderr)
+    if os.path.abspath(game.SCENE_PATH) != header['scene']:
+        game.load_scene(header['scene'])
+
+    render = None
+    if args.render or args.trace:
+        headless.init_headless()
+
+        def render_frame():
+            game.render_scene(show_hud=False)
+            game.glFinish()
+        render = render_frame
+
+    if args.trace:
+        game.enable_profiling()
+    summary = replay(game, header, records, args.realtime, render, args.tolerance, args.keep_going)
+    if args.trace:
+        summary['trace_events'] = game.export_chrome_trace(args.trace)
+        game.disable_profiling()
+    summary = dict(log=args.log, scene=header['scene'], **summary)
+
+    report = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    if summary['mismatch_count']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
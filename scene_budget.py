@@ -0,0 +1,358 @@
+"""Per-frame cost report for the castle scene: GL calls, vertices, primitives, state changes
+and Python allocations, charged to the draw functions that issued them
+
+Usage:
+    python scene_budget.py --out budget.json                     # orbit poses, counts only
+    python scene_budget.py --tracemalloc --out budget.json       # plus allocations
+    python scene_budget.py --baseline budget.json --tolerance 0  # print changes, fail on growth
+
+No GL context is needed: every gl*/glu*/glut* function the game module calls is swapped
+for a counting stub that draws nothing, so this runs on CI boxes without a display or a
+GPU driver. Display lists are followed like benchmark.GLCounter does: whatever is recorded
+while a list compiles is charged again on every glCallList. GL counts only depend on the
+scene, the poses and the code, so two reports can be diffed between commits; allocation
+figures move a little from run to run and are never treated as regressions.
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+import CastleDefense as game
+
+# Calls that change GL state rather than submit geometry
+STATE_CHANGE_CALLS = {
+    'glColor3f', 'glPushMatrix', 'glPopMatrix', 'glTranslatef', 'glRotatef', 'glScalef',
+    'glMatrixMode', 'glLoadIdentity', 'glLineWidth', 'glEnableClientState', 'glDisableClientState',
+    'glVertexPointer', 'glColorPointer', 'glInterleavedArrays', 'glEnable', 'glDepthFunc', 'glViewport'
+}
+# Totals compared against a baseline; an increase beyond the tolerance is a regression
+BUDGET_METRICS = ['gl_calls', 'vertices', 'primitives', 'state_changes']
+TOP_ALLOCATIONS = 10
+# Stand-ins for queries the stubs have to answer (the text atlas asks for font metrics)
+STUB_GLYPH_WIDTH, STUB_GLYPH_HEIGHT = 10, 18
+PIXEL_SIZES = {'GL_RED': 1, 'GL_ALPHA': 1, 'GL_RGB': 3, 'GL_RGBA': 4}
+
+def summarize(counts):
+    """Totals and per-call counts of a Counter filled by SceneBudget"""
+    calls = {name: n for name, n in sorted(counts.items()) if name.startswith('gl')}
+    return {
+        'gl_calls': sum(calls.values()),
+        'vertices': counts['vertices'],
+        'primitives': counts['primitives'],
+        'state_changes': sum(n for name, n in calls.items() if name in STATE_CHANGE_CALLS),
+        'calls': calls
+    }
+
+class SceneBudget:
+    """Counting GL shim plus draw_* wrappers that attribute every count to a draw function
+
+    Counts land on the innermost draw function running and roll up into its callers'
+    totals when it returns. What a function records into a display list is kept apart as
+    'compiled', since it is paid on replay by whoever calls the list. Calls from other
+    threads (the world streaming builder) are stubbed but not counted, so they cannot leak
+    into the frame being measured.
+    """
+
+    def __init__(self, module, use_tracemalloc=False):
+        self.module = module
+        self.use_tracemalloc = use_tracemalloc
+        self.originals = {}
+        self.thread = threading.get_ident()
+        self.next_list = 1
+        self.lists = {}
+        self.compiling = None
+        self.begin = None
+        self.stack = []
+        self.frame = Counter()
+        self.functions = {}
+        self.top_level = set()
+        self.frame_alloc_start = 0
+        self.frame_alloc_peak = 0
+
+    def install(self):
+        source = open(self.module.__file__).read()
+        for name in sorted(set(re.findall(r'\b(glu?t?[A-Z]\w*)\s*\(', source))):
+            if callable(getattr(self.module, name, None)):
+                self.originals[name] = getattr(self.module, name)
+                setattr(self.module, name, self.stub(name))
+        for name, func in list(vars(self.module).items()):
+            if name.startswith('draw_') and callable(func) and getattr(func, '__module__', None) == self.module.__name__:
+                self.originals[name] = func
+                setattr(self.module, name, self.wrap(name, func))
+
+    def uninstall(self):
+        for name, func in self.originals.items():
+            setattr(self.module, name, func)
+        self.originals = {}
+
+    def charge(self, key, n=1):
+        if self.compiling is not None:
+            self.lists[self.compiling][key] += n
+            if self.stack:
+                self.stack[-1]['compiled_self'][key] += n
+            return
+        if self.stack:
+            self.stack[-1]['self'][key] += n
+        self.frame[key] += n
+
+    def count_call(self, name, args):
+        if name == 'glEndList':
+            self.compiling = None
+        self.charge(name)
+        if name == 'glNewList':
+            self.compiling = args[0]
+            self.lists[args[0]] = Counter()
+        elif name == 'glCallList':
+            for key, n in self.lists.get(args[0], {}).items():
+                self.charge(key, n)
+        elif name == 'glBegin':
+            self.begin = [args[0], 0]
+        elif name.startswith('glVertex') and name != 'glVertexPointer':
+            self.charge('vertices')
+            if self.begin is not None:
+                self.begin[1] += 1
+        elif name == 'glEnd' and self.begin is not None:
+            self.charge('primitives', self.module.count_primitives(*self.begin))
+            self.begin = None
+        elif name == 'glDrawArrays':
+            self.charge('vertices', args[2])
+            self.charge('primitives', self.module.count_primitives(args[0], args[2]))
+
+    def stub(self, name):
+        budget = self
+
+        def counted(*args):
+            if threading.get_ident() != budget.thread:
+                return None
+            budget.count_call(name, args)
+            if name == 'glGenLists':
+                budget.next_list += args[0]
+                return budget.next_list - args[0]
+            if name == 'glGenTextures':
+                return 1
+            if name == 'glReadPixels':
+                width, height, pixel_format = args[2], args[3], args[4]
+                return bytes(width * height * PIXEL_SIZES.get(getattr(pixel_format, 'name', ''), 4))
+            if name == 'glutBitmapWidth':
+                return STUB_GLYPH_WIDTH
+            if name == 'glutBitmapHeight':
+                return STUB_GLYPH_HEIGHT
+            return None
+
+        return counted
+
+    def fold_alloc_peak(self):
+        self.frame_alloc_peak = max(self.frame_alloc_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def wrap(self, name, func):
+        budget = self
+
+        def attributed(*args, **kwargs):
+            label = f"{name}[{args[0]['kind']}]" if name == 'draw_scene_object' else name
+            top = not budget.stack
+            if top:
+                budget.top_level.add(label)
+                if budget.use_tracemalloc:
+                    budget.fold_alloc_peak()
+                    alloc_start = tracemalloc.get_traced_memory()[0]
+            frame = {'self': Counter(), 'children': Counter(), 'compiled_self': Counter(), 'compiled': Counter()}
+            budget.stack.append(frame)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                budget.stack.pop()
+                total = frame['self'] + frame['children']
+                compiled = frame['compiled_self'] + frame['compiled']
+                if budget.stack:
+                    budget.stack[-1]['children'].update(total)
+                    budget.stack[-1]['compiled'].update(compiled)
+                entry = budget.functions.setdefault(label, {'calls': 0, 'self': Counter(), 'total': Counter(),
+                                                            'compiled': Counter()})
+                entry['calls'] += 1
+                entry['self'].update(frame['self'])
+                entry['total'].update(total)
+                entry['compiled'].update(compiled)
+                if top and budget.use_tracemalloc:
+                    current, peak = tracemalloc.get_traced_memory()
+                    entry['alloc_net_bytes'] = entry.get('alloc_net_bytes', 0) + current - alloc_start
+                    entry['alloc_peak_bytes'] = max(entry.get('alloc_peak_bytes', 0), peak - alloc_start)
+                    budget.fold_alloc_peak()
+
+        return attributed
+
+    def begin_frame(self):
+        self.frame = Counter()
+        if self.use_tracemalloc:
+            tracemalloc.reset_peak()
+            self.frame_alloc_start = self.frame_alloc_peak = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self):
+        """Summary of the frame since begin_frame"""
+        summary = summarize(self.frame)
+        if self.use_tracemalloc:
+            self.fold_alloc_peak()
+            summary['alloc_net_bytes'] = tracemalloc.get_traced_memory()[0] - self.frame_alloc_start
+            summary['alloc_peak_bytes'] = self.frame_alloc_peak - self.frame_alloc_start
+        return summary
+
+    def reset_functions(self):
+        self.functions = {}
+        self.top_level = set()
+
+    def function_report(self):
+        report = {}
+        for label, entry in sorted(self.functions.items()):
+            report[label] = dict(entry, self=summarize(entry['self']), total=summarize(entry['total']),
+                                 compiled=summarize(entry['compiled']))
+        return report
+
+def orbit_poses(count=8, angle_v=30, dist=4000):
+    """Camera poses circling the player at the start position"""
+    return [{'camera': {'angle_h': 360 * i / count, 'angle_v': angle_v, 'dist': dist}} for i in range(count)]
+
+def apply_pose(pose):
+    """Copy a headless.py style {camera, player} pose into the game globals"""
+    camera, player_state = pose.get('camera', {}), pose.get('player', {})
+    game.cam_angle_h = camera.get('angle_h', game.cam_angle_h)
+    game.cam_angle_v = camera.get('angle_v', game.cam_angle_v)
+    game.cam_dist = camera.get('dist', game.cam_dist)
+    if 'pos' in player_state:
+        game.player_pos[:] = [float(c) for c in player_state['pos']]
+    game.player_angle = player_state.get('angle', game.player_angle)
+
+def retained_allocations(before, after):
+    """Source lines holding the most memory allocated between two snapshots, minus this tool's own"""
+    ignore = [tracemalloc.Filter(False, path) for path in (__file__, tracemalloc.__file__, Counter.__init__.__code__.co_filename)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    stats.sort(key=lambda stat: (-stat.size_diff, str(stat.traceback)))
+    return [{'line': str(stat.traceback), 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+            for stat in stats[:TOP_ALLOCATIONS]]
+
+def run_budget(poses, use_tracemalloc=False, show_hud=False, baked=False, scene=None):
+    """Render every pose once through the counting shim and return the report"""
+    budget = SceneBudget(game, use_tracemalloc)
+    cache_dir = game.SCENE_CACHE_DIR
+    budget.install()
+    try:
+        if scene:
+            game.load_scene(scene)
+        if not baked:
+            # Live drawing, so the counts belong to the draw functions and not draw_baked_batches
+            game.SCENE_CACHE_DIR = None
+        if use_tracemalloc:
+            tracemalloc.start()
+        # The first frame builds the scene and compiles the display lists
+        apply_pose(poses[0])
+        game.wait_for_world_chunks()
+        budget.begin_frame()
+        game.render_scene(show_hud)
+        first_frame = budget.end_frame()
+        first_frame_functions = budget.function_report()
+        budget.reset_functions()
+        before = tracemalloc.take_snapshot() if use_tracemalloc else None
+
+        per_frame, totals = [], Counter()
+        for pose in poses:
+            apply_pose(pose)
+            game.wait_for_world_chunks()
+            budget.begin_frame()
+            game.render_scene(show_hud)
+            totals.update(budget.frame)
+            per_frame.append({key: value for key, value in budget.end_frame().items() if key != 'calls'})
+
+        report = {
+            'scene': {'source': scene or game.SCENE_PATH, 'castles': len(game.castle_configs),
+                      'objects': len(game.scene_objects), 'baked': baked,
+                      'streaming': game.world_stream['enabled']},
+            'frames': len(poses),
+            'first_frame': first_frame,
+            'first_frame_functions': first_frame_functions,
+            'frames_total': summarize(totals),
+            'per_frame': per_frame,
+            'top_level': sorted(budget.top_level),
+            'functions': budget.function_report()
+        }
+        if use_tracemalloc:
+            report['retained_allocations'] = retained_allocations(before, tracemalloc.take_snapshot())
+        return report
+    finally:
+        if use_tracemalloc:
+            tracemalloc.stop()
+        budget.uninstall()
+        game.SCENE_CACHE_DIR = cache_dir
+
+def flatten(report, prefix=''):
+    """Numeric leaves of a report as {'a.b.c': value}"""
+    values = {}
+    items = report.items() if isinstance(report, dict) else enumerate(report)
+    for key, value in items:
+        path = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            values.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def diff_reports(old, new):
+    """(path, old, new) for every numeric field that differs; missing fields count as 0"""
+    old, new = flatten(old), flatten(new)
+    return [(path, old.get(path, 0), new.get(path, 0))
+            for path in sorted(set(old) | set(new)) if old.get(path, 0) != new.get(path, 0)]
+
+def find_regressions(old, new, tolerance):
+    """Budgeted totals (whole run and per function) that grew more than tolerance"""
+    failures = []
+    sections = [('frames_total', old.get('frames_total', {}), new['frames_total'])]
+    for label, entry in new['functions'].items():
+        sections.append((f"functions.{label}.total", old.get('functions', {}).get(label, {}).get('total', {}),
+                         entry['total']))
+    for name, base, current in sections:
+        for metric in BUDGET_METRICS:
+            if metric in base and current[metric] > base[metric] * (1 + tolerance):
+                failures.append(f"{name}.{metric}: {current[metric]} > {base[metric]} + {tolerance:.0%}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="GL call, geometry and allocation budget per draw function")
+    parser.add_argument('--poses', help="JSON list of {camera, player} poses (default: orbit)")
+    parser.add_argument('--scene', help="scene file to load instead of the default scene")
+    parser.add_argument('--tracemalloc', action='store_true', help="also track Python allocations")
+    parser.add_argument('--hud', action='store_true', help="include the HUD text")
+    parser.add_argument('--baked', action='store_true', help="draw from the scene bake cache instead of live")
+    parser.add_argument('--out', help="write the report JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="report JSON to diff against")
+    parser.add_argument('--tolerance', type=float, default=0.0, help="allowed relative increase per metric")
+    args = parser.parse_args()
+
+    if args.poses:
+        with open(args.poses) as f:
+            poses = json.load(f)
+    else:
+        poses = orbit_poses()
+
+    report = run_budget(poses, args.tracemalloc, args.hud, args.baked, args.scene)
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    elif not args.baseline:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for path, old, new in diff_reports(baseline, report):
+            print(f"{path}: {old} -> {new}")
+        failures = find_regressions(baseline, report, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Vectorized wall stone-block meshes against the per-block drawing they replaced"""
+import os
+import sys
+from math import atan2, cos, radians, sin
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import CastleDefense as game
+
+WALLS = [
+    (0, 0, 2000, 0),  # along x
+    (500, -300, 500, 1700),  # along y
+    (-1200, 800, 900, -650),  # diagonal
+    (2000, 0, 0, 0),  # reversed
+    (0, 0, 1333, 77),  # length that leaves a partial block at the end
+    (0, 0, 180, 0)  # too short for a single block
+]
+
+def per_block_walls(x1, y1, x2, y2, offset_z, thickness, height, block_width, block_height, gap, block_color):
+    """The old loop: one translated, rotated draw_cube_manual_shading per block"""
+    length = ((x2 - x1)**2 + (y2 - y1)**2) ** 0.5
+    angle = atan2(y2 - y1, x2 - x1) * 180 / 3.14159
+    blocks_x = int(length / (block_width + gap))
+    blocks_z = int(height / (block_height + gap))
+    midx, midy = (x1 + x2) / 2, (y1 + y2) / 2
+
+    for row in range(blocks_z):
+        for col in range(blocks_x):
+            offset = (block_width + gap) / 2 if (row % 2 == 1) else 0
+            block_x_local = -length/2 + col * (block_width + gap) + block_width/2 + offset
+            block_z_local = row * (block_height + gap) + block_height/2
+
+            if abs(block_x_local) > length/2 - block_width/2:
+                continue
+
+            cos_a, sin_a = cos(radians(angle)), sin(radians(angle))
+            game.glPushMatrix()
+            game.glTranslatef(midx + block_x_local * cos_a, midy + block_x_local * sin_a,
+                              offset_z + block_z_local + 15)
+            game.glRotatef(angle, 0, 0, 1)
+            game.draw_cube_manual_shading(0, 0, 0, block_width, thickness + 5, block_height, block_color(row, col))
+            game.glPopMatrix()
+
+def castle_block_color(color_scheme):
+    def color(row, col):
+        variation = 0.12 * ((row + col) % 5 - 2) / 2
+        stone_color = [min(max(base + variation, 0.0), 1.0) for base in (0.85, 0.40, 0.35)]
+        return game.get_color_scheme(color_scheme, stone_color)
+    return color
+
+def perimeter_block_color(row, col):
+    variation = 0.1 * ((row + col) % 4 - 2) / 2
+    return [min(max(base + variation, 0.0), 1.0) for base in (0.75, 0.75, 0.65)]
+
+def recorded_quads(draw):
+    """Colors and vertices of the GL_QUADS draw() emits, from the bake recorder"""
+    batches = [data for mode, _, data in game.record_draw(draw) if mode == game.GL_QUADS]
+    data = np.concatenate(batches) if batches else np.zeros((0, 6), dtype=np.float32)
+    return data[:, 3:6], data[:, 0:3]
+
+def assert_same_mesh(mesh, baseline):
+    vertices, colors = mesh
+    baseline_vertices, baseline_colors = baseline
+    assert vertices.shape == baseline_vertices.shape
+    np.testing.assert_allclose(vertices, baseline_vertices, rtol=0, atol=1e-3)
+    np.testing.assert_allclose(colors, baseline_colors, rtol=0, atol=1e-6)
+
+@pytest.mark.parametrize('wall', WALLS)
+@pytest.mark.parametrize('color_scheme', ['normal', 'reddish'])
+def test_stone_blocks_match_per_block_path(wall, color_scheme):
+    mesh = game.build_stone_blocks_mesh(*wall, 40, 300, 600, color_scheme)
+    baseline = recorded_quads(lambda: per_block_walls(*wall, 40, 300, 600, 200, 100, 20,
+                                                      castle_block_color(color_scheme)))
+    assert_same_mesh(mesh, baseline)
+
+@pytest.mark.parametrize('wall', WALLS)
+def test_perimeter_stone_blocks_match_per_block_path(wall):
+    mesh = game.build_perimeter_stone_blocks_mesh(*wall, 0, game.PERIMETER_WALL_THICKNESS,
+                                                  game.PERIMETER_WALL_HEIGHT)
+    baseline = recorded_quads(lambda: per_block_walls(*wall, 0, game.PERIMETER_WALL_THICKNESS,
+                                                      game.PERIMETER_WALL_HEIGHT, 150, 80, 15, perimeter_block_color))
+    assert_same_mesh(mesh, baseline)
+
+def test_short_wall_has_no_blocks():
+    vertices, colors = game.build_stone_blocks_mesh(0, 0, 180, 0, 0, 300, 600)
+    assert len(vertices) == 0 and len(colors) == 0
@@ -0,0 +1,187 @@
+"""Seeded procedural scenes for stress-testing the renderer and collision code
+
+Usage:
+    python worldgen.py --scale 10 --out scenes/x10.json        # ~10x the stock scene
+    python worldgen.py --scale 1000 --seed 7 --out big.json
+    CASTLE_SCENE=scenes/x10.json python CastleDefense.py
+    python benchmark.py --scene scenes/x10.json
+
+--scale multiplies the castle count and the world area of the stock scene (3 castles in
+roughly 20000 x 20000 units), so densities stay the same unless overridden. The output
+is a scene file that CastleDefense.load_scene_file accepts.
+"""
+import argparse
+import json
+import random
+from math import ceil, cos, pi, sin, sqrt
+
+# Stock scene numbers the generator scales from
+BASE_CASTLES = 3
+BASE_HALF_SIZE = 10000
+CASTLE_SIZES = (1400, 2200)
+CASTLE_CLEARANCE = 600  # free ground kept around every castle
+PERIMETER_PADDING = 500
+PERIMETER_WALL_THICKNESS = 200
+COLOR_SCHEMES = ['reddish', 'normal']
+MOUNTAIN_CLUSTER_RADIUS = 1500
+MOUNTAINS_PER_CLUSTER = (5, 8)
+VEGETATION_CLEARANCE = 900
+PLACEMENT_ATTEMPTS = 30
+
+class PlacementGrid:
+    """Uniform grid of placed discs for overlap tests that only look at nearby cells"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.max_radius = 0.0
+
+    def cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, x, y, radius):
+        self.cells.setdefault(self.cell(x, y), []).append((x, y, radius))
+        self.max_radius = max(self.max_radius, radius)
+
+    def overlaps(self, x, y, radius):
+        """True if a disc at (x, y) would intersect anything placed so far"""
+        reach = int(ceil((radius + self.max_radius) / self.cell_size))
+        ci, cj = self.cell(x, y)
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach, cj + reach + 1):
+                for px, py, pr in self.cells.get((i, j), ()):
+                    if (x - px)**2 + (y - py)**2 < (radius + pr)**2:
+                        return True
+        return False
+
+def make_castle(rng, x, y):
+    """Castle config in the ranges the stock castles use"""
+    size = rng.randrange(CASTLE_SIZES[0], CASTLE_SIZES[1] + 1, 100)
+    floors = rng.randint(3, 12)
+    wall_height = rng.randrange(450, 801, 50)
+    return {
+        'position': [round(x), round(y), 0],
+        'size': size,
+        'height': max(wall_height + 150, floors * 100),
+        'roof_z': wall_height,
+        'tower_radius': rng.randrange(120, 181, 20),
+        'floors': floors,
+        'wall_thickness': rng.choice([300, 400]),
+        'wall_height': wall_height,
+        'color_scheme': rng.choice(COLOR_SCHEMES)
+    }
+
+def castle_footprint(size, walled):
+    """Radius of the ground a castle (and its perimeter wall, if any) needs"""
+    half = size / 2
+    if walled:
+        half += PERIMETER_PADDING + PERIMETER_WALL_THICKNESS
+    return half * sqrt(2) + CASTLE_CLEARANCE
+
+def random_point(rng, half_size):
+    return rng.uniform(-half_size, half_size), rng.uniform(-half_size, half_size)
+
+def generate_world(scale=1.0, seed=0, castles=None, half_size=None, walled_fraction=0.3,
+                   mountain_clusters=None, trees_per_km2=0.15, bushes_per_km2=0.25):
+    """Build a scene dict; the same arguments always give the same scene
+
+    Densities are per 1000 x 1000 units. Castles that do not fit after PLACEMENT_ATTEMPTS
+    tries are skipped, so a crowded world can come back with fewer than asked for.
+    """
+    rng = random.Random(seed)
+    castles = castles if castles is not None else max(BASE_CASTLES, round(BASE_CASTLES * scale))
+    half_size = half_size if half_size is not None else BASE_HALF_SIZE * sqrt(scale)
+    mountain_clusters = mountain_clusters if mountain_clusters is not None else max(4, round(4 * scale))
+
+    grid = PlacementGrid(castle_footprint(CASTLE_SIZES[1], True))
+    central_rock = [0, 0, 0]
+    grid.add(0, 0, 800)
+
+    castle_configs, perimeter_walls = [], []
+    for _ in range(castles):
+        walled = rng.random() < walled_fraction
+        for _ in range(PLACEMENT_ATTEMPTS):
+            x, y = random_point(rng, half_size * 0.9)
+            castle = make_castle(rng, x, y)
+            radius = castle_footprint(castle['size'], walled)
+            if not grid.overlaps(x, y, radius):
+                grid.add(x, y, radius)
+                castle_configs.append(castle)
+                if walled:
+                    reach = castle['size'] / 2 + PERIMETER_PADDING
+                    x0, y0, x1, y1 = x - reach, y - reach, x + reach, y + reach
+                    perimeter_walls += [[x0, y1, x1, y1], [x1, y1, x1, y0], [x1, y0, x0, y0], [x0, y0, x0, y1]]
+                break
+
+    # Mountains overlap each other inside a cluster but stay off the castles
+    mountains = []
+    for _ in range(mountain_clusters):
+        cx, cy = random_point(rng, half_size)
+        for _ in range(rng.randint(*MOUNTAINS_PER_CLUSTER)):
+            angle = rng.uniform(0, 2 * pi)
+            distance = rng.uniform(0, MOUNTAIN_CLUSTER_RADIUS)
+            x, y = cx + distance * cos(angle), cy + distance * sin(angle)
+            width, height, depth = rng.randint(800, 1400), rng.randint(700, 1100), rng.randint(600, 850)
+            if not grid.overlaps(x, y, max(width, depth) / 2):
+                mountains.append({'position': [round(x), round(y), 0], 'width': width,
+                                  'height': height, 'depth': depth})
+    for mountain in mountains:
+        x, y = mountain['position'][:2]
+        grid.add(x, y, max(mountain['width'], mountain['depth']) / 2)
+
+    area_km2 = (2 * half_size / 1000) ** 2
+    vegetation = {}
+    for kind, density, radius in (('trees', trees_per_km2, 150), ('bushes', bushes_per_km2, 100)):
+        points = []
+        for _ in range(round(density * area_km2)):
+            x, y = random_point(rng, half_size)
+            if not grid.overlaps(x, y, radius):
+                points.append([round(x), round(y)])
+        vegetation[kind] = points
+
+    return {
+        'castles': castle_configs,
+        'central_rock': central_rock,
+        # GRID_LENGTH * 20 is the ground's half size
+        'grid_length': int(ceil(half_size * 1.1 / 20)),
+        'perimeter_walls': perimeter_walls,
+        'mountains': mountains,
+        'vegetation': dict(vegetation, clearance=VEGETATION_CLEARANCE)
+    }
+
+def describe(scene):
+    """Object counts for a generated scene"""
+    return {
+        'castles': len(scene['castles']),
+        'perimeter_walls': len(scene['perimeter_walls']),
+        'mountains': len(scene['mountains']),
+        'trees': len(scene['vegetation']['trees']),
+        'bushes': len(scene['vegetation']['bushes']),
+        'half_size': scene['grid_length'] * 20
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded castle scene")
+    parser.add_argument('--scale', type=float, default=10, help="multiple of the stock castle count and area")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--castles', type=int, help="castle count (default: 3 * scale)")
+    parser.add_argument('--half-size', type=float, help="half width of the world in units")
+    parser.add_argument('--walled', type=float, default=0.3, help="fraction of castles with a perimeter wall")
+    parser.add_argument('--mountain-clusters', type=int)
+    parser.add_argument('--trees', type=float, default=0.15, help="trees per 1000 x 1000 units")
+    parser.add_argument('--bushes', type=float, default=0.25, help="bushes per 1000 x 1000 units")
+    parser.add_argument('--out', help="scene file to write (default: stdout)")
+    args = parser.parse_args()
+
+    scene = generate_world(args.scale, args.seed, args.castles, args.half_size, args.walled,
+                           args.mountain_clusters, args.trees, args.bushes)
+    text = json.dumps(scene, indent=1)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+        print(json.dumps(describe(scene)))
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()